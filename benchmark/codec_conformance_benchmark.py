@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Checks the compiled dacp codec against the pure python implementation & measures the
+speed up.  Random & mutated responses are decoded every way the daemon decodes them,
+by both implementations, & the element trees or errors compared.  Encoding is compared
+the same way.  A 10 MB listing is then decoded & encoded by each.  Build the codec
+first, then run directly:
+
+    cd src && python build_dacp_codec.py build_ext --inplace && cd ..
+    python benchmark/codec_conformance_benchmark.py [--seed N] [--cases N] [--min-speedup N]
+
+Exits with status 1 if the codec is not built, on any difference, or if the listing
+decode speed up is below the minimum.
+'''
+
+import optparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dacp_serialisation
+import dacp_emulator
+import parser_fuzz_benchmark
+
+DEFAULT_CASES = 2000
+# the items of a listing of about 10 MB
+LISTING_ITEMS = 88000
+THROUGHPUT_REPEAT = 3
+# length fields that wrap negative when added to an offset in a signed 32 bit integer
+HOSTILE_LENGTHS = (2 ** 31 - 1, 2 ** 31, 2 ** 32 - 1)
+
+def using(codec, function, *args):
+    '''
+    Call the function with dacp_serialisation using the supplied codec, None for the
+    pure python implementation
+    '''
+    selected = dacp_serialisation.native
+    dacp_serialisation.native = codec
+    try:
+        return function(*args)
+    finally:
+        dacp_serialisation.native = selected
+
+def describe(element):
+    '''
+    A comparable description of an element tree, including the class & content types
+    '''
+    if element is None:
+        return None
+    if isinstance(element, (dacp_serialisation.parent_element, dacp_serialisation.lazy_parent_element)):
+        return ("parent", element.name, [describe(child) for child in element.children])
+    return (type(element).__name__, element.name, type(element.content).__name__, element.content, getattr(element, "type", None))
+
+def describe_table(table):
+    return sorted([(tag, table.column(tag)) for tag in table.tags()])
+
+def outcome(function):
+    '''
+    The description of the result of the function, or of the error it raised
+    '''
+    try:
+        return ("ok", function())
+    except (dacp_serialisation.parser_exception, AssertionError, ValueError, TypeError, RuntimeError), e:
+        return ("error", type(e).__name__, str(e))
+
+def decodings(rng, data):
+    '''
+    The ways the daemon decodes a response, each returning a description of the result
+    '''
+    listing = rng.choice(parser_fuzz_benchmark.PARENT_TAGS)
+    tags = rng.sample(parser_fuzz_benchmark.CONTENT_TAGS + parser_fuzz_benchmark.PARENT_TAGS, 3)
+    chunk_seed = rng.random()
+    def stream(element_parser):
+        decoder = dacp_serialisation.stream_decoder(element_parser(), emit=("mlit", "mlcl"))
+        decoded = []
+        chunks = random.Random(chunk_seed)
+        offset = 0
+        while offset < len(data):
+            size = chunks.randint(1, 4096)
+            decoded.extend([(path, describe(element)) for path, element in decoder.feed(data[offset:offset + size])])
+            offset += size
+        decoder.close()
+        return decoded
+    return [
+        ("parse", lambda: describe(dacp_serialisation.parser().parse(data, assert_status=False, allow_null=True))),
+        ("parse with status", lambda: describe(dacp_serialisation.parser().parse(data))),
+        ("lazy parse", lambda: describe(dacp_serialisation.parser().parse(data, assert_status=False, lazy=True))),
+        ("hardened parse", lambda: describe(parser_fuzz_benchmark.hardened_parser().parse(data, assert_status=False))),
+        ("hardened lazy parse", lambda: describe(parser_fuzz_benchmark.hardened_parser().parse(data, assert_status=False, lazy=True))),
+        ("parse listing", lambda: describe_table(parser_fuzz_benchmark.hardened_parser().parse_listing(data, listing=listing, assert_status=False))),
+        ("find", lambda: sorted([(tag, describe(element)) for tag, element in parser_fuzz_benchmark.hardened_parser().find(data, tags).items()])),
+        ("stream decode", lambda: stream(dacp_serialisation.parser)),
+        ("hardened stream decode", lambda: stream(parser_fuzz_benchmark.hardened_parser))]
+
+def compare(case_seed, data):
+    '''
+    Decode the data with both implementations, returning the descriptions of any differences
+    '''
+    differences = []
+    python_decodings = decodings(random.Random(case_seed), data)
+    native_decodings = decodings(random.Random(case_seed), data)
+    for (name, python_decode), (native_name, native_decode) in zip(python_decodings, native_decodings):
+        expected = using(None, outcome, python_decode)
+        actual = outcome(native_decode)
+        if expected != actual:
+            differences.append("%s: python %s, native %s" % (name, repr(expected)[:200], repr(actual)[:200]))
+    return differences
+
+def check_conformance(seed, cases):
+    '''
+    Compare the implementations on random, mutated & hostile responses & on encoding,
+    returning the number of differences
+    '''
+    failures = 0
+    started = time.time()
+    for case in range(cases):
+        case_seed = seed + case
+        rng = random.Random(case_seed)
+        tree = parser_fuzz_benchmark.tree_generator(rng).response(rng.randint(1, 10), rng.randint(0, 10))
+        data = using(None, tree.get_bytes)
+        if tree.get_bytes() != data:
+            failures += 1
+            print "  FAIL seed %d: encode differs" % case_seed
+        lazy = dacp_serialisation.parser().parse(data, lazy=True)
+        if dacp_serialisation.encode(lazy.assert_child(tree.children[1].name)) != using(None, tree.children[1].get_bytes):
+            failures += 1
+            print "  FAIL seed %d: encode of a lazy parent differs" % case_seed
+        mutated = data
+        for i in range(rng.randint(1, 3)):
+            mutated = parser_fuzz_benchmark.mutate(rng, mutated)
+        for name, candidate in (("valid", data), ("mutated", mutated)):
+            for difference in compare(case_seed, candidate):
+                failures += 1
+                print "  FAIL seed %d %s: %s" % (case_seed, name, difference)
+    print "compared %d random & mutated responses in %.1f seconds: %d differences" % (cases, time.time() - started, failures)
+    return failures
+
+def check_lengths():
+    '''
+    Compare the implementations on elements whose length fields are too large for a signed
+    32 bit offset, returning the number of differences
+    '''
+    failures = 0
+    header = dacp_serialisation.HEADER
+    for length in HOSTILE_LENGTHS:
+        leaf = header.pack("minm", length) + "abc"
+        for data in (header.pack("apso", len(leaf)) + leaf, header.pack("apso", 8 + len(leaf)) + header.pack("mlcl", len(leaf)) + leaf):
+            for difference in compare(length, data):
+                failures += 1
+                print "  FAIL length %d: %s" % (length, difference)
+    print "compared %d oversized element lengths: %d differences" % (len(HOSTILE_LENGTHS), failures)
+    return failures
+
+def best_of(repeat, function, *args):
+    return parser_fuzz_benchmark.best_of(repeat, function, *args)
+
+def measure_speedup():
+    '''
+    Time each implementation decoding & encoding a 10 MB listing, returning the full
+    decode speed up
+    '''
+    listing = dacp_emulator.make_listing("apso", LISTING_ITEMS)
+    data = listing.get_bytes()
+    megabytes = len(data) / (1024.0 * 1024.0)
+    hardened = dacp_serialisation.DEFAULT_LIMITS
+    measurements = [
+        ("parse", lambda: dacp_serialisation.parser().parse(data)),
+        ("hardened parse", lambda: dacp_serialisation.parser(hardened).parse(data)),
+        ("parse listing", lambda: dacp_serialisation.parser(hardened).parse_listing(data)),
+        ("lazy index", lambda: dacp_serialisation.parser().parse(data, lazy=True).assert_child("mlcl").assert_child("mlit")),
+        ("encode", lambda: dacp_serialisation.encode(listing))]
+    print "%.1f MB listing of %d items:" % (megabytes, LISTING_ITEMS)
+    print "  %-16s %12s %12s %10s" % ("", "python MB/s", "native MB/s", "speed up")
+    speedups = {}
+    for name, function in measurements:
+        python_time = using(None, best_of, THROUGHPUT_REPEAT, function)
+        native_time = best_of(THROUGHPUT_REPEAT, function)
+        speedups[name] = python_time / native_time
+        print "  %-16s %12.1f %12.1f %9.1fx" % (name, megabytes / python_time, megabytes / native_time, python_time / native_time)
+    return speedups["parse"]
+
+if __name__ == "__main__":
+    options = optparse.OptionParser(usage="%prog [options]")
+    options.add_option("--seed", type="int", default=0, help="the seed of the first case")
+    options.add_option("--cases", type="int", default=DEFAULT_CASES, help="the number of random responses compared")
+    options.add_option("--min-speedup", type="float", default=0, help="fail if the listing parse is not this many times faster")
+    options, args = options.parse_args()
+    
+    if dacp_serialisation.native is None:
+        print "the compiled codec is not built, or %s is set" % dacp_serialisation.PURE_PYTHON_VARIABLE
+        sys.exit(1)
+    failures = check_conformance(options.seed, options.cases)
+    failures += check_lengths()
+    speedup = measure_speedup()
+    if speedup < options.min_speedup:
+        print "parse speed up %.1fx is below the minimum of %.1fx" % (speedup, options.min_speedup)
+        failures += 1
+    if failures > 0:
+        sys.exit(1)
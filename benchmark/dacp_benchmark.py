@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Benchmarks for the dacp serialisation module.  Run directly:
+
+    python benchmark/dacp_benchmark.py
+'''
+
+import gc
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dacp_serialisation
+import dacp_emulator
+import metrics
+import parallel_decode
+
+def make_listing(item_count):
+    '''
+    Build a synthetic library listing response: an apso element holding an mlcl 
+    with item_count mlit track entries
+    '''
+    return dacp_serialisation.encode(dacp_emulator.make_listing("apso", item_count))
+
+def best_of(repeat, function, *args):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchmark_parse_scaling():
+    '''
+    Parse listings of doubling size, a linear parser keeps the time per MB constant
+    '''
+    print "parse scaling (mlcl/mlit listings):"
+    print "  %8s %10s %10s %10s" % ("items", "MB", "seconds", "s/MB")
+    for item_count in (12500, 25000, 50000, 100000):
+        data = make_listing(item_count)
+        megabytes = len(data) / (1024.0 * 1024.0)
+        elapsed = best_of(3, dacp_serialisation.parser().parse, data)
+        print "  %8d %10.2f %10.3f %10.3f" % (item_count, megabytes, elapsed, elapsed / megabytes)
+
+def benchmark_lazy_parse():
+    '''
+    Compare reading a single field from a 10k item listing with full & lazy parsing
+    '''
+    data = make_listing(10000)
+    def read_field(lazy):
+        dacp_serialisation.parser().parse(data, lazy=lazy).assert_child("mtco").content
+    print "single field from a 10k item listing:"
+    print "  full parse: %8.4f seconds" % best_of(3, read_field, False)
+    print "  lazy parse: %8.4f seconds" % best_of(3, read_field, True)
+
+def benchmark_stream_decode():
+    '''
+    Feed a 100k item listing to the stream decoder in 16k chunks, reporting the time to 
+    the first item and the largest amount of data buffered
+    '''
+    data = make_listing(100000)
+    decoder = dacp_serialisation.stream_decoder()
+    start = time.time()
+    first_item = None
+    items = 0
+    buffered = 0
+    for offset in range(0, len(data), 16384):
+        for path, element in decoder.feed(data[offset:offset + 16384]):
+            if first_item is None:
+                first_item = time.time() - start
+            items = items + 1
+        buffered = max(buffered, len(decoder.buffer))
+    decoder.close()
+    elapsed = time.time() - start
+    print "stream decode of a %.2f MB listing in 16k chunks:" % (len(data) / (1024.0 * 1024.0))
+    print "  elements: %d, first after %.4f seconds, all after %.3f seconds" % (items, first_item, elapsed)
+    print "  largest buffer: %d bytes" % buffered
+
+def benchmark_per_element():
+    '''
+    Time encoding & decoding a synthetic response of 50k elements, per element
+    '''
+    data = make_listing(6250)
+    response = dacp_serialisation.parser().parse(data)
+    element_count = 6250 * 8 + 6
+    print "per element cost on a %d element response:" % element_count
+    elapsed = best_of(3, response.get_bytes)
+    print "  encode: %8.3f microseconds" % (elapsed * 1000000 / element_count)
+    elapsed = best_of(3, dacp_serialisation.parser().parse, data)
+    print "  decode: %8.3f microseconds" % (elapsed * 1000000 / element_count)
+
+def benchmark_nested_encode():
+    '''
+    Encode trees of increasing depth, each level holding a 4k string.  Encoding into a 
+    single buffer keeps the time per level constant
+    '''
+    print "nested encode:"
+    print "  %8s %10s %14s" % ("depth", "seconds", "ms/level")
+    for depth in (100, 200, 400, 800):
+        element = dacp_serialisation.string_content_element("minm", "x" * 4096)
+        for level in range(depth):
+            element = dacp_serialisation.parent_element("mlit", [dacp_serialisation.string_content_element("minm", "x" * 4096), element])
+        elapsed = best_of(3, element.get_bytes)
+        print "  %8d %10.4f %14.4f" % (depth, elapsed, elapsed * 1000 / depth)
+
+def element_memory(element):
+    '''
+    The memory held by an element tree, not counting the shared name strings
+    '''
+    size = sys.getsizeof(element)
+    if hasattr(element, "__dict__"):
+        size += sys.getsizeof(element.__dict__)
+        for value in element.__dict__.values():
+            if isinstance(value, dict):
+                size += sys.getsizeof(value)
+    size += sys.getsizeof(element.content if hasattr(element, "content") else element.children)
+    for child in getattr(element, "children", ()):
+        size += element_memory(child)
+    return size
+
+def benchmark_element_memory():
+    '''
+    Report the memory used per element of a parsed 100k track listing
+    '''
+    data = make_listing(100000)
+    gc.collect()
+    response = dacp_serialisation.parser().parse(data)
+    element_count = 100000 * 8 + 6
+    print "memory of a parsed %d element listing:" % element_count
+    print "  %.1f bytes per element" % (element_memory(response) / float(element_count))
+
+def benchmark_listing_table():
+    '''
+    Decode a 100k track listing into columns then scan & sort it
+    '''
+    data = make_listing(100000)
+    print "columnar 100k track listing:"
+    print "  decode:        %8.3f seconds" % best_of(3, dacp_serialisation.parser().parse_listing, data)
+    table = dacp_serialisation.parser().parse_listing(data)
+    print "  filter number: %8.3f seconds" % best_of(3, table.filter, "asyr", lambda year: year == 1995)
+    print "  sort number:   %8.3f seconds" % best_of(3, table.sort, "astm", True)
+    print "  sort string:   %8.3f seconds" % best_of(3, table.sort, "minm")
+    print "  slice:         %8.3f seconds" % best_of(3, table.__getitem__, slice(1000, 2000))
+
+def benchmark_partial_decode():
+    '''
+    Read the total count from a 10k item listing by a full parse, a hardened parse & a
+    find that stops once the tag has been found, then reject a hostile listing nested 
+    100k levels deep
+    '''
+    data = make_listing(10000)
+    hardened = dacp_serialisation.parser(dacp_serialisation.DEFAULT_LIMITS)
+    print "total count from a 10k item listing:"
+    print "  full parse:     %8.4f seconds" % best_of(3, lambda: dacp_serialisation.parser().parse(data).assert_child("mtco").content)
+    print "  hardened parse: %8.4f seconds" % best_of(3, lambda: hardened.parse(data).assert_child("mtco").content)
+    print "  find:           %8.6f seconds" % best_of(3, lambda: hardened.find(data, ("mstt", "mtco"))["mtco"].content)
+    leaf = dacp_serialisation.number_content_element("miid", 1, "I").get_bytes()
+    hostile = "".join([dacp_serialisation.HEADER.pack("mlit", (99999 - level) * dacp_serialisation.HEADER.size + len(leaf)) for level in range(100000)]) + leaf
+    def reject():
+        try:
+            hardened.parse(hostile, assert_status=False)
+        except dacp_serialisation.parser_exception:
+            pass
+    print "  reject 100k levels of nesting: %8.6f seconds" % best_of(3, reject)
+
+def benchmark_metrics_overhead():
+    '''
+    Parse a 50k element listing with the metrics disabled & enabled, the disabled parse
+    should cost the same as before the parser was instrumented
+    '''
+    data = make_listing(6250)
+    enabled = metrics.enabled
+    try:
+        metrics.disable()
+        disabled_time = best_of(5, dacp_serialisation.parser().parse, data)
+        metrics.enable()
+        enabled_time = best_of(5, dacp_serialisation.parser().parse, data)
+    finally:
+        metrics.enabled = enabled
+        metrics.reset()
+    print "parse metrics overhead on a %d element response:" % (6250 * 8 + 6)
+    print "  disabled: %8.4f seconds" % disabled_time
+    print "  enabled:  %8.4f seconds (%+.1f%%)" % (enabled_time, (enabled_time / disabled_time - 1) * 100)
+
+def benchmark_parallel_listing():
+    '''
+    Decode a 500k track listing into columns in this process & across pools of 2 to 8
+    processes.  The work left in the parent, finding the ranges & joining their columns,
+    is timed separately: it bounds the speed up however many cpus there are
+    '''
+    data = make_listing(500000)
+    serial_time = best_of(1, dacp_serialisation.parser().parse_listing, data)
+    print "parallel columnar 500k track listing, %d cpus:" % multiprocessing.cpu_count()
+    print "  serial:      %8.3f seconds" % serial_time
+    for processes in (2, 4, 8):
+        parallel = parallel_decode.parallel_parser(processes=processes, min_items=0)
+        parallel_time = best_of(1, parallel.parse_listing, data)
+        print "  %d processes: %8.3f seconds (%.1fx)" % (processes, parallel_time, serial_time / parallel_time)
+    
+    element_parser = dacp_serialisation.parser()
+    def find_ranges():
+        items = element_parser.parse(data, lazy=True).assert_child("mlcl")
+        return parallel._ranges(list(element_parser._walk(items.view, items.start, items.end)))
+    ranges = find_ranges()
+    parallel_decode._start_worker(data, None)
+    try:
+        decoded = [parallel_decode._decode_range(item_range) for item_range in ranges]
+    finally:
+        gc.enable()
+    parent_time = best_of(1, find_ranges) + best_of(1, lambda: element_parser._table(*parallel._join(decoded)))
+    print "  parent work: %8.3f seconds (%.0f%% of serial), the speed up at 8 cpus is at most %.1fx" % (parent_time, 100 * parent_time / serial_time, serial_time / (parent_time + (serial_time - parent_time) / 8))
+
+if __name__ == "__main__":
+    benchmark_parse_scaling()
+    benchmark_lazy_parse()
+    benchmark_stream_decode()
+    benchmark_per_element()
+    benchmark_nested_encode()
+    benchmark_element_memory()
+    benchmark_listing_table()
+    benchmark_partial_decode()
+    benchmark_metrics_overhead()
+    benchmark_parallel_listing()
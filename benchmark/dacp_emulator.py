@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+A local stand in for an itunes dacp service, for benchmarking & load testing without 
+itunes.  Serves login, the playstatusupdate long poll, the play/pause, pause, next & 
+previous commands, the library update & database requests and a synthetic library 
+listing.  Run directly to serve on a port:
+
+    python benchmark/dacp_emulator.py [port] [library size]
+'''
+
+import BaseHTTPServer
+import SocketServer
+import cgi
+import os
+import sys
+import threading
+import time
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dacp_serialisation
+
+PLAY_STATUS_STOPPED = 2
+PLAY_STATUS_PAUSED = 3
+PLAY_STATUS_PLAYING = 4
+
+# the longest a status update is held before returning the unchanged status
+LONG_POLL_TIMEOUT = 30
+
+class emulator_state():
+    '''
+    The player state shared by all the connections to the emulator.  Every change 
+    increments the revision number & wakes the waiting status updates
+    item_count - the number of tracks in the synthetic library
+    command_delay - the seconds each control command takes, to stand in for a slow or distant library
+    '''
+    
+    def __init__(self, item_count, command_delay = 0):
+        self.item_count = item_count
+        self.command_delay = command_delay
+        # itunes answers revision 1 at once with the current status, so real revisions start above it
+        self.revision = 2
+        self.play_status = PLAY_STATUS_PAUSED
+        self.track = 0
+        self.sessions = 0
+        self.running = True
+        self.condition = threading.Condition()
+        self.listing = None
+        self.library_revision = 1
+        
+    def login(self):
+        self.condition.acquire()
+        try:
+            self.sessions += 1
+            return self.sessions
+        finally:
+            self.condition.release()
+            
+    def change(self, play_status = None, skip = 0):
+        if self.command_delay:
+            time.sleep(self.command_delay)
+        self.condition.acquire()
+        try:
+            if play_status is not None:
+                self.play_status = play_status
+            self.track = (self.track + skip) % self.item_count
+            self.revision += 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+            
+    def wait_for_change(self, revision):
+        '''
+        Wait until the revision differs from the supplied revision, returning a status element
+        '''
+        self.condition.acquire()
+        try:
+            if revision == self.revision and self.running:
+                self.condition.wait(LONG_POLL_TIMEOUT)
+            return self.status_element()
+        finally:
+            self.condition.release()
+            
+    def stop(self):
+        self.condition.acquire()
+        try:
+            self.running = False
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        
+    def status_element(self):
+        elements = []
+        elements.append(dacp_serialisation.number_content_element("mstt", 200, "I"))
+        elements.append(dacp_serialisation.number_content_element("cmsr", self.revision, "I"))
+        elements.append(dacp_serialisation.number_content_element("caps", self.play_status, "B"))
+        elements.append(dacp_serialisation.number_content_element("cash", 0, "B"))
+        elements.append(dacp_serialisation.number_content_element("carp", 0, "B"))
+        if self.play_status != PLAY_STATUS_STOPPED:
+            elements.append(dacp_serialisation.string_content_element("cann", "Track number %d" % self.track))
+            elements.append(dacp_serialisation.string_content_element("cana", "Artist %d" % (self.track % 500)))
+            elements.append(dacp_serialisation.string_content_element("canl", "Album %d" % (self.track % 2000)))
+            elements.append(dacp_serialisation.number_content_element("asai", self.track % 2000, "Q"))
+        return dacp_serialisation.parent_element("cmst", elements)
+    
+    def listing_bytes(self):
+        '''
+        The encoded library listing, built on first use
+        '''
+        self.condition.acquire()
+        try:
+            if self.listing is None:
+                self.listing = dacp_serialisation.encode(make_listing("adbs", self.item_count))
+            return self.listing
+        finally:
+            self.condition.release()
+            
+    def delta_bytes(self, revision):
+        '''
+        The encoded changes to the library since the revision, the synthetic library never 
+        changes so the delta is empty once a client has the current revision
+        '''
+        if revision != self.library_revision:
+            return self.listing_bytes()
+        elements = []
+        elements.append(dacp_serialisation.number_content_element("mstt", 200, "I"))
+        elements.append(dacp_serialisation.number_content_element("muty", 1, "B"))
+        elements.append(dacp_serialisation.number_content_element("mtco", self.item_count, "I"))
+        elements.append(dacp_serialisation.number_content_element("mrco", 0, "I"))
+        elements.append(dacp_serialisation.parent_element("mlcl", []))
+        elements.append(dacp_serialisation.parent_element("mudl", []))
+        return dacp_serialisation.encode(dacp_serialisation.parent_element("adbs", elements))
+            
+def make_listing(name, item_count):
+    '''
+    Build a synthetic library listing holding item_count tracks
+    '''
+    items = []
+    for i in range(item_count):
+        fields = []
+        fields.append(dacp_serialisation.number_content_element("miid", i, "I"))
+        fields.append(dacp_serialisation.number_content_element("mper", i, "Q"))
+        fields.append(dacp_serialisation.string_content_element("minm", "Track number %d" % i))
+        fields.append(dacp_serialisation.string_content_element("asar", "Artist %d" % (i % 500)))
+        fields.append(dacp_serialisation.string_content_element("asal", "Album %d" % (i % 2000)))
+        fields.append(dacp_serialisation.number_content_element("astm", 180000 + i, "I"))
+        fields.append(dacp_serialisation.number_content_element("asyr", 1990 + i % 20, "H"))
+        items.append(dacp_serialisation.parent_element("mlit", fields))
+    elements = []
+    elements.append(dacp_serialisation.number_content_element("mstt", 200, "I"))
+    elements.append(dacp_serialisation.number_content_element("muty", 0, "B"))
+    elements.append(dacp_serialisation.number_content_element("mtco", item_count, "I"))
+    elements.append(dacp_serialisation.number_content_element("mrco", item_count, "I"))
+    elements.append(dacp_serialisation.parent_element("mlcl", items))
+    return dacp_serialisation.parent_element(name, elements)
+
+class emulator_request_handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serves a single keep-alive connection to the emulator
+    '''
+    protocol_version = "HTTP/1.1"
+    # buffer each response so it is sent in a single write, otherwise the separate header 
+    # writes wait on delayed acks
+    wbufsize = -1
+    
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = dict([(key, values[0]) for key, values in cgi.parse_qs(url.query).items()])
+        state = self.server.state
+        
+        if url.path == "/login":
+            elements = []
+            elements.append(dacp_serialisation.number_content_element("mstt", 200, "I"))
+            elements.append(dacp_serialisation.number_content_element("mlid", state.login(), "I"))
+            self.send_dacp(dacp_serialisation.encode(dacp_serialisation.parent_element("mlog", elements)))
+        elif url.path == "/ctrl-int/1/playstatusupdate":
+            status = state.wait_for_change(int(query.get("revision-number", "1")))
+            self.send_dacp(dacp_serialisation.encode(status))
+        elif url.path == "/ctrl-int/1/playpause":
+            if state.play_status == PLAY_STATUS_PLAYING:
+                state.change(PLAY_STATUS_PAUSED)
+            else:
+                state.change(PLAY_STATUS_PLAYING)
+            self.send_dacp(None)
+        elif url.path == "/ctrl-int/1/pause":
+            state.change(PLAY_STATUS_PAUSED)
+            self.send_dacp(None)
+        elif url.path == "/ctrl-int/1/nextitem":
+            state.change(skip=1)
+            self.send_dacp(None)
+        elif url.path == "/ctrl-int/1/previtem":
+            state.change(skip=-1)
+            self.send_dacp(None)
+        elif url.path == "/update":
+            elements = []
+            elements.append(dacp_serialisation.number_content_element("mstt", 200, "I"))
+            elements.append(dacp_serialisation.number_content_element("musr", state.library_revision, "I"))
+            self.send_dacp(dacp_serialisation.encode(dacp_serialisation.parent_element("mupd", elements)))
+        elif url.path == "/databases":
+            database = dacp_serialisation.parent_element("mlit", [dacp_serialisation.number_content_element("miid", 1, "I")])
+            elements = []
+            elements.append(dacp_serialisation.number_content_element("mstt", 200, "I"))
+            elements.append(dacp_serialisation.parent_element("mlcl", [database]))
+            self.send_dacp(dacp_serialisation.encode(dacp_serialisation.parent_element("avdb", elements)))
+        elif url.path == "/databases/1/items":
+            if query.has_key("delta"):
+                self.send_dacp(state.delta_bytes(int(query["delta"])))
+            else:
+                self.send_dacp(state.listing_bytes())
+        else:
+            self.send_error(404)
+            
+    def send_dacp(self, data):
+        '''
+        Send a dacp response, or 204 no content when data is None
+        '''
+        if data is None:
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-dmap-tagged")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        
+    def log_message(self, format, *args):
+        pass
+
+class dacp_emulator(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    The emulated dacp service, each connection is served on its own thread
+    address - the (host, port) to listen on, port 0 picks a free port
+    item_count - the number of tracks in the synthetic library
+    command_delay - the seconds each control command takes
+    '''
+    daemon_threads = True
+    
+    def __init__(self, address = ("127.0.0.1", 0), item_count = 1000, command_delay = 0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, emulator_request_handler)
+        self.state = emulator_state(item_count, command_delay)
+        
+    def start(self):
+        '''
+        Serve from a background thread, returning the port being served
+        '''
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        return self.server_address[1]
+    
+    def stop(self):
+        self.state.stop()
+        self.shutdown()
+        self.server_close()
+
+if __name__ == "__main__":
+    port = 3689
+    item_count = 1000
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        item_count = int(sys.argv[2])
+    emulator = dacp_emulator(("0.0.0.0", port), item_count)
+    print "dacp emulator serving %d tracks on port %d" % (item_count, port)
+    emulator.serve_forever()
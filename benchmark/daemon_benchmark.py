@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Runs the headless remote_daemon against the local emulator, with no display, avahi or
+gconf, and reports its processor & memory footprint.  Commands are sent through the
+selected service & timed until the status update they cause reaches a subscriber.  
+A group of slow libraries is then paused one at a time & by a single broadcast.  
+Run directly:
+
+    python benchmark/daemon_benchmark.py [commands] [libraries]
+'''
+
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import gobject
+import remote_daemon
+import dacp_emulator
+
+SERVICE_ID = "0000000000000001"
+PAIRING_GUID = "0000000000000001"
+EVENT_TIMEOUT = 10
+IDLE_SECONDS = 5
+# the time each library in the group takes to carry out a command
+LIBRARY_DELAY = 0.05
+GROUP_TIMEOUT = 500 # milliseconds
+
+class memory_pairings():
+    '''
+    A pairing store holding the emulator's pairing, so gconf is not needed
+    '''
+    
+    def __init__(self, pairings):
+        self.pairings = pairings
+    
+    def get(self, service_id):
+        return self.pairings.get(service_id)
+    
+    def set(self, service_id, pairing_guid):
+        self.pairings[service_id] = pairing_guid
+
+class event_counter():
+
+    def __init__(self):
+        self.counts = {}
+    
+    def event(self, event, service, data):
+        self.counts[event] = self.counts.get(event, 0) + 1
+    
+    def count(self, event):
+        return self.counts.get(event, 0)
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def run_until(condition, timeout = EVENT_TIMEOUT):
+    context = gobject.main_context_default()
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise Exception("timed out waiting for the daemon")
+        context.iteration(True)
+
+def run_for(seconds):
+    context = gobject.main_context_default()
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        context.iteration(True)
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def benchmark_daemon(command_count):
+    emulator = dacp_emulator.dacp_emulator(item_count=1000)
+    port = emulator.start()
+    directory = tempfile.mkdtemp()
+    counter = event_counter()
+    daemon = remote_daemon.remote_daemon(pairings=memory_pairings({SERVICE_ID: PAIRING_GUID}), auto_select=True,
+                                         socket_path=os.path.join(directory, "control.sock"), pipe_name=os.path.join(directory, "control"),
+                                         cache_dir=directory)
+    try:
+        daemon.subscribe(counter.event)
+        daemon.start()
+        print "footprint at start: " + daemon.footprint()
+        
+        daemon.add_service(SERVICE_ID, "emulator", "127.0.0.1", port)
+        run_until(lambda: counter.count(remote_daemon.STATUS_CHANGED) > 0)
+        service = daemon.selected
+        
+        latencies = []
+        started_cpu = cpu_time()
+        for i in range(command_count):
+            changes = counter.count(remote_daemon.STATUS_CHANGED)
+            started = time.time()
+            service.next_track()
+            run_until(lambda: counter.count(remote_daemon.STATUS_CHANGED) > changes)
+            latencies.append(time.time() - started)
+        used_cpu = cpu_time() - started_cpu
+        print "command to status event: median %.3f ms, 95%% %.3f ms over %d commands" % (percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, command_count)
+        print "cpu per command & status update: %.3f ms" % (used_cpu * 1000 / command_count)
+        
+        started_cpu = cpu_time()
+        run_for(IDLE_SECONDS)
+        print "cpu while idle on the long poll: %.3f ms over %d s" % ((cpu_time() - started_cpu) * 1000, IDLE_SECONDS)
+        print "footprint at end: " + daemon.footprint()
+    finally:
+        daemon.stop()
+        emulator.stop()
+        shutil.rmtree(directory)
+
+def pause_one_at_a_time(services):
+    replies = []
+    for service in services:
+        service.pause(replies.append)
+        run_until(lambda: len(replies) == services.index(service) + 1)
+    return replies
+
+def pause_group(group):
+    replies = []
+    group.broadcast("pause", replies.append)
+    run_until(lambda: len(replies) == 1)
+    return replies[0]
+
+def benchmark_group_broadcast(library_count):
+    emulators = [dacp_emulator.dacp_emulator(item_count=100, command_delay=LIBRARY_DELAY) for i in range(library_count)]
+    # one extra library which never answers within the timeout
+    emulators.append(dacp_emulator.dacp_emulator(item_count=100, command_delay=GROUP_TIMEOUT * 4 / 1000.0))
+    service_ids = ["%016X" % (i + 1) for i in range(len(emulators))]
+    directory = tempfile.mkdtemp()
+    daemon = remote_daemon.remote_daemon(pairings=memory_pairings(dict([(service_id, PAIRING_GUID) for service_id in service_ids])),
+                                         socket_path=os.path.join(directory, "control.sock"), pipe_name=os.path.join(directory, "control"),
+                                         cache_dir=directory)
+    try:
+        daemon.start()
+        daemon.group.timeout = GROUP_TIMEOUT
+        for service_id, emulator in zip(service_ids, emulators):
+            daemon.add_service(service_id, "emulator", "127.0.0.1", emulator.start())
+        daemon.group.add_all()
+        daemon.group.remove(service_ids[-1])
+        services = [daemon.services[service_id] for service_id in service_ids]
+        run_until(lambda: None not in [service.session_id for service in services])
+        
+        started = time.time()
+        pause_one_at_a_time(services[:library_count])
+        print "pause %d libraries one at a time: %.1f ms" % (library_count, (time.time() - started) * 1000)
+        
+        started = time.time()
+        reply = pause_group(daemon.group)
+        print "pause %d libraries by broadcast: %.1f ms (%s)" % (library_count, (time.time() - started) * 1000, reply.split(":")[0])
+        
+        daemon.group.add(service_ids[-1])
+        started = time.time()
+        reply = pause_group(daemon.group)
+        print "broadcast with an unresponsive library: %.1f ms, timeout %d ms (%s)" % ((time.time() - started) * 1000, GROUP_TIMEOUT, reply.split(":")[0])
+    finally:
+        daemon.stop()
+        for emulator in emulators:
+            emulator.stop()
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    command_count = 500
+    library_count = 8
+    if len(sys.argv) > 1:
+        command_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        library_count = int(sys.argv[2])
+    benchmark_daemon(command_count)
+    benchmark_group_broadcast(library_count)
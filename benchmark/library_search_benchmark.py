@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Checks & times the search of the local library copy.  A synthetic listing is stored in
+a temporary mirror, then searched with whole & partial words as they are typed.  Run
+directly:
+
+    python benchmark/library_search_benchmark.py [items]
+
+Exits with status 1 if a search returns the wrong tracks.
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dacp_emulator
+import dacp_serialisation
+import library_mirror
+
+DEFAULT_ITEMS = 20000
+CHUNK_SIZE = 16384
+
+# searches with whole words & with the partial words typed so far
+SEARCHES = ("Track number 1234", "Tra numb 1234", "track NUM 123", "Artis 499 Albu 1499", "Art 7 Alb 7 Tr 7", "Albu 1999", "Nothing")
+
+def track_words(item_id):
+    '''
+    The words of the name, artist & album dacp_emulator.make_listing gives the track
+    '''
+    return ("track number %d artist %d album %d" % (item_id, item_id % 500, item_id % 2000)).split()
+
+def expected_tracks(text, items):
+    '''
+    The ids of the tracks having a word starting with each of the words of the text
+    '''
+    words = text.lower().split()
+    found = []
+    for item_id in range(items):
+        candidates = track_words(item_id)
+        if len([word for word in words if len([candidate for candidate in candidates if candidate.startswith(word)]) > 0]) == len(words):
+            found.append(item_id)
+    return found
+
+def chunks(decoder, data):
+    for offset in range(0, len(data), CHUNK_SIZE):
+        for item in decoder.feed(data[offset:offset + CHUNK_SIZE]):
+            yield item
+
+def make_mirror(directory, items):
+    mirror = library_mirror.library_mirror(None, os.path.join(directory, "library.db"))
+    connection = mirror._connect()
+    try:
+        # decoded in chunks as the daemon reads the listing from the socket
+        data = dacp_emulator.make_listing("adbs", items).get_bytes()
+        decoder = dacp_serialisation.stream_decoder(dacp_serialisation.parser(dacp_serialisation.DEFAULT_LIMITS))
+        mirror._apply(connection, chunks(decoder, data))
+        decoder.close()
+        connection.commit()
+    finally:
+        connection.close()
+    return mirror
+
+def check_searches(mirror, items):
+    '''
+    Run each search, returning the number returning the wrong tracks
+    '''
+    failures = 0
+    for text in SEARCHES:
+        expected = expected_tracks(text, items)
+        found = sorted([row[0] for row in mirror.search(text, limit=items)])
+        if found != expected:
+            failures += 1
+            print "  FAIL search %r found %d tracks %s, expected %d tracks %s" % (text, len(found), found[:5], len(expected), expected[:5])
+    return failures
+
+def time_searches(mirror):
+    '''
+    Time the search of each prefix of a title, as it is typed
+    '''
+    text = "Track number 1234"
+    started = time.time()
+    for length in range(1, len(text) + 1):
+        mirror.search(text[:length])
+    return (time.time() - started) / len(text)
+
+if __name__ == "__main__":
+    items = DEFAULT_ITEMS
+    if len(sys.argv) > 1:
+        items = int(sys.argv[1])
+    directory = tempfile.mkdtemp()
+    try:
+        mirror = make_mirror(directory, items)
+        print "%d track library, full text search %s:" % (items, mirror.full_text and "on" or "off")
+        failures = check_searches(mirror, items)
+        print "  %d of %d searches found the expected tracks" % (len(SEARCHES) - failures, len(SEARCHES))
+        print "  search as typed: %8.4f seconds per keystroke" % time_searches(mirror)
+    finally:
+        shutil.rmtree(directory)
+    if failures > 0:
+        sys.exit(1)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Measures the time to pair against a scripted local client standing in for itunes, with 
+other connections to the listener stalled part way through their requests.  Run directly:
+
+    python benchmark/pairing_benchmark.py
+'''
+
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import gobject
+import dacp_serialisation
+import pairing_service
+
+PAIRING_REQUEST_TEMPLATE = "GET /pair?pairingcode=%s&servicename=%s HTTP/1.1\r\nHost: 127.0.0.1:3689\r\n\r\n"
+
+class pairing_recorder():
+    '''
+    Stands in for the pairing_service, ending the main loop when pairing completes
+    '''
+    
+    def __init__(self, loop):
+        self.loop = loop
+        self.paired = None
+        
+    def complete_pairing(self, service_id, service_host, service_port, pairing_guid):
+        self.paired = (service_id, pairing_guid)
+        self.loop.quit()
+
+class scripted_client(threading.Thread):
+    '''
+    Sends a pairing request in two parts, as itunes may, and reads the response
+    '''
+    
+    def __init__(self, port, pairing_hash):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.port = port
+        self.request = PAIRING_REQUEST_TEMPLATE % (pairing_hash, "0123456789ABCDEF")
+        
+    def run(self):
+        self.start_time = time.time()
+        client = socket.create_connection(("127.0.0.1", self.port))
+        client.sendall(self.request[:20])
+        client.sendall(self.request[20:])
+        response = ""
+        while True:
+            data = client.recv(1024)
+            if not data:
+                break
+            response = response + data
+        self.elapsed = time.time() - self.start_time
+        client.close()
+        body = response[response.index("\r\n\r\n") + 4:]
+        self.pairing_guid = dacp_serialisation.parser().parse(body, assert_status=False).assert_child("cmpg").content
+
+def stalled_connections(port, count):
+    '''
+    Open connections which send a partial request and then wait
+    '''
+    connections = []
+    for i in range(count):
+        connection = socket.create_connection(("127.0.0.1", port))
+        connection.sendall("GET /pair?pairingcode=")
+        connections.append(connection)
+    return connections
+
+def benchmark_time_to_pair(pairings = 50, stalled = 5):
+    samples = []
+    for i in range(pairings):
+        loop = gobject.MainLoop()
+        recorder = pairing_recorder(loop)
+        listener = pairing_service.pairing_request_listener((1, 2, 3, 4), "127.0.0.1", recorder)
+        port = listener.bind()
+        listener.start()
+        others = stalled_connections(port, stalled)
+        client = scripted_client(port, listener.pairing_hash)
+        client.start()
+        loop.run()
+        client.join()
+        if recorder.paired[1] != client.pairing_guid:
+            raise AssertionError("client received pairing guid: " + client.pairing_guid + " not: " + recorder.paired[1])
+        samples.append(client.elapsed)
+        for connection in others:
+            connection.close()
+    samples.sort()
+    print "time to pair (%d pairings, %d stalled connections each):" % (pairings, stalled)
+    print "  median %.3f ms, worst %.3f ms" % (samples[len(samples) / 2] * 1000, samples[-1] * 1000)
+
+def benchmark_stop_listening(stalled = 5):
+    '''
+    Time from stop_listening until the stalled connections are closed
+    '''
+    listener = pairing_service.pairing_request_listener((1, 2, 3, 4), "127.0.0.1", None)
+    port = listener.bind()
+    listener.start()
+    others = stalled_connections(port, stalled)
+    # let the main loop accept the connections
+    context = gobject.main_context_default()
+    while len(listener.requests) < stalled:
+        context.iteration(True)
+    start = time.time()
+    listener.stop_listening()
+    for connection in others:
+        try:
+            connection.recv(1024)
+        except socket.error:
+            # closed with the partial request unread, so reset rather than shut down
+            pass
+        connection.close()
+    print "stop listening with %d stalled connections: %.3f ms" % (stalled, (time.time() - start) * 1000)
+
+if __name__ == "__main__":
+    benchmark_time_to_pair()
+    benchmark_stop_listening()
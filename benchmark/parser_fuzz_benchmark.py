@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Fuzzes the dacp parser & measures its throughput, as a safety net for parser changes.
+Randomly generated element trees are round tripped through get_bytes & parse, then
+mutated (truncated, corrupted, resized) to check the parser only ever fails with a
+parser_exception or AssertionError, the errors the daemon handles.  The encode & parse
+throughput of wide, deep, string heavy & number heavy trees is then measured & compared
+with a saved baseline.  Exits with status 1 on any fuzz failure or throughput regression.
+Run directly:
+
+    python benchmark/parser_fuzz_benchmark.py [--seed N] [--cases N] [--save-baseline FILE] [--baseline FILE] [--tolerance FRACTION]
+
+A failing case is reproduced by running again with the seed it reports & --cases 1.
+'''
+
+import binascii
+import json
+import optparse
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dacp_serialisation
+
+PARENT_TAGS = sorted(dacp_serialisation.PARENT_TAGS)
+STRING_TAGS = sorted(dacp_serialisation.STRING_TAGS)
+# tags which are neither parents nor strings, decoded as numbers or hex by their length
+CONTENT_TAGS = ["miid", "mper", "astm", "asyr", "caps", "cash", "carp", "mtco", "mrco", "muty", "asai", "cmsr", "mlid", "ceQa"]
+NUMBER_TYPES = sorted(dacp_serialisation.NUMBER_WIDTHS.keys())
+# content lengths which are not decoded as numbers
+HEX_LENGTHS = [length for length in range(0, 33) if not dacp_serialisation.NUMBER_TYPES_BY_WIDTH.has_key(length)]
+
+# the errors a malformed response may raise, the daemon treats both as a failed request
+EXPECTED_ERRORS = (dacp_serialisation.parser_exception, AssertionError)
+
+DEFAULT_CASES = 2000
+DEFAULT_TOLERANCE = 0.2
+THROUGHPUT_REPEAT = 5
+# the deep tree shape is nested past the default limit
+THROUGHPUT_LIMITS = dacp_serialisation.parse_limits(max_depth=64)
+# the deepest nesting of the hostile responses
+MAX_HOSTILE_DEPTH = 20000
+
+def hardened_parser():
+    return dacp_serialisation.parser(dacp_serialisation.DEFAULT_LIMITS)
+
+class tree_generator():
+    '''
+    Builds random element trees, each element's tag matches the kind of its content so
+    the parser decodes the tree back to the same elements
+    '''
+    
+    def __init__(self, rng, max_string = 64):
+        self.rng = rng
+        self.max_string = max_string
+    
+    def string(self):
+        length = self.rng.randint(0, self.max_string)
+        content = "".join([chr(self.rng.randint(0, 255)) for i in range(length)])
+        return dacp_serialisation.string_content_element(self.rng.choice(STRING_TAGS), content)
+    
+    def number(self):
+        number_type = self.rng.choice(NUMBER_TYPES)
+        value = self.rng.getrandbits(8 * dacp_serialisation.NUMBER_WIDTHS[number_type])
+        return dacp_serialisation.number_content_element(self.rng.choice(CONTENT_TAGS), value, number_type)
+    
+    def hex(self):
+        length = self.rng.choice(HEX_LENGTHS)
+        content = binascii.b2a_hex("".join([chr(self.rng.randint(0, 255)) for i in range(length)]))
+        return dacp_serialisation.hex_content_element(self.rng.choice(CONTENT_TAGS), content)
+    
+    def leaf(self):
+        kind = self.rng.random()
+        if kind < 0.4:
+            return self.number()
+        if kind < 0.8:
+            return self.string()
+        return self.hex()
+    
+    def tree(self, depth, breadth):
+        '''
+        A random parent element at most depth levels deep with up to breadth children
+        '''
+        children = []
+        for i in range(self.rng.randint(0, breadth)):
+            if depth > 1 and self.rng.random() < 0.3:
+                children.append(self.tree(depth - 1, breadth))
+            else:
+                children.append(self.leaf())
+        return dacp_serialisation.parent_element(self.rng.choice(PARENT_TAGS), children)
+    
+    def response(self, depth, breadth):
+        '''
+        A response root holding an mstt status of 200 & a random tree
+        '''
+        status = dacp_serialisation.number_content_element("mstt", 200, "I")
+        return dacp_serialisation.parent_element(self.rng.choice(PARENT_TAGS), [status, self.tree(depth, breadth)])
+
+def is_parent(element):
+    return hasattr(element, "children")
+
+def same_tree(expected, actual):
+    '''
+    Compare a generated tree with a parsed one, lazy parents are compared by their children
+    '''
+    if expected.name != actual.name or is_parent(expected) != is_parent(actual):
+        return False
+    if not is_parent(expected):
+        return type(expected) == type(actual) and expected.content == actual.content and getattr(expected, "type", None) == getattr(actual, "type", None)
+    expected_children = expected.children
+    actual_children = actual.children
+    if len(expected_children) != len(actual_children):
+        return False
+    for expected_child, actual_child in zip(expected_children, actual_children):
+        if not same_tree(expected_child, actual_child):
+            return False
+    return True
+
+def visit(element):
+    '''
+    Decode every element of a lazily parsed tree
+    '''
+    if is_parent(element):
+        for child in element.children:
+            visit(child)
+
+def mutate(rng, data):
+    '''
+    Corrupt encoded data in one of the ways a broken or hostile service might
+    '''
+    data = bytearray(data)
+    mutation = rng.randint(0, 5)
+    if mutation == 0 and len(data) > 0:
+        # truncate
+        del data[rng.randint(0, len(data) - 1):]
+    elif mutation == 1 and len(data) > 0:
+        # flip some bytes
+        for i in range(rng.randint(1, 8)):
+            data[rng.randint(0, len(data) - 1)] = rng.randint(0, 255)
+    elif mutation == 2 and len(data) >= 4:
+        # overwrite what may be a length with a small, huge or off by one value
+        offset = rng.randint(0, len(data) - 4)
+        length = rng.choice([0, 1, 7, 8, 9, len(data) - offset, len(data), 2 ** 31 - 1, 2 ** 32 - 1, rng.getrandbits(32)])
+        data[offset:offset + 4] = dacp_serialisation.NUMBER_CONTENTS["I"].pack(length % 2 ** 32)
+    elif mutation == 3:
+        # insert random bytes
+        offset = rng.randint(0, len(data))
+        data[offset:offset] = bytearray([rng.randint(0, 255) for i in range(rng.randint(1, 16))])
+    elif mutation == 4 and len(data) > 0:
+        # repeat a slice
+        start = rng.randint(0, len(data) - 1)
+        end = rng.randint(start, len(data))
+        data[end:end] = data[start:end]
+    else:
+        # append trailing data
+        data.extend(bytearray([rng.randint(0, 255) for i in range(rng.randint(1, 16))]))
+    return str(data)
+
+def first_elements(element, found = None):
+    '''
+    The first element with each name in a depth first walk of a tree
+    '''
+    if found is None:
+        found = {}
+    if not found.has_key(element.name):
+        found[element.name] = element
+    if is_parent(element):
+        for child in element.children:
+            first_elements(child, found)
+    return found
+
+def stream_decode(rng, data, element_parser = None):
+    decoder = dacp_serialisation.stream_decoder(element_parser)
+    offset = 0
+    while offset < len(data):
+        size = rng.randint(1, 4096)
+        for path, element in decoder.feed(data[offset:offset + size]):
+            pass
+        offset += size
+    decoder.close()
+
+def check_round_trip(rng):
+    '''
+    Encode a random tree & parse it back fully, lazily, incrementally & partially, with
+    & without limits, returning the description of any difference
+    '''
+    generator = tree_generator(rng)
+    expected = generator.response(rng.randint(1, 12), rng.randint(0, 12))
+    data = expected.get_bytes()
+    parsed = dacp_serialisation.parser().parse(data)
+    if not same_tree(expected, parsed):
+        return "full parse differs from the encoded tree"
+    if parsed.get_bytes() != data:
+        return "full parse re-encodes differently"
+    lazy = dacp_serialisation.parser().parse(data, lazy=True)
+    if not same_tree(expected, lazy):
+        return "lazy parse differs from the encoded tree"
+    hardened = hardened_parser().parse(data, lazy=rng.random() < 0.5)
+    if not same_tree(expected, hardened):
+        return "hardened parse differs from the encoded tree"
+    stream_decode(rng, data)
+    stream_decode(rng, data, hardened_parser())
+    first = first_elements(expected)
+    tags = rng.sample(first.keys(), rng.randint(1, len(first)))
+    found = hardened_parser().find(data, tags)
+    for tag in tags:
+        if not found.has_key(tag) or not same_tree(first[tag], found[tag]):
+            return "find did not return the first %s element" % tag
+    return None
+
+def check_mutation(rng):
+    '''
+    Parse a corrupted response every way the daemon does, returning the description of
+    any error the daemon does not handle
+    '''
+    generator = tree_generator(rng)
+    data = generator.response(rng.randint(1, 8), rng.randint(0, 8)).get_bytes()
+    for i in range(rng.randint(1, 3)):
+        data = mutate(rng, data)
+    attempts = [
+        ("parse", lambda: dacp_serialisation.parser().parse(data, assert_status=rng.random() < 0.5, allow_null=rng.random() < 0.5)),
+        ("lazy parse", lambda: visit(dacp_serialisation.parser().parse(data, assert_status=False, allow_null=False, lazy=True))),
+        ("parse listing", lambda: dacp_serialisation.parser().parse_listing(data, listing=rng.choice(PARENT_TAGS), assert_status=False)),
+        ("stream decode", lambda: stream_decode(rng, data)),
+        ("hardened parse", lambda: hardened_parser().parse(data, assert_status=rng.random() < 0.5, allow_null=rng.random() < 0.5)),
+        ("hardened lazy parse", lambda: visit(hardened_parser().parse(data, assert_status=False, lazy=True))),
+        ("hardened stream decode", lambda: stream_decode(rng, data, hardened_parser())),
+        ("find", lambda: hardened_parser().find(data, rng.sample(CONTENT_TAGS + PARENT_TAGS, 2)))]
+    for name, attempt in attempts:
+        try:
+            attempt()
+        except EXPECTED_ERRORS:
+            pass
+        except Exception, e:
+            return "%s raised %s: %s on %r" % (name, type(e).__name__, e, data[:64])
+    return None
+
+def check_nesting(rng):
+    '''
+    Parse a response nested far beyond the depth limit, which the hardened parse must
+    reject with a parser_exception rather than exhausting the stack
+    '''
+    depth = rng.randint(dacp_serialisation.MAX_DEPTH + 1, MAX_HOSTILE_DEPTH)
+    leaf = dacp_serialisation.number_content_element("miid", 1, "I").get_bytes()
+    headers = [struct.pack(">4sI", rng.choice(PARENT_TAGS), (depth - 1 - level) * dacp_serialisation.HEADER.size + len(leaf)) for level in range(depth)]
+    data = "".join(headers) + leaf
+    attempts = [
+        ("hardened parse", lambda: hardened_parser().parse(data, assert_status=False)),
+        ("hardened lazy parse", lambda: hardened_parser().parse(data, assert_status=False, lazy=True)),
+        ("hardened stream decode", lambda: stream_decode(rng, data, hardened_parser())),
+        ("find", lambda: hardened_parser().find(data, ("miid",)))]
+    for name, attempt in attempts:
+        try:
+            attempt()
+            return "%s accepted %d levels of nesting" % (name, depth)
+        except dacp_serialisation.parser_exception:
+            pass
+        except Exception, e:
+            return "%s raised %s: %s on %d levels of nesting" % (name, type(e).__name__, e, depth)
+    return None
+
+def fuzz(seed, cases):
+    '''
+    Run the round trip, mutation & nesting checks, each case seeded separately so a 
+    failure can be replayed.  Returns the number of failures
+    '''
+    failures = 0
+    started = time.time()
+    for case in range(cases):
+        for check in (check_round_trip, check_mutation, check_nesting):
+            case_seed = seed + case
+            try:
+                failure = check(random.Random(case_seed))
+            except Exception, e:
+                failure = "raised %s: %s" % (type(e).__name__, e)
+            if failure is not None:
+                failures += 1
+                print "  FAIL %s seed %d: %s" % (check.__name__, case_seed, failure)
+    print "fuzzed %d round trips, mutations & hostile nestings in %.1f seconds: %d failures" % (cases, time.time() - started, failures)
+    return failures
+
+def count_elements(element):
+    if not is_parent(element):
+        return 1
+    return 1 + sum([count_elements(child) for child in element.children])
+
+def wide_tree(rng):
+    '''
+    A listing: a single parent holding many small items
+    '''
+    generator = tree_generator(rng, max_string = 24)
+    items = [dacp_serialisation.parent_element("mlit", [generator.number(), generator.string(), generator.string(), generator.number()]) for i in range(15000)]
+    return dacp_serialisation.parent_element("apso", [dacp_serialisation.number_content_element("mstt", 200, "I"), dacp_serialisation.parent_element("mlcl", items)])
+
+def deep_tree(rng):
+    '''
+    Many chains of nested parents, each level holding a couple of leaves
+    '''
+    generator = tree_generator(rng, max_string = 24)
+    chains = []
+    for i in range(300):
+        element = generator.leaf()
+        for level in range(50):
+            element = dacp_serialisation.parent_element(rng.choice(PARENT_TAGS), [generator.leaf(), element])
+        chains.append(element)
+    return dacp_serialisation.parent_element("cmst", [dacp_serialisation.number_content_element("mstt", 200, "I")] + chains)
+
+def string_tree(rng):
+    '''
+    Few elements holding long strings
+    '''
+    generator = tree_generator(rng, max_string = 1024)
+    return dacp_serialisation.parent_element("apso", [dacp_serialisation.number_content_element("mstt", 200, "I")] + [generator.string() for i in range(3000)])
+
+def number_tree(rng):
+    '''
+    Many number elements of every width
+    '''
+    generator = tree_generator(rng)
+    return dacp_serialisation.parent_element("apso", [dacp_serialisation.number_content_element("mstt", 200, "I")] + [generator.number() for i in range(60000)])
+
+TREE_SHAPES = [("wide", wide_tree), ("deep", deep_tree), ("string-heavy", string_tree), ("number-heavy", number_tree)]
+
+def best_of(repeat, function, *args):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def measure_throughput(seed):
+    '''
+    The encode, parse & hardened parse throughput of each tree shape, in MB/s & elements/s
+    '''
+    results = {}
+    print "throughput:"
+    print "  %-14s %8s %10s %12s %12s %14s %14s" % ("shape", "MB", "elements", "encode MB/s", "parse MB/s", "parse elem/s", "hardened MB/s")
+    for shape, build in TREE_SHAPES:
+        tree = build(random.Random(seed))
+        data = tree.get_bytes()
+        elements = count_elements(tree)
+        megabytes = len(data) / (1024.0 * 1024.0)
+        encode_time = best_of(THROUGHPUT_REPEAT, tree.get_bytes)
+        parse_time = best_of(THROUGHPUT_REPEAT, dacp_serialisation.parser().parse, data)
+        hardened_time = best_of(THROUGHPUT_REPEAT, dacp_serialisation.parser(THROUGHPUT_LIMITS).parse, data)
+        results[shape] = { "encode_mb_per_second":megabytes / encode_time, "parse_mb_per_second":megabytes / parse_time, "parse_elements_per_second":elements / parse_time, "hardened_parse_mb_per_second":megabytes / hardened_time }
+        print "  %-14s %8.2f %10d %12.1f %12.1f %14.0f %14.1f" % (shape, megabytes, elements, megabytes / encode_time, megabytes / parse_time, elements / parse_time, megabytes / hardened_time)
+    return results
+
+def compare_with_baseline(results, baseline, tolerance):
+    '''
+    Report every measurement more than tolerance below its baseline, returning the number
+    of regressions
+    '''
+    regressions = 0
+    for shape, measurements in sorted(baseline.items()):
+        for measurement, expected in sorted(measurements.items()):
+            actual = results.get(shape, {}).get(measurement)
+            if actual is None:
+                continue
+            if actual < expected * (1 - tolerance):
+                regressions += 1
+                print "  REGRESSION %s %s: %.1f, baseline %.1f (%+.1f%%)" % (shape, measurement, actual, expected, (actual / expected - 1) * 100)
+    print "compared with the baseline at %d%% tolerance: %d regressions" % (tolerance * 100, regressions)
+    return regressions
+
+if __name__ == "__main__":
+    options = optparse.OptionParser(usage="%prog [options]")
+    options.add_option("--seed", type="int", default=0, help="the seed of the first fuzz case & of the throughput trees")
+    options.add_option("--cases", type="int", default=DEFAULT_CASES, help="the number of round trip & mutation cases")
+    options.add_option("--baseline", help="fail if the throughput falls below this saved baseline")
+    options.add_option("--save-baseline", help="save the measured throughput as a baseline")
+    options.add_option("--tolerance", type="float", default=DEFAULT_TOLERANCE, help="the fraction below the baseline allowed before failing")
+    options, args = options.parse_args()
+    
+    failures = fuzz(options.seed, options.cases)
+    results = measure_throughput(options.seed)
+    if options.save_baseline:
+        baseline_file = open(options.save_baseline, "w")
+        try:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        finally:
+            baseline_file.close()
+    if options.baseline:
+        baseline_file = open(options.baseline)
+        try:
+            failures += compare_with_baseline(results, json.load(baseline_file), options.tolerance)
+        finally:
+            baseline_file.close()
+    if failures > 0:
+        sys.exit(1)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Benchmarks the dacp request path against the local emulator, so no itunes is needed.  
+Run directly:
+
+    python benchmark/service_benchmark.py [library size]
+'''
+
+import httplib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dacp_connection
+import dacp_serialisation
+import dacp_emulator
+
+HEADERS = {"Viewer-Only-Client": "1"}
+LOGIN_URL = "/login?pairing-guid=0x0000000000000001"
+PLAY_STATUS_UPDATE_TEMPLATE = "/ctrl-int/1/playstatusupdate?revision-number=%d&session-id=%s"
+NEXT_ITEM_TEMPLATE = "/ctrl-int/1/nextitem?session-id=%s"
+LISTING_URL = "/databases/1/items?session-id=%s"
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def print_latency(label, samples):
+    print "  %-24s median %7.3f ms, 95%% %7.3f ms" % (label, percentile(samples, 0.5) * 1000, percentile(samples, 0.95) * 1000)
+
+def login(connections):
+    response = dacp_serialisation.parser().parse(connections.fetch(LOGIN_URL, HEADERS))
+    return response.assert_child("mlid").content
+
+def single_request(port, url):
+    '''
+    A request on its own connection, as each command was sent before the connection pool
+    '''
+    connection = httplib.HTTPConnection("127.0.0.1", port)
+    connection.request("GET", url, "", HEADERS)
+    connection.getresponse().read()
+    connection.close()
+
+def benchmark_command_latency(port, count = 500):
+    '''
+    Time the round trip of next item commands on a pooled connection & on a new 
+    connection per command
+    '''
+    connections = dacp_connection.connection_pool("127.0.0.1", port)
+    session_id = login(connections)
+    url = NEXT_ITEM_TEMPLATE % session_id
+    pooled = []
+    single = []
+    for i in range(count):
+        start = time.time()
+        dacp_serialisation.parser().parse(connections.fetch(url, HEADERS), allow_null=True)
+        pooled.append(time.time() - start)
+        start = time.time()
+        single_request(port, url)
+        single.append(time.time() - start)
+    connections.close()
+    print "command round trip (%d commands):" % count
+    print_latency("pooled connection:", pooled)
+    print_latency("connection per command:", single)
+
+class status_listener(threading.Thread):
+    '''
+    Long polls the status updates, recording the time each update arrives
+    '''
+    
+    def __init__(self, port, revision, updates):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.connections = dacp_connection.connection_pool("127.0.0.1", port, max_idle=1)
+        self.session_id = login(self.connections)
+        self.revision = revision
+        self.updates = updates
+        self.received = []
+        
+    def run(self):
+        for i in range(self.updates):
+            data = self.connections.fetch(PLAY_STATUS_UPDATE_TEMPLATE % (self.revision, self.session_id), HEADERS)
+            status = dacp_serialisation.parser().parse(data, lazy=True)
+            self.received.append(time.time())
+            self.revision = status.assert_child("cmsr").content
+
+def benchmark_status_fan_out(emulator, port, listener_count = 20, updates = 20):
+    '''
+    Time from a command until every long polling listener has received the status update
+    '''
+    listeners = [status_listener(port, emulator.state.revision, updates) for i in range(listener_count)]
+    for listener in listeners:
+        listener.start()
+    connections = dacp_connection.connection_pool("127.0.0.1", port)
+    url = NEXT_ITEM_TEMPLATE % login(connections)
+    # let the listeners settle into their long polls
+    time.sleep(0.5)
+    samples = []
+    for update in range(updates):
+        start = time.time()
+        connections.fetch(url, HEADERS)
+        while min([len(listener.received) for listener in listeners]) <= update:
+            time.sleep(0.0005)
+        samples.append(max([listener.received[update] for listener in listeners]) - start)
+    connections.close()
+    print "status update fan out (%d listeners, %d updates):" % (listener_count, updates)
+    print_latency("command to last update:", samples)
+
+def benchmark_listing_throughput(port, item_count):
+    '''
+    Fetch & decode the library listing with each of the parse modes
+    '''
+    connections = dacp_connection.connection_pool("127.0.0.1", port)
+    url = LISTING_URL % login(connections)
+    data = connections.fetch(url, HEADERS)
+    megabytes = len(data) / (1024.0 * 1024.0)
+    print "library listing of %d tracks, %.2f MB:" % (item_count, megabytes)
+    
+    def fetch_and_parse(decode):
+        start = time.time()
+        decode(connections.fetch(url, HEADERS))
+        elapsed = time.time() - start
+        return "%7.3f seconds, %6.2f MB/s" % (elapsed, megabytes / elapsed)
+    print "  fetch & parse:          " + fetch_and_parse(dacp_serialisation.parser().parse)
+    print "  fetch & lazy parse:     " + fetch_and_parse(lambda data: dacp_serialisation.parser().parse(data, lazy=True))
+    print "  fetch & columnar parse: " + fetch_and_parse(dacp_serialisation.parser().parse_listing)
+    
+    start = time.time()
+    connection, response = connections.request(url, HEADERS)
+    decoder = dacp_serialisation.stream_decoder()
+    first_item = None
+    while True:
+        chunk = response.read(16384)
+        if not chunk:
+            break
+        for path, element in decoder.feed(chunk):
+            if first_item is None:
+                first_item = time.time() - start
+    decoder.close()
+    connections.release(connection, response)
+    elapsed = time.time() - start
+    print "  stream decode:          %7.3f seconds, %6.2f MB/s, first element after %.4f seconds" % (elapsed, megabytes / elapsed, first_item)
+    connections.close()
+
+if __name__ == "__main__":
+    item_count = 20000
+    if len(sys.argv) > 1:
+        item_count = int(sys.argv[1])
+    emulator = dacp_emulator.dacp_emulator(item_count=item_count)
+    port = emulator.start()
+    benchmark_command_latency(port)
+    benchmark_status_fan_out(emulator, port)
+    benchmark_listing_throughput(port, item_count)
+    emulator.stop()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Benchmarks the applet startup.  Reports the cost of importing each module in a fresh 
+interpreter, split into the modules imported at startup & those deferred until first 
+use, then the time the applet takes to show its first indicator.  The indicator 
+timing needs a desktop session with avahi & a dacp service on the network.  Run directly:
+
+    python benchmark/startup_benchmark.py [runs]
+'''
+
+import os
+import select
+import signal
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+APPLET = os.path.join(SRC, "itunes-remote-applet.py")
+
+STARTUP_MODULES = ("gobject", "indicate", "dbus", "avahi", "gconf", "dacp_serialisation", "dacp_connection", 
+                   "control_socket", "command_scheduler", "status_model", "artwork_cache", "pairing_store", "icon_cache")
+DEFERRED_MODULES = ("gtk", "gtk.glade", "pynotify", "pairing_service", "library_mirror")
+
+IMPORT_TEMPLATE = "import sys, time; sys.path.insert(0, %r); started = time.time(); import %s; print time.time() - started"
+FIRST_INDICATOR_TIMEOUT = 30
+
+def import_time(module):
+    '''
+    Seconds to import the module & everything it imports in a fresh interpreter, or None 
+    when it can not be imported
+    '''
+    process = subprocess.Popen([sys.executable, "-c", IMPORT_TEMPLATE % (SRC, module)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        return None
+    return float(output.strip().splitlines()[-1])
+
+def best_import_time(module, runs):
+    samples = [import_time(module) for i in range(runs)]
+    if None in samples:
+        return None
+    return min(samples)
+
+def print_import_times(label, modules, runs):
+    print label
+    total = 0
+    for module in modules:
+        elapsed = best_import_time(module, runs)
+        if elapsed is None:
+            print "  %-20s unavailable" % module
+            continue
+        total += elapsed
+        print "  %-20s %8.1f ms" % (module, elapsed * 1000)
+    # shared dependencies are counted once per module so the total is an upper bound
+    print "  %-20s %8.1f ms" % ("total", total * 1000)
+
+def first_indicator_time():
+    '''
+    Start the applet & return the milliseconds it reports before the first indicator is 
+    shown, or None if it exits or times out first
+    '''
+    environment = dict(os.environ)
+    environment["ITUNES_REMOTE_STARTUP_TIMING"] = "1"
+    process = subprocess.Popen([sys.executable, APPLET], stdout=subprocess.PIPE, env=environment)
+    deadline = time.time() + FIRST_INDICATOR_TIMEOUT
+    try:
+        while time.time() < deadline:
+            readable = select.select([process.stdout], [], [], deadline - time.time())[0]
+            if not readable:
+                break
+            line = process.stdout.readline()
+            if not line:
+                break
+            if line.startswith("startup: first indicator after "):
+                return float(line.split()[4])
+        return None
+    finally:
+        if process.poll() is None:
+            os.kill(process.pid, signal.SIGINT)
+        process.wait()
+
+def benchmark_first_indicator(runs):
+    samples = []
+    for i in range(runs):
+        elapsed = first_indicator_time()
+        if elapsed is None:
+            print "time to first indicator: the applet did not show an indicator, is a desktop session & dacp service available?"
+            return
+        samples.append(elapsed)
+    print "time to first indicator: best %.1f ms, worst %.1f ms over %d runs" % (min(samples), max(samples), runs)
+
+if __name__ == "__main__":
+    runs = 5
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    print_import_times("imported at startup (best of %d):" % runs, STARTUP_MODULES, runs)
+    print_import_times("deferred until first use (best of %d):" % runs, DEFERRED_MODULES, runs)
+    benchmark_first_indicator(runs)
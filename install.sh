@@ -31,8 +31,10 @@ function force_link {
 	ln -s $source_file $link
 }
 
-if [ ! -e /usr/lib/python2.6/dist-packages ]; then
-	echo "Cannot find python 2.6 dist-packages dir: /usr/lib/python2.6/dist-packages"
+# the parser's memoryviews need python 2.7
+python_dir=/usr/lib/python2.7/dist-packages
+if [ ! -e $python_dir ]; then
+	echo "Cannot find python 2.7 dist-packages dir: $python_dir"
 	exit 200
 fi
 
@@ -46,6 +48,7 @@ install_dir=`cd $install_dir; pwd`
 echo "install dir: $install_dir"
 
 force_link $install_dir/src/itunes-remote-applet.py /usr/bin/itunes-remote-applet.py
+force_link $install_dir/src/remote_daemon.py /usr/bin/itunes-remote-daemon.py
 
 mkdir /usr/share/itunes-remote-applet
 
@@ -56,5 +59,23 @@ force_link $install_dir/resources/pairing-gui.glade /usr/share/itunes-remote-app
 
 force_link $install_dir/resources/itunes-remote-applet.desktop /usr/share/applications/itunes-remote-applet.desktop
 
-force_link $install_dir/resources/src/pairing_service.py /usr/lib/python2.6/dist-packages/pairing_service.py
-force_link $install_dir/resources/src/dacp_serialisation.py /usr/lib/python2.6/dist-packages/dacp_serialisation.py
+force_link $install_dir/src/pairing_service.py $python_dir/pairing_service.py
+force_link $install_dir/src/dacp_serialisation.py $python_dir/dacp_serialisation.py
+force_link $install_dir/src/dacp_connection.py $python_dir/dacp_connection.py
+force_link $install_dir/src/control_socket.py $python_dir/control_socket.py
+force_link $install_dir/src/command_scheduler.py $python_dir/command_scheduler.py
+force_link $install_dir/src/status_model.py $python_dir/status_model.py
+force_link $install_dir/src/artwork_cache.py $python_dir/artwork_cache.py
+force_link $install_dir/src/library_mirror.py $python_dir/library_mirror.py
+force_link $install_dir/src/pairing_store.py $python_dir/pairing_store.py
+force_link $install_dir/src/icon_cache.py $python_dir/icon_cache.py
+force_link $install_dir/src/remote_daemon.py $python_dir/remote_daemon.py
+force_link $install_dir/src/service_group.py $python_dir/service_group.py
+force_link $install_dir/src/metrics.py $python_dir/metrics.py
+
+# the compiled codec is optional, dacp_serialisation falls back to pure python without it
+if (cd $install_dir/src; python2.7 build_dacp_codec.py build_ext --inplace); then
+	force_link $install_dir/src/_dacp_codec.so $python_dir/_dacp_codec.so
+else
+	echo "Could not build the compiled dacp codec, using the pure python codec"
+fi
@@ -17,11 +17,51 @@
 #	control script for binding to keyboard shortcuts 
 
 file=/tmp/itunes-controller
+socket=/tmp/itunes-controller.sock
+
+# the exit status of the socket client when the daemon isn't listening on the socket
+not_listening=3
+
+# send the command over the control socket & print the reply, falling back to the named pipe
+# when there is no socket or it was left behind by a daemon that has exited
+function send_command {
+	if [ -S $socket ]; then
+		python -c '
+import socket, sys
+s = socket.socket(socket.AF_UNIX)
+try:
+    s.connect(sys.argv[1])
+except socket.error:
+    sys.exit(int(sys.argv[3]))
+s.sendall((sys.argv[2] + "\n").encode())
+s.shutdown(socket.SHUT_WR)
+sys.stdout.write(s.makefile().read())' $socket "$1" $not_listening
+		if [ $? -ne $not_listening ]; then
+			return
+		fi
+	fi
+	echo "$1" > $file
+}
 
 case $1 in
-	"query" ) echo query-track > $file ;;
-	"next" ) echo next-track > $file ;;
-	"prev" ) echo prev-track > $file ;;
-	"playpause" ) echo play-pause > $file ;;
-    * ) echo `basename $0` "query|next|prev|playpause" ;;
+	"query" ) send_command query-track ;;
+	"next" ) send_command next-track ;;
+	"prev" ) send_command prev-track ;;
+	"playpause" ) send_command play-pause ;;
+	"search" ) send_command "play-search ${*:2}" ;;
+	"sync" ) send_command sync-library ;;
+	"list" ) send_command list-services ;;
+	"select" ) send_command "select $2" ;;
+	"pair" ) send_command "pair $2" ;;
+	"cancel-pairing" ) send_command cancel-pairing ;;
+	"footprint" ) send_command footprint ;;
+	"pause" ) send_command pause ;;
+	"group-add" ) send_command "group-add $2" ;;
+	"group-remove" ) send_command "group-remove $2" ;;
+	"group-list" ) send_command group-list ;;
+	"group" ) send_command "group $2" ;;
+	"metrics" ) send_command metrics ;;
+	"metrics-on" ) send_command metrics-on ;;
+	"metrics-off" ) send_command metrics-off ;;
+    * ) echo `basename $0` "query|next|prev|playpause|pause|search <text>|sync|list|select <service id>|pair <service id>|cancel-pairing|footprint|group-add <service id|all>|group-remove <service id>|group-list|group <command>|metrics|metrics-on|metrics-off" ;;
 esac
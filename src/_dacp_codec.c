@@ -0,0 +1,842 @@
+/*
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+*/
+
+/*
+   The optional compiled codec of dacp_serialisation: the tag walk, the decode of whole
+   element trees including the numbers, the child index of the lazy parents & the
+   encode.  It creates instances of the pure python element classes, which are handed
+   over by configure when dacp_serialisation is imported, so the decoded trees are
+   interchangeable with those of the pure python parser.  Build with:
+
+       python build_dacp_codec.py build_ext --inplace
+*/
+
+#include <Python.h>
+#include <structmember.h>
+
+#define HEADER_SIZE 8
+
+#define KIND_CONTENT 0
+#define KIND_PARENT 1
+#define KIND_STRING 2
+
+/* the interned element names by their 4 bytes, so each name is created & classified
+   once.  A response with more distinct names than fit is decoded without the cache */
+#define NAME_CACHE_SIZE 4096
+#define NAME_CACHE_FILL 3072
+
+typedef struct {
+    PyObject *name;
+    unsigned long key;
+    int kind;
+} cached_name;
+
+static cached_name name_cache[NAME_CACHE_SIZE];
+static int name_cache_count = 0;
+
+/* the element classes & their slot offsets */
+typedef struct {
+    PyTypeObject *type;
+    Py_ssize_t name;
+    Py_ssize_t content;
+    Py_ssize_t number_type;
+} element_class;
+
+static element_class parent_class;
+static element_class string_class;
+static element_class number_class;
+static element_class hex_class;
+
+static PyObject *parser_exception = NULL;
+static PyObject *parent_tags = NULL;
+static PyObject *string_tags = NULL;
+/* the number type codes by content width */
+static PyObject *number_types[9];
+
+static const char HEX_DIGITS[] = "0123456789ABCDEF";
+
+typedef struct {
+    const unsigned char *data;
+    Py_ssize_t elements;
+    Py_ssize_t max_elements;
+    int max_depth;
+    int build;
+} decoder;
+
+static unsigned long
+read_length(const unsigned char *p)
+{
+    return ((unsigned long)p[0] << 24) | ((unsigned long)p[1] << 16) | ((unsigned long)p[2] << 8) | (unsigned long)p[3];
+}
+
+static void
+raise_parser_exception(const char *format, PyObject *args)
+{
+    PyObject *template, *message;
+    if (args == NULL)
+        return;
+    template = PyString_FromString(format);
+    if (template != NULL) {
+        message = PyString_Format(template, args);
+        if (message != NULL) {
+            PyErr_SetObject(parser_exception, message);
+            Py_DECREF(message);
+        }
+        Py_DECREF(template);
+    }
+    Py_DECREF(args);
+}
+
+/* the content length of the element whose header is at offset, or -1 with a parser_exception
+   raised if it overruns the parent ending at end.  The unsigned length is compared with the
+   space left before any offset is computed from it, a length of 2^31 or more would wrap
+   negative in the Py_ssize_t of a 32 bit build */
+static Py_ssize_t
+content_length(const unsigned char *header, Py_ssize_t offset, Py_ssize_t end)
+{
+    unsigned long length = read_length(header + 4);
+    size_t available = (size_t)(end - offset - HEADER_SIZE);
+    if ((size_t)length > available) {
+        raise_parser_exception("element %s at offset %d overruns its parent by %d bytes", Py_BuildValue("(s#nK)", header, 4, offset, (unsigned PY_LONG_LONG)length - (unsigned PY_LONG_LONG)available));
+        return -1;
+    }
+    return (Py_ssize_t)length;
+}
+
+static int
+classify(PyObject *name)
+{
+    int contained = PySet_Contains(parent_tags, name);
+    if (contained != 0)
+        return contained < 0 ? -1 : KIND_PARENT;
+    contained = PySet_Contains(string_tags, name);
+    if (contained != 0)
+        return contained < 0 ? -1 : KIND_STRING;
+    return KIND_CONTENT;
+}
+
+/* returns a new reference to the name of the element at p & sets its kind */
+static PyObject *
+element_name(const unsigned char *p, int *kind)
+{
+    unsigned long key = read_length(p);
+    size_t slot = (size_t)((key * 2654435761UL) & 0xffffffffUL) % NAME_CACHE_SIZE;
+    PyObject *name;
+    while (name_cache[slot].name != NULL) {
+        if (name_cache[slot].key == key) {
+            *kind = name_cache[slot].kind;
+            Py_INCREF(name_cache[slot].name);
+            return name_cache[slot].name;
+        }
+        slot = (slot + 1) % NAME_CACHE_SIZE;
+    }
+    name = PyString_FromStringAndSize((const char *)p, 4);
+    if (name == NULL)
+        return NULL;
+    PyString_InternInPlace(&name);
+    *kind = classify(name);
+    if (*kind < 0) {
+        Py_DECREF(name);
+        return NULL;
+    }
+    if (name_cache_count < NAME_CACHE_FILL) {
+        Py_INCREF(name);
+        name_cache[slot].name = name;
+        name_cache[slot].key = key;
+        name_cache[slot].kind = *kind;
+        name_cache_count++;
+    }
+    return name;
+}
+
+static void
+clear_name_cache(void)
+{
+    int slot;
+    for (slot = 0; slot < NAME_CACHE_SIZE; slot++)
+        Py_CLEAR(name_cache[slot].name);
+    name_cache_count = 0;
+}
+
+#define SLOT(object, offset) (*(PyObject **)((char *)(object) + (offset)))
+
+/* create an element, stealing the references to the values */
+static PyObject *
+new_element(element_class *cls, PyObject *name, PyObject *content, PyObject *number_type)
+{
+    PyObject *element;
+    if (name == NULL || content == NULL) {
+        Py_XDECREF(name);
+        Py_XDECREF(content);
+        Py_XDECREF(number_type);
+        return NULL;
+    }
+    element = cls->type->tp_alloc(cls->type, 0);
+    if (element == NULL) {
+        Py_DECREF(name);
+        Py_DECREF(content);
+        Py_XDECREF(number_type);
+        return NULL;
+    }
+    SLOT(element, cls->name) = name;
+    SLOT(element, cls->content) = content;
+    if (number_type != NULL)
+        SLOT(element, cls->number_type) = number_type;
+    return element;
+}
+
+/* the content width of a number type code, -1 if it is not one */
+static int
+number_width(PyObject *number_type)
+{
+    int width;
+    for (width = 1; width <= 8; width *= 2)
+        if (number_type == number_types[width])
+            return width;
+    if (number_type != NULL && PyString_Check(number_type) && PyString_GET_SIZE(number_type) == 1) {
+        switch (PyString_AS_STRING(number_type)[0]) {
+        case 'B': return 1;
+        case 'H': return 2;
+        case 'I': return 4;
+        case 'Q': return 8;
+        }
+    }
+    return -1;
+}
+
+static PyObject *
+decode_number(const unsigned char *p, Py_ssize_t width)
+{
+    unsigned PY_LONG_LONG value = 0;
+    Py_ssize_t i;
+    for (i = 0; i < width; i++)
+        value = (value << 8) | p[i];
+    if (value <= (unsigned PY_LONG_LONG)LONG_MAX)
+        return PyInt_FromLong((long)value);
+    return PyLong_FromUnsignedLongLong(value);
+}
+
+static PyObject *
+decode_hex(const unsigned char *p, Py_ssize_t length)
+{
+    PyObject *hex = PyString_FromStringAndSize(NULL, length * 2);
+    char *out;
+    Py_ssize_t i;
+    if (hex == NULL)
+        return NULL;
+    out = PyString_AS_STRING(hex);
+    for (i = 0; i < length; i++) {
+        out[2 * i] = HEX_DIGITS[p[i] >> 4];
+        out[2 * i + 1] = HEX_DIGITS[p[i] & 0xf];
+    }
+    return hex;
+}
+
+static int decode_range(decoder *d, Py_ssize_t offset, Py_ssize_t end, int depth, PyObject *list);
+
+/* decode the children of a parent, the interpreter's recursion limit bounds the c stack 
+   when the decoder has no depth limit of its own */
+static int
+descend(decoder *d, Py_ssize_t offset, Py_ssize_t end, int depth, PyObject *list)
+{
+    int result;
+    if (Py_EnterRecursiveCall(" while decoding a dacp response"))
+        return -1;
+    result = decode_range(d, offset, end, depth, list);
+    Py_LeaveRecursiveCall();
+    return result;
+}
+
+/* decode the elements between offset & end into the list, or only check them when
+   the decoder is not building.  depth is the depth of the elements in the range */
+static int
+decode_range(decoder *d, Py_ssize_t offset, Py_ssize_t end, int depth, PyObject *list)
+{
+    while (offset < end) {
+        const unsigned char *header = d->data + offset;
+        Py_ssize_t start, element_end, length;
+        PyObject *name, *element;
+        int kind;
+
+        if (end - offset < HEADER_SIZE) {
+            raise_parser_exception("truncated element header at offset %d", Py_BuildValue("(n)", offset));
+            return -1;
+        }
+        length = content_length(header, offset, end);
+        if (length < 0)
+            return -1;
+        start = offset + HEADER_SIZE;
+        element_end = start + length;
+        if (depth > d->max_depth) {
+            raise_parser_exception("element %s at offset %d is nested deeper than %d", Py_BuildValue("(s#ni)", header, 4, offset, d->max_depth));
+            return -1;
+        }
+        d->elements++;
+        if (d->elements > d->max_elements) {
+            raise_parser_exception("response contains more than %d elements", Py_BuildValue("(n)", d->max_elements));
+            return -1;
+        }
+
+        name = element_name(header, &kind);
+        if (name == NULL)
+            return -1;
+        if (!d->build) {
+            Py_DECREF(name);
+            if (kind == KIND_PARENT && descend(d, start, element_end, depth + 1, NULL) < 0)
+                return -1;
+            offset = element_end;
+            continue;
+        }
+        if (kind == KIND_PARENT) {
+            PyObject *children = PyList_New(0);
+            if (children == NULL) {
+                Py_DECREF(name);
+                return -1;
+            }
+            if (descend(d, start, element_end, depth + 1, children) < 0) {
+                Py_DECREF(name);
+                Py_DECREF(children);
+                return -1;
+            }
+            element = new_element(&parent_class, name, children, NULL);
+        }
+        else if (kind == KIND_STRING) {
+            element = new_element(&string_class, name, PyString_FromStringAndSize((const char *)d->data + start, length), NULL);
+        }
+        else if ((length == 1 || length == 2 || length == 4 || length == 8)) {
+            Py_INCREF(number_types[length]);
+            element = new_element(&number_class, name, decode_number(d->data + start, length), number_types[length]);
+        }
+        else {
+            element = new_element(&hex_class, name, decode_hex(d->data + start, length), NULL);
+        }
+        if (element == NULL)
+            return -1;
+        if (PyList_Append(list, element) < 0) {
+            Py_DECREF(element);
+            return -1;
+        }
+        Py_DECREF(element);
+        offset = element_end;
+    }
+    return 0;
+}
+
+static int
+check_range(Py_buffer *buffer, Py_ssize_t offset, Py_ssize_t end)
+{
+    if (offset < 0 || end > buffer->len || offset > end) {
+        PyErr_SetString(PyExc_ValueError, "range outside of the data");
+        return -1;
+    }
+    return 0;
+}
+
+static int
+check_configured(void)
+{
+    if (parser_exception == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "_dacp_codec has not been configured");
+        return -1;
+    }
+    return 0;
+}
+
+PyDoc_STRVAR(decode_doc,
+"decode(data, offset, end, depth, max_depth, max_elements) -> list\n\
+\n\
+Decode the elements between offset & end of the data into element trees.  depth is\n\
+the depth of the enclosing element, the elements deeper than max_depth or beyond\n\
+max_elements raise a parser_exception");
+
+static PyObject *
+codec_decode(PyObject *self, PyObject *args)
+{
+    Py_buffer buffer;
+    Py_ssize_t offset, end, max_elements;
+    int depth, max_depth;
+    decoder d;
+    PyObject *elements;
+    if (check_configured() < 0)
+        return NULL;
+    if (!PyArg_ParseTuple(args, "s*nniin:decode", &buffer, &offset, &end, &depth, &max_depth, &max_elements))
+        return NULL;
+    if (check_range(&buffer, offset, end) < 0) {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    elements = PyList_New(0);
+    if (elements != NULL) {
+        d.data = (const unsigned char *)buffer.buf;
+        d.elements = 0;
+        d.max_elements = max_elements;
+        d.max_depth = max_depth;
+        d.build = 1;
+        if (decode_range(&d, offset, end, depth + 1, elements) < 0)
+            Py_CLEAR(elements);
+    }
+    PyBuffer_Release(&buffer);
+    return elements;
+}
+
+PyDoc_STRVAR(check_doc,
+"check(data, offset, end, depth, max_depth, max_elements)\n\
+\n\
+Walk the elements between offset & end without decoding them, raising a\n\
+parser_exception as decode would");
+
+static PyObject *
+codec_check(PyObject *self, PyObject *args)
+{
+    Py_buffer buffer;
+    Py_ssize_t offset, end, max_elements;
+    int depth, max_depth, result;
+    decoder d;
+    if (check_configured() < 0)
+        return NULL;
+    if (!PyArg_ParseTuple(args, "s*nniin:check", &buffer, &offset, &end, &depth, &max_depth, &max_elements))
+        return NULL;
+    if (check_range(&buffer, offset, end) < 0) {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    d.data = (const unsigned char *)buffer.buf;
+    d.elements = 0;
+    d.max_elements = max_elements;
+    d.max_depth = max_depth;
+    d.build = 0;
+    /* the walk descends at most max_depth levels so the c stack is bounded */
+    result = decode_range(&d, offset, end, depth + 1, NULL);
+    PyBuffer_Release(&buffer);
+    if (result < 0)
+        return NULL;
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(walk_doc,
+"walk(data, offset, end) -> list\n\
+\n\
+The (name, content start, content end) of each element between offset & end");
+
+static PyObject *
+codec_walk(PyObject *self, PyObject *args)
+{
+    Py_buffer buffer;
+    Py_ssize_t offset, end;
+    PyObject *offsets;
+    if (check_configured() < 0)
+        return NULL;
+    if (!PyArg_ParseTuple(args, "s*nn:walk", &buffer, &offset, &end))
+        return NULL;
+    if (check_range(&buffer, offset, end) < 0) {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    offsets = PyList_New(0);
+    while (offsets != NULL && offset < end) {
+        const unsigned char *header = (const unsigned char *)buffer.buf + offset;
+        Py_ssize_t start = offset + HEADER_SIZE, element_end, length;
+        PyObject *name, *entry;
+        int kind;
+        if (end - offset < HEADER_SIZE) {
+            raise_parser_exception("truncated element header at offset %d", Py_BuildValue("(n)", offset));
+            Py_CLEAR(offsets);
+            break;
+        }
+        length = content_length(header, offset, end);
+        if (length < 0) {
+            Py_CLEAR(offsets);
+            break;
+        }
+        element_end = start + length;
+        name = element_name(header, &kind);
+        if (name == NULL) {
+            Py_CLEAR(offsets);
+            break;
+        }
+        entry = Py_BuildValue("(Nnn)", name, start, element_end);
+        if (entry == NULL || PyList_Append(offsets, entry) < 0) {
+            Py_XDECREF(entry);
+            Py_CLEAR(offsets);
+            break;
+        }
+        Py_DECREF(entry);
+        offset = element_end;
+    }
+    PyBuffer_Release(&buffer);
+    return offsets;
+}
+
+PyDoc_STRVAR(index_doc,
+"index(offsets) -> dict\n\
+\n\
+The position of the first entry with each name in a list of walk entries");
+
+static PyObject *
+codec_index(PyObject *self, PyObject *offsets)
+{
+    PyObject *index, *sequence;
+    Py_ssize_t position, count;
+    sequence = PySequence_Fast(offsets, "index requires a sequence of walk entries");
+    if (sequence == NULL)
+        return NULL;
+    index = PyDict_New();
+    count = PySequence_Fast_GET_SIZE(sequence);
+    for (position = 0; index != NULL && position < count; position++) {
+        PyObject *entry = PySequence_Fast_GET_ITEM(sequence, position);
+        PyObject *name, *value;
+        int contained;
+        if (!PyTuple_Check(entry) || PyTuple_GET_SIZE(entry) < 1) {
+            PyErr_SetString(PyExc_TypeError, "walk entries must be tuples");
+            Py_CLEAR(index);
+            break;
+        }
+        name = PyTuple_GET_ITEM(entry, 0);
+        contained = PyDict_Contains(index, name);
+        if (contained < 0) {
+            Py_CLEAR(index);
+            break;
+        }
+        if (contained)
+            continue;
+        value = PyInt_FromSsize_t(position);
+        if (value == NULL || PyDict_SetItem(index, name, value) < 0) {
+            Py_XDECREF(value);
+            Py_CLEAR(index);
+            break;
+        }
+        Py_DECREF(value);
+    }
+    Py_DECREF(sequence);
+    return index;
+}
+
+/* the encoded size of an element, -1 on error */
+static Py_ssize_t
+encoded_size(PyObject *element)
+{
+    PyTypeObject *type = Py_TYPE(element);
+    if (type == parent_class.type) {
+        PyObject *children = SLOT(element, parent_class.content), *sequence;
+        Py_ssize_t size = HEADER_SIZE, i, count;
+        if (children == NULL) {
+            PyErr_SetString(PyExc_AttributeError, "children");
+            return -1;
+        }
+        sequence = PySequence_Fast(children, "children must be a sequence");
+        if (sequence == NULL)
+            return -1;
+        if (Py_EnterRecursiveCall(" while encoding a dacp element")) {
+            Py_DECREF(sequence);
+            return -1;
+        }
+        count = PySequence_Fast_GET_SIZE(sequence);
+        for (i = 0; i < count; i++) {
+            Py_ssize_t child_size = encoded_size(PySequence_Fast_GET_ITEM(sequence, i));
+            if (child_size < 0) {
+                size = -1;
+                break;
+            }
+            size += child_size;
+        }
+        Py_LeaveRecursiveCall();
+        Py_DECREF(sequence);
+        return size;
+    }
+    if (type == string_class.type) {
+        PyObject *content = SLOT(element, string_class.content);
+        if (content == NULL || !PyString_Check(content)) {
+            PyErr_SetString(PyExc_TypeError, "string content must be a str");
+            return -1;
+        }
+        return HEADER_SIZE + PyString_GET_SIZE(content);
+    }
+    if (type == number_class.type) {
+        int width = number_width(SLOT(element, number_class.number_type));
+        if (width < 0) {
+            PyErr_SetString(PyExc_ValueError, "number type must be one of: B, H, I, Q");
+            return -1;
+        }
+        return HEADER_SIZE + width;
+    }
+    if (type == hex_class.type) {
+        PyObject *content = SLOT(element, hex_class.content);
+        if (content == NULL || !PyString_Check(content) || PyString_GET_SIZE(content) % 2 != 0) {
+            PyErr_SetString(PyExc_TypeError, "hex content must be a str of an even length");
+            return -1;
+        }
+        return HEADER_SIZE + PyString_GET_SIZE(content) / 2;
+    }
+    {
+        /* any other element, such as a lazy parent, sizes itself */
+        PyObject *size = PyObject_CallMethod(element, "get_size", NULL);
+        Py_ssize_t result;
+        if (size == NULL)
+            return -1;
+        result = PyNumber_AsSsize_t(size, PyExc_OverflowError);
+        Py_DECREF(size);
+        return result;
+    }
+}
+
+static int
+write_name(PyObject *name, unsigned char *out)
+{
+    if (name == NULL || !PyString_Check(name) || PyString_GET_SIZE(name) != 4) {
+        PyErr_SetString(PyExc_ValueError, "element names must be 4 byte strs");
+        return -1;
+    }
+    memcpy(out, PyString_AS_STRING(name), 4);
+    return 0;
+}
+
+static void
+write_length(unsigned char *out, Py_ssize_t length)
+{
+    out[0] = (unsigned char)((length >> 24) & 0xff);
+    out[1] = (unsigned char)((length >> 16) & 0xff);
+    out[2] = (unsigned char)((length >> 8) & 0xff);
+    out[3] = (unsigned char)(length & 0xff);
+}
+
+static int
+hex_value(char digit)
+{
+    if (digit >= '0' && digit <= '9')
+        return digit - '0';
+    if (digit >= 'A' && digit <= 'F')
+        return digit - 'A' + 10;
+    if (digit >= 'a' && digit <= 'f')
+        return digit - 'a' + 10;
+    return -1;
+}
+
+/* write an element at offset of the bytearray, returning the offset after it or -1 */
+static Py_ssize_t
+write_element(PyObject *element, PyObject *buffer, Py_ssize_t offset)
+{
+    PyTypeObject *type = Py_TYPE(element);
+    unsigned char *out = (unsigned char *)PyByteArray_AS_STRING(buffer) + offset;
+    if (type == parent_class.type) {
+        PyObject *sequence;
+        Py_ssize_t start = offset + HEADER_SIZE, end = start, i, count;
+        if (write_name(SLOT(element, parent_class.name), out) < 0)
+            return -1;
+        sequence = PySequence_Fast(SLOT(element, parent_class.content), "children must be a sequence");
+        if (sequence == NULL)
+            return -1;
+        count = PySequence_Fast_GET_SIZE(sequence);
+        for (i = 0; i < count && end >= 0; i++)
+            end = write_element(PySequence_Fast_GET_ITEM(sequence, i), buffer, end);
+        Py_DECREF(sequence);
+        if (end < 0)
+            return -1;
+        /* the children have been written so the content length is now known */
+        write_length((unsigned char *)PyByteArray_AS_STRING(buffer) + offset + 4, end - start);
+        return end;
+    }
+    if (type == string_class.type) {
+        PyObject *content = SLOT(element, string_class.content);
+        Py_ssize_t length = PyString_GET_SIZE(content);
+        if (write_name(SLOT(element, string_class.name), out) < 0)
+            return -1;
+        write_length(out + 4, length);
+        memcpy(out + HEADER_SIZE, PyString_AS_STRING(content), length);
+        return offset + HEADER_SIZE + length;
+    }
+    if (type == number_class.type) {
+        PyObject *content = SLOT(element, number_class.content);
+        PyObject *number_type = SLOT(element, number_class.number_type);
+        unsigned PY_LONG_LONG value;
+        int width = number_width(number_type), i;
+        if (write_name(SLOT(element, number_class.name), out) < 0)
+            return -1;
+        if (content == NULL) {
+            PyErr_SetString(PyExc_AttributeError, "content");
+            return -1;
+        }
+        if (PyInt_Check(content)) {
+            long small = PyInt_AS_LONG(content);
+            if (small < 0) {
+                PyErr_SetString(PyExc_ValueError, "number must not be negative");
+                return -1;
+            }
+            value = (unsigned PY_LONG_LONG)small;
+        }
+        else {
+            value = PyLong_AsUnsignedLongLong(content);
+            if (value == (unsigned PY_LONG_LONG)-1 && PyErr_Occurred())
+                return -1;
+        }
+        if (width < 8 && value >> (8 * width) != 0) {
+            PyErr_Format(PyExc_ValueError, "number too large for type %s", PyString_AS_STRING(number_type));
+            return -1;
+        }
+        write_length(out + 4, width);
+        for (i = width - 1; i >= 0; i--) {
+            out[HEADER_SIZE + i] = (unsigned char)(value & 0xff);
+            value >>= 8;
+        }
+        return offset + HEADER_SIZE + width;
+    }
+    if (type == hex_class.type) {
+        PyObject *content = SLOT(element, hex_class.content);
+        const char *digits = PyString_AS_STRING(content);
+        Py_ssize_t length = PyString_GET_SIZE(content) / 2, i;
+        if (write_name(SLOT(element, hex_class.name), out) < 0)
+            return -1;
+        write_length(out + 4, length);
+        for (i = 0; i < length; i++) {
+            int high = hex_value(digits[2 * i]), low = hex_value(digits[2 * i + 1]);
+            if (high < 0 || low < 0) {
+                PyErr_SetString(PyExc_ValueError, "Non-hexadecimal digit found");
+                return -1;
+            }
+            out[HEADER_SIZE + i] = (unsigned char)((high << 4) | low);
+        }
+        return offset + HEADER_SIZE + length;
+    }
+    {
+        PyObject *end = PyObject_CallMethod(element, "write_into", "On", buffer, offset);
+        Py_ssize_t result;
+        if (end == NULL)
+            return -1;
+        result = PyNumber_AsSsize_t(end, PyExc_OverflowError);
+        Py_DECREF(end);
+        return result;
+    }
+}
+
+PyDoc_STRVAR(encode_doc,
+"encode(element) -> str\n\
+\n\
+Serialise an element tree, sizing it first so it is written into a single buffer");
+
+static PyObject *
+codec_encode(PyObject *self, PyObject *element)
+{
+    Py_ssize_t size;
+    PyObject *buffer, *encoded = NULL;
+    if (check_configured() < 0)
+        return NULL;
+    size = encoded_size(element);
+    if (size < 0)
+        return NULL;
+    buffer = PyByteArray_FromStringAndSize(NULL, size);
+    if (buffer == NULL)
+        return NULL;
+    if (write_element(element, buffer, 0) >= 0)
+        encoded = PyString_FromStringAndSize(PyByteArray_AS_STRING(buffer), size);
+    Py_DECREF(buffer);
+    return encoded;
+}
+
+static int
+slot_offset(PyTypeObject *type, const char *name, Py_ssize_t *offset)
+{
+    PyObject *descriptor = PyDict_GetItemString(type->tp_dict, name);
+    PyMemberDef *member;
+    if (descriptor == NULL || Py_TYPE(descriptor) != &PyMemberDescr_Type) {
+        PyErr_Format(PyExc_TypeError, "%s has no %s slot", type->tp_name, name);
+        return -1;
+    }
+    member = ((PyMemberDescrObject *)descriptor)->d_member;
+    if (member->type != T_OBJECT_EX) {
+        PyErr_Format(PyExc_TypeError, "%s.%s is not an object slot", type->tp_name, name);
+        return -1;
+    }
+    *offset = member->offset;
+    return 0;
+}
+
+static int
+configure_class(element_class *cls, PyObject *type, const char *content_slot, int number)
+{
+    if (!PyType_Check(type)) {
+        PyErr_SetString(PyExc_TypeError, "the element classes must be new style classes");
+        return -1;
+    }
+    cls->type = (PyTypeObject *)type;
+    if (slot_offset(cls->type, "name", &cls->name) < 0 || slot_offset(cls->type, content_slot, &cls->content) < 0)
+        return -1;
+    if (number && slot_offset(cls->type, "type", &cls->number_type) < 0)
+        return -1;
+    return 0;
+}
+
+PyDoc_STRVAR(configure_doc,
+"configure(parent_element, string_content_element, number_content_element,\n\
+          hex_content_element, parser_exception, parent_tags, string_tags)\n\
+\n\
+Hand over the element classes to create, the exception to raise & the tags of the\n\
+parent & string elements");
+
+static PyObject *
+codec_configure(PyObject *self, PyObject *args)
+{
+    PyObject *parent_type, *string_type, *number_type, *hex_type, *exception, *parents, *strings;
+    if (!PyArg_ParseTuple(args, "OOOOOOO:configure", &parent_type, &string_type, &number_type, &hex_type, &exception, &parents, &strings))
+        return NULL;
+    if (!PyAnySet_Check(parents) || !PyAnySet_Check(strings)) {
+        PyErr_SetString(PyExc_TypeError, "the tags must be sets");
+        return NULL;
+    }
+    if (configure_class(&parent_class, parent_type, "children", 0) < 0 ||
+        configure_class(&string_class, string_type, "content", 0) < 0 ||
+        configure_class(&number_class, number_type, "content", 1) < 0 ||
+        configure_class(&hex_class, hex_type, "content", 0) < 0)
+        return NULL;
+    /* the classes are held for as long as the module */
+    Py_INCREF(parent_type);
+    Py_INCREF(string_type);
+    Py_INCREF(number_type);
+    Py_INCREF(hex_type);
+    Py_INCREF(exception);
+    Py_XDECREF(parser_exception);
+    parser_exception = exception;
+    Py_INCREF(parents);
+    Py_XDECREF(parent_tags);
+    parent_tags = parents;
+    Py_INCREF(strings);
+    Py_XDECREF(string_tags);
+    string_tags = strings;
+    clear_name_cache();
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef codec_methods[] = {
+    {"configure", codec_configure, METH_VARARGS, configure_doc},
+    {"decode", codec_decode, METH_VARARGS, decode_doc},
+    {"check", codec_check, METH_VARARGS, check_doc},
+    {"walk", codec_walk, METH_VARARGS, walk_doc},
+    {"index", codec_index, METH_O, index_doc},
+    {"encode", codec_encode, METH_O, encode_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+PyDoc_STRVAR(module_doc, "The compiled codec of dacp_serialisation");
+
+PyMODINIT_FUNC
+init_dacp_codec(void)
+{
+    PyObject *module = Py_InitModule3("_dacp_codec", codec_methods, module_doc);
+    if (module == NULL)
+        return;
+    number_types[1] = PyString_InternFromString("B");
+    number_types[2] = PyString_InternFromString("H");
+    number_types[4] = PyString_InternFromString("I");
+    number_types[8] = PyString_InternFromString("Q");
+}
@@ -0,0 +1,149 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Caches album artwork in memory & on disk.  The images are stored on disk by the hash of 
+their content, so artwork shared by several albums is only stored once, with a small 
+key file per album or track pointing at the image.
+'''
+
+import hashlib
+import os
+
+class lru_cache():
+    '''
+    A least recently used cache bounded by the total size of its values
+    max_size - the maximum total size of the cached values
+    '''
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.values = {}
+        self.order = []
+        
+    def get(self, key):
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        self.order.remove(key)
+        self.order.append(key)
+        return entry[0]
+    
+    def put(self, key, value, size):
+        if self.values.has_key(key):
+            self.size -= self.values[key][1]
+            self.order.remove(key)
+        self.values[key] = (value, size)
+        self.order.append(key)
+        self.size += size
+        while self.size > self.max_size and len(self.order) > 1:
+            evicted = self.order.pop(0)
+            self.size -= self.values.pop(evicted)[1]
+
+class artwork_cache():
+    '''
+    Decoded artwork held in a memory lru cache, backed by the encoded images on disk
+    cache_dir - the directory holding the cached images
+    decode - called with the image data, returning the decoded image & its size in bytes
+    max_memory - the maximum size of the decoded images held in memory
+    max_disk - the maximum total size of the images held on disk
+    '''
+    
+    def __init__(self, cache_dir, decode, max_memory = 16 * 1024 * 1024, max_disk = 64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.decode = decode
+        self.max_disk = max_disk
+        self.memory = lru_cache(max_memory)
+        for directory in (self._path("keys"), self._path("images")):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            
+    def get(self, key):
+        '''
+        Returns the decoded artwork for the key or None if it is not cached
+        '''
+        image = self.memory.get(key)
+        if image is not None:
+            return image
+        image_path = self._image_path(key)
+        if image_path is None:
+            return None
+        try:
+            data = open(image_path, "rb").read()
+        except IOError:
+            return None
+        # touch the image so that it is pruned last
+        os.utime(image_path, None)
+        return self._decode(key, data)
+        
+    def store(self, key, data):
+        '''
+        Cache the encoded image for the key, returning the decoded image
+        '''
+        content_hash = hashlib.sha1(data).hexdigest()
+        image_path = self._path("images", content_hash)
+        if not os.path.exists(image_path):
+            self._write(image_path, data)
+            self._prune()
+        self._write(self._key_path(key), content_hash)
+        return self._decode(key, data)
+    
+    def _decode(self, key, data):
+        image, size = self.decode(data)
+        self.memory.put(key, image, size)
+        return image
+    
+    def _image_path(self, key):
+        try:
+            content_hash = open(self._key_path(key)).read().strip()
+        except IOError:
+            return None
+        return self._path("images", content_hash)
+        
+    def _key_path(self, key):
+        return self._path("keys", hashlib.sha1(key).hexdigest())
+    
+    def _path(self, *names):
+        return os.path.join(self.cache_dir, *names)
+    
+    def _write(self, path, data):
+        # write then rename so that a partly written file is never read
+        temporary_path = path + ".tmp"
+        output = open(temporary_path, "wb")
+        try:
+            output.write(data)
+        finally:
+            output.close()
+        os.rename(temporary_path, path)
+        
+    def _prune(self):
+        '''
+        Remove the least recently used images until the disk cache is within its limit, 
+        key files left pointing at a removed image are treated as a miss
+        '''
+        images = []
+        total = 0
+        for name in os.listdir(self._path("images")):
+            path = self._path("images", name)
+            status = os.stat(path)
+            images.append((status.st_mtime, path, status.st_size))
+            total += status.st_size
+        images.sort()
+        while total > self.max_disk and len(images) > 1:
+            mtime, path, size = images.pop(0)
+            os.unlink(path)
+            total -= size
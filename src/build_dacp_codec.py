@@ -0,0 +1,27 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Builds the optional compiled codec of dacp_serialisation next to its source:
+
+    python build_dacp_codec.py build_ext --inplace
+
+dacp_serialisation falls back to its pure python implementation when it is not built.
+'''
+
+from distutils.core import setup, Extension
+
+setup(name="_dacp_codec", ext_modules=[Extension("_dacp_codec", ["_dacp_codec.c"])])
@@ -0,0 +1,151 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Coalesces bursts of play/pause, next & previous commands into their net effect before 
+they are sent to itunes, so holding down a keyboard shortcut doesn't queue a request 
+per key repeat.
+'''
+
+import gobject
+import time
+
+TOGGLE_PLAY = "toggle-play"
+NEXT_TRACK = "next-track"
+PREV_TRACK = "prev-track"
+
+# how long to wait for further commands before sending, & the longest a burst is held
+COALESCE_DELAY = 100 # milliseconds
+MAX_COALESCE_DELAY = 500 # milliseconds
+
+class command_scheduler():
+    '''
+    Collects commands until none has arrived for the coalesce delay, then sends the net 
+    action: nexts & previouses cancel each other and pairs of play/pauses cancel out.  
+    Commands arriving while requests are in flight are merged into the pending action 
+    rather than queued behind them.  Driven by the glib main loop.
+    send - called with a command & a completion function, which must be called with 
+    None on success or the exception on failure
+    max_in_flight - the maximum number of requests sent but not yet completed
+    '''
+    
+    def __init__(self, send, max_in_flight = 1):
+        self.send = send
+        self.max_in_flight = max_in_flight
+        self.skip = 0
+        self.toggle = False
+        self.replies = []
+        self.in_flight = 0
+        # incremented on cancel so completions of requests sent before are ignored
+        self.generation = 0
+        self.timer = None
+        self.burst_start = None
+        self.received = 0
+        self.sent = 0
+        
+    def toggle_play(self, reply = None):
+        self._add(0, True, reply)
+        
+    def next_track(self, reply = None):
+        self._add(1, False, reply)
+        
+    def prev_track(self, reply = None):
+        self._add(-1, False, reply)
+        
+    def cancel(self):
+        '''
+        Drop any commands not yet sent & forget the requests in flight, whose connection 
+        is closed without completing them
+        '''
+        if self.timer is not None:
+            gobject.source_remove(self.timer)
+            self.timer = None
+        self.skip = 0
+        self.toggle = False
+        self.in_flight = 0
+        self.generation += 1
+        self.burst_start = None
+        self._reply("error cancelled")
+        
+    def metrics(self):
+        '''
+        A single line summary of the commands received & the requests sent for them
+        '''
+        return "received %d sent %d saved %d" % (self.received, self.sent, self.received - self.sent)
+        
+    def _add(self, skip, toggle, reply):
+        self.received += 1
+        self.skip += skip
+        self.toggle = self.toggle != toggle
+        if reply is not None:
+            self.replies.append(reply)
+        now = time.time()
+        if self.burst_start is None:
+            self.burst_start = now
+        if self.timer is not None:
+            gobject.source_remove(self.timer)
+            self.timer = None
+        # a burst longer than the maximum delay is sent now so the user sees progress
+        if (now - self.burst_start) * 1000 >= MAX_COALESCE_DELAY:
+            self._flush()
+        else:
+            self.timer = gobject.timeout_add(COALESCE_DELAY, self._timer_expired)
+        
+    def _timer_expired(self):
+        self.timer = None
+        self._flush()
+        return False
+    
+    def _flush(self):
+        self.burst_start = None
+        while self.in_flight < self.max_in_flight:
+            if self.toggle:
+                self.toggle = False
+                command = TOGGLE_PLAY
+            elif self.skip > 0:
+                self.skip -= 1
+                command = NEXT_TRACK
+            elif self.skip < 0:
+                self.skip += 1
+                command = PREV_TRACK
+            else:
+                break
+            self.in_flight += 1
+            self.sent += 1
+            generation = self.generation
+            self.send(command, lambda exception: self._completed(generation, exception))
+        if self.in_flight == 0 and self.timer is None:
+            # the commands have cancelled each other out or all been sent
+            self._reply("ok")
+            
+    def _completed(self, generation, exception):
+        if generation != self.generation:
+            # sent before the scheduler was cancelled
+            return
+        self.in_flight -= 1
+        if exception is not None:
+            # drop the rest of the action, the service is unlikely to accept it
+            self.skip = 0
+            self.toggle = False
+            self._reply("error " + str(exception))
+        if self.timer is None:
+            self._flush()
+        
+    def _reply(self, message):
+        replies = self.replies
+        self.replies = []
+        for reply in replies:
+            reply(message)
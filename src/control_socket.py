@@ -0,0 +1,155 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+A unix domain socket accepting line based commands from any number of local clients, 
+driven by the glib main loop.  Each command line receives a single reply line, replies 
+are returned in the order the commands were sent so a client may send a batch of 
+commands before reading the replies.
+'''
+
+import errno
+import gobject
+import os
+import socket
+
+RECEIVE_SIZE = 4096
+MAX_LINE_LENGTH = 1024
+
+class control_client():
+    '''
+    A connection to the control socket
+    server - the control_server accepting the connection
+    clientsocket - the connected socket
+    '''
+    
+    def __init__(self, server, clientsocket):
+        self.server = server
+        self.clientsocket = clientsocket
+        self.clientsocket.setblocking(0)
+        self.pending = ""
+        self.replies = []
+        self.outgoing = ""
+        self.reading = True
+        self.read_watch = gobject.io_add_watch(self.clientsocket, gobject.IO_IN | gobject.IO_ERR | gobject.IO_HUP, self._read)
+        self.write_watch = None
+        
+    def close(self):
+        if self.clientsocket is None:
+            return
+        for watch in (self.read_watch, self.write_watch):
+            if watch is not None:
+                gobject.source_remove(watch)
+        self.read_watch = None
+        self.write_watch = None
+        self.clientsocket.close()
+        self.clientsocket = None
+        self.server.clients.remove(self)
+        
+    def _read(self, source, condition):
+        try:
+            data = self.clientsocket.recv(RECEIVE_SIZE)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            data = ""
+        if data == "":
+            # the client has sent all its commands, close once they have been replied to
+            self.reading = False
+            self.read_watch = None
+            self._flush()
+            return False
+        lines = (self.pending + data).split("\n")
+        self.pending = lines.pop()
+        if len(self.pending) > MAX_LINE_LENGTH:
+            self.pending = ""
+            lines.append("")
+            print "Error: control command too long"
+        for line in lines:
+            self._dispatch(line.strip())
+        return True
+    
+    def _dispatch(self, line):
+        slot = [None]
+        self.replies.append(slot)
+        def reply(message):
+            slot[0] = message
+            self._flush()
+        self.server.dispatch(line, reply)
+        
+    def _flush(self):
+        if self.clientsocket is None:
+            return
+        # replies are sent in command order, so stop at the first command still in progress
+        while len(self.replies) > 0 and self.replies[0][0] is not None:
+            self.outgoing = self.outgoing + self.replies.pop(0)[0].replace("\n", " ") + "\n"
+        if len(self.outgoing) > 0:
+            if self.write_watch is None:
+                self.write_watch = gobject.io_add_watch(self.clientsocket, gobject.IO_OUT | gobject.IO_ERR | gobject.IO_HUP, self._write)
+        elif not self.reading and len(self.replies) == 0:
+            self.close()
+            
+    def _write(self, source, condition):
+        try:
+            sent = self.clientsocket.send(self.outgoing)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            self.close()
+            return False
+        self.outgoing = self.outgoing[sent:]
+        if len(self.outgoing) > 0:
+            return True
+        self.write_watch = None
+        self._flush()
+        return False
+
+class control_server():
+    '''
+    Listens for clients on a unix domain socket
+    path - the file system path of the socket
+    dispatch - called with each command line and a reply function, which must be called 
+    with a single line reply once the command is complete
+    '''
+    
+    def __init__(self, path, dispatch):
+        self.path = path
+        self.dispatch = dispatch
+        self.clients = []
+        self.watch = None
+        
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.serversocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.serversocket.bind(self.path)
+        os.chmod(self.path, 0600)
+        self.serversocket.listen(16)
+        self.watch = gobject.io_add_watch(self.serversocket, gobject.IO_IN, self._accept)
+        
+    def stop(self):
+        if self.watch is not None:
+            gobject.source_remove(self.watch)
+            self.watch = None
+            self.serversocket.close()
+            os.unlink(self.path)
+            for client in list(self.clients):
+                client.close()
+        
+    def _accept(self, source, condition):
+        clientsocket, address = self.serversocket.accept()
+        self.clients.append(control_client(self, clientsocket))
+        return True
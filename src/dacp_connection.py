@@ -0,0 +1,480 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Contains the http connection handling for talking to a dacp service
+'''
+
+import errno
+import gobject
+import httplib
+import socket
+import threading
+import time
+import metrics
+
+RECEIVE_SIZE = 65536
+# how long an async request may take from being sent to its response completing
+REQUEST_TIMEOUT = 10000 # milliseconds
+REQUEST_TEMPLATE = "GET %s HTTP/1.1\r\nHost: %s:%d\r\n%s\r\n"
+
+class connection_exception(Exception):
+    
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+class http_status_exception(connection_exception):
+    '''
+    A request answered with a status other than 2xx (success)
+    '''
+    
+    def __init__(self, status, reason):
+        connection_exception.__init__(self, ("%d %s" % (status, reason)).strip())
+        self.status = status
+
+class connection_pool():
+    '''
+    A pool of keep-alive http connections to a single dacp service.  Connections are 
+    returned to the pool once their response has been read so that subsequent requests 
+    avoid a new tcp handshake.  A request on an idle connection the server has since 
+    closed is transparently retried on a new connection.
+    host, port - the address of the dacp service
+    max_idle - the maximum number of idle connections kept open
+    name - the connection label of the recorded metrics
+    '''
+    
+    def __init__(self, host, port, max_idle = 2, name = "blocking"):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.name = name
+        self.idle = []
+        self.lock = threading.Lock()
+        
+    def request(self, url, headers):
+        '''
+        Send a GET request for the supplied url, returning the connection and the http 
+        response.  The response must be read in full and then passed to release
+        '''
+        connection, reused = self._acquire()
+        try:
+            return connection, self._send(connection, url, headers, reused)
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+        # the server closed the idle connection, retry once on a new connection
+        connection = httplib.HTTPConnection(self.host, self.port)
+        try:
+            return connection, self._send(connection, url, headers, False)
+        except:
+            connection.close()
+            raise
+        
+    def _send(self, connection, url, headers, reused):
+        if not metrics.enabled:
+            connection.request("GET", url, "", headers)
+            return connection.getresponse()
+        started = time.time()
+        if not reused:
+            connection.connect()
+            connected = time.time()
+            metrics.request_phase.observe(connected - started, self.name, "connect")
+            started = connected
+        connection.request("GET", url, "", headers)
+        response = connection.getresponse()
+        metrics.request_phase.observe(time.time() - started, self.name, "first_byte")
+        return response
+        
+    def release(self, connection, response):
+        '''
+        Return a connection to the pool once its response has been read
+        '''
+        if response.will_close:
+            connection.close()
+            return
+        self.lock.acquire()
+        try:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(connection)
+                return
+        finally:
+            self.lock.release()
+        connection.close()
+        
+    def fetch(self, url, headers):
+        '''
+        Send a GET request for the supplied url and return the response body
+        '''
+        connection, response = self.request(url, headers)
+        timing = metrics.enabled
+        if timing:
+            started = time.time()
+        try:
+            body = response.read()
+        except:
+            connection.close()
+            raise
+        if timing:
+            metrics.request_phase.observe(time.time() - started, self.name, "read")
+        self.release(connection, response)
+        return body
+        
+    def close(self):
+        '''
+        Close all the idle connections
+        '''
+        self.lock.acquire()
+        try:
+            idle = self.idle
+            self.idle = []
+        finally:
+            self.lock.release()
+        for connection in idle:
+            connection.close()
+        
+    def _acquire(self):
+        self.lock.acquire()
+        try:
+            if len(self.idle) > 0:
+                return self.idle.pop(), True
+        finally:
+            self.lock.release()
+        return httplib.HTTPConnection(self.host, self.port), False
+
+class async_request():
+    '''
+    A request queued on an async_connection
+    url - the url requested
+    headers - a map of additional request headers
+    callback - called with the response body once a 2xx (success) response has been received
+    error_callback - called with the exception if the request fails or is answered with 
+    any other status
+    '''
+    
+    def __init__(self, connection, url, headers, callback, error_callback):
+        self.connection = connection
+        self.url = url
+        self.headers = headers
+        self.callback = callback
+        self.error_callback = error_callback
+        
+    def cancel(self):
+        '''
+        Cancel the request, neither callback will be called
+        '''
+        self.connection._cancel(self)
+        
+class async_connection():
+    '''
+    A keep-alive http connection to a dacp service driven by the glib main loop, so that 
+    no thread is needed to wait on the service.  Requests are sent one at a time in the 
+    order they were made and the response of each is passed to its callback on the main 
+    loop.  A request on a connection the server has since closed is retried once on a 
+    new connection.  A request not answered within the timeout fails & its connection is 
+    closed, so a service that stops responding doesn't hold up the requests behind it.
+    host, port - the address of the dacp service
+    name - the connection label of the recorded metrics
+    timeout - the milliseconds each request may take, None to wait indefinitely as the 
+    long poll for status updates does
+    address - the (family, socket address) the host has been resolved to.  Without it 
+    the host is resolved on each connect, blocking the main loop
+    '''
+    
+    def __init__(self, host, port, name = "async", timeout = REQUEST_TIMEOUT, address = None):
+        self.host = host
+        self.port = port
+        self.address = address
+        self.name = name
+        self.timeout = timeout
+        self.deadline = None
+        self.timing = False
+        self.queue = []
+        self.current = None
+        self.sock = None
+        self.watch = None
+        self.reused = False
+        
+    def request(self, url, headers, callback, error_callback):
+        '''
+        Queue a GET request for the supplied url, returning the async_request
+        '''
+        request = async_request(self, url, headers, callback, error_callback)
+        self.queue.append(request)
+        self._next()
+        return request
+    
+    def close(self):
+        '''
+        Cancel all the requests and close the connection
+        '''
+        self.queue = []
+        self._finish_current()
+        self._close_socket()
+        
+    def _cancel(self, request):
+        if request in self.queue:
+            self.queue.remove(request)
+        elif request is self.current:
+            # the response to the request in flight can't be skipped, so drop the connection
+            self._finish_current()
+            self._close_socket()
+            self._next()
+        
+    def _next(self):
+        if self.current is not None or len(self.queue) == 0:
+            return
+        self.current = self.queue.pop(0)
+        self.timing = metrics.enabled
+        if self.timeout is not None:
+            # a retry on a new connection keeps the deadline of the request
+            self.deadline = gobject.timeout_add(self.timeout, self._timed_out)
+        if self.sock is None:
+            self._connect()
+        else:
+            self.reused = True
+            self._send()
+            
+    def _connect(self):
+        self.reused = False
+        if self.timing:
+            self.started = time.time()
+        if self.address is not None:
+            family, address = self.address
+        else:
+            try:
+                family, type, protocol, canonical_name, address = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0]
+            except socket.error, e:
+                self._fail(e)
+                return
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.setblocking(0)
+        result = self.sock.connect_ex(address)
+        if result == 0:
+            self._send()
+        elif result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self._watch(gobject.IO_OUT, self._connected)
+        else:
+            self._fail(socket.error(result, "connect to %s:%d failed" % (self.host, self.port)))
+        
+    def _connected(self, source, condition):
+        result = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if result != 0:
+            self._fail(socket.error(result, "connect to %s:%d failed" % (self.host, self.port)))
+        else:
+            self._send()
+        return False
+        
+    def _send(self):
+        if self.timing and not self.reused:
+            connected = time.time()
+            metrics.request_phase.observe(connected - self.started, self.name, "connect")
+            self.started = connected
+        headers = "".join(["%s: %s\r\n" % header for header in self.current.headers.items()])
+        self.outgoing = REQUEST_TEMPLATE % (self.current.url, self.host, self.port, headers)
+        self.header_data = ""
+        self.response_headers = None
+        self.body = []
+        self.body_length = 0
+        self._watch(gobject.IO_OUT, self._write)
+        
+    def _write(self, source, condition):
+        try:
+            sent = self.sock.send(self.outgoing)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            return self._retry_or_fail(e)
+        self.outgoing = self.outgoing[sent:]
+        if len(self.outgoing) > 0:
+            return True
+        if self.timing:
+            self.started = time.time()
+        self._watch(gobject.IO_IN, self._read)
+        return False
+        
+    def _read(self, source, condition):
+        try:
+            data = self.sock.recv(RECEIVE_SIZE)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            return self._retry_or_fail(e)
+        if data == "":
+            if self.response_headers is None:
+                return self._retry_or_fail(connection_exception("connection closed before the response was received"))
+            if self.chunked:
+                self._fail(connection_exception("connection closed after %d bytes of a chunked response" % self.body_length))
+                return False
+            if self.content_length is not None:
+                self._fail(connection_exception("connection closed after %d of %d bytes" % (self.body_length, self.content_length)))
+                return False
+            # without a content length the body runs until the connection is closed
+            self.will_close = True
+            self._complete()
+            return False
+        
+        if self.response_headers is None:
+            if self.timing and self.header_data == "":
+                received = time.time()
+                metrics.request_phase.observe(received - self.started, self.name, "first_byte")
+                self.started = received
+            self.header_data = self.header_data + data
+            end = self.header_data.find("\r\n\r\n")
+            if end < 0:
+                return True
+            self._parse_headers(self.header_data[:end])
+            data = self.header_data[end + 4:]
+            self.header_data = ""
+        if self.chunked:
+            try:
+                finished = self._read_chunks(data)
+            except ValueError:
+                self._fail(connection_exception("invalid chunk size in the response"))
+                return False
+            if finished:
+                self._complete()
+                return False
+            return True
+        if len(data) > 0:
+            self.body.append(data)
+            self.body_length += len(data)
+        if self.content_length is not None and self.body_length >= self.content_length:
+            self._complete()
+            return False
+        return True
+    
+    def _parse_headers(self, header_data):
+        lines = header_data.split("\r\n")
+        status_line = lines[0].split(" ", 2)
+        self.response_headers = {}
+        for line in lines[1:]:
+            key, separator, value = line.partition(":")
+            self.response_headers[key.strip().lower()] = value.strip()
+        self.status = int(status_line[1])
+        self.reason = ""
+        if len(status_line) > 2:
+            self.reason = status_line[2]
+        self.will_close = status_line[0] == "HTTP/1.0" or self.response_headers.get("connection", "").lower() == "close"
+        # a chunked body is delimited by its chunks whatever the content length says
+        self.chunked = self.response_headers.get("transfer-encoding", "").lower().endswith("chunked")
+        self.chunk_data = ""
+        self.chunk_remaining = None
+        self.chunk_trailer = False
+        if self.chunked:
+            self.content_length = None
+        elif self.response_headers.has_key("content-length"):
+            self.content_length = int(self.response_headers["content-length"])
+        elif self.status in (204, 304) or self.status < 200:
+            self.content_length = 0
+        else:
+            self.content_length = None
+            
+    def _read_chunks(self, data):
+        '''
+        Decode the chunks of a chunked response body into the body, returning true once 
+        the last chunk & any trailer has been read.  Throws a ValueError for an invalid 
+        chunk size
+        '''
+        self.chunk_data = self.chunk_data + data
+        while True:
+            if self.chunk_remaining is not None:
+                chunk = self.chunk_data[:self.chunk_remaining]
+                self.chunk_data = self.chunk_data[len(chunk):]
+                self.body.append(chunk)
+                self.body_length += len(chunk)
+                self.chunk_remaining -= len(chunk)
+                if self.chunk_remaining > 0:
+                    return False
+                self.chunk_remaining = None
+            end = self.chunk_data.find("\r\n")
+            if end < 0:
+                return False
+            line = self.chunk_data[:end]
+            self.chunk_data = self.chunk_data[end + 2:]
+            if self.chunk_trailer:
+                # the trailer headers end with an empty line
+                if line == "":
+                    return True
+            elif line != "":
+                # the empty lines are the line breaks ending each chunk
+                size = int(line.split(";", 1)[0].strip(), 16)
+                if size < 0:
+                    raise ValueError("negative chunk size: %d" % size)
+                if size == 0:
+                    self.chunk_trailer = True
+                else:
+                    self.chunk_remaining = size
+            
+    def _complete(self):
+        if self.timing:
+            metrics.request_phase.observe(time.time() - self.started, self.name, "read")
+        request = self.current
+        body = "".join(self.body)
+        self._finish_current()
+        self.body = []
+        if self.will_close:
+            self._close_socket()
+        else:
+            self._watch(None, None)
+        if self.status < 200 or self.status >= 300:
+            # a rejected request, e.g. an expired session, has an empty body rather than a dacp error
+            if request.error_callback is not None:
+                request.error_callback(http_status_exception(self.status, self.reason))
+        elif request.callback is not None:
+            request.callback(body)
+        self._next()
+        
+    def _retry_or_fail(self, exception):
+        if self.reused and self.response_headers is None:
+            # the server closed the idle connection, retry once on a new connection
+            self._close_socket()
+            self._connect()
+        else:
+            self._fail(exception)
+        return False
+    
+    def _timed_out(self):
+        self.deadline = None
+        self._fail(connection_exception("no response from %s:%d within %d ms" % (self.host, self.port, self.timeout)))
+        return False
+    
+    def _finish_current(self):
+        self.current = None
+        if self.deadline is not None:
+            gobject.source_remove(self.deadline)
+            self.deadline = None
+    
+    def _fail(self, exception):
+        request = self.current
+        self._finish_current()
+        self._close_socket()
+        if request.error_callback is not None:
+            request.error_callback(exception)
+        self._next()
+        
+    def _watch(self, condition, handler):
+        if self.watch is not None:
+            gobject.source_remove(self.watch)
+            self.watch = None
+        if handler is not None:
+            self.watch = gobject.io_add_watch(self.sock, condition | gobject.IO_ERR | gobject.IO_HUP, handler)
+            
+    def _close_socket(self):
+        self._watch(None, None)
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -19,60 +19,136 @@ Contains parser and data structures for serialising and deserialising the dacp b
 protocol
 '''
 
+import array
+import gc
+import os
 import struct
+import sys
 import binascii
+import metrics
 
-class string_content_element():
+# set to decode with the pure python implementation even when the compiled codec is built
+PURE_PYTHON_VARIABLE = "ITUNES_REMOTE_PURE_PYTHON"
+
+# the optional compiled codec, built from _dacp_codec.c by build_dacp_codec.py.  It is
+# configured with the element classes below & creates the same objects
+native = None
+if not os.environ.has_key(PURE_PYTHON_VARIABLE):
+    try:
+        import _dacp_codec as native
+    except ImportError:
+        pass
+
+# element kinds determined by the element name, any other element is a number when its 
+# length matches one of the number types, otherwise it is held as hex
+PARENT = "parent"
+STRING = "string"
+
+TAG_KINDS = {
+    "arsv":PARENT, "mupd":PARENT, "msrv":PARENT, "mdcl":PARENT, "mccr":PARENT, "cmst":PARENT, "mlog":PARENT, 
+    "agal":PARENT, "mlcl":PARENT, "mshl":PARENT, "mlit":PARENT, "abro":PARENT, "abar":PARENT, "apso":PARENT, 
+    "caci":PARENT, "avdb":PARENT, "cmgt":PARENT, "aply":PARENT, "adbs":PARENT, "cmpa":PARENT, "mudl":PARENT, 
+    "mcnm":STRING, "mcna":STRING, "minm":STRING, "cann":STRING, "cana":STRING, "canl":STRING, "asaa":STRING, 
+    "asal":STRING, "asar":STRING, "cmty":STRING, "cmnm":STRING }
+
+PARENT_TAGS = frozenset([tag for tag, kind in TAG_KINDS.items() if kind == PARENT])
+STRING_TAGS = frozenset([tag for tag, kind in TAG_KINDS.items() if kind == STRING])
+
+# the element header: 4 letter name & content length
+HEADER = struct.Struct(">4sI")
+
+NUMBER_WIDTHS = { "B":1, "H":2, "I":4, "Q":8 }
+NUMBER_TYPES_BY_WIDTH = dict([(width, number_type) for number_type, width in NUMBER_WIDTHS.items()])
+NUMBER_MAXIMUMS = dict([(number_type, 2 ** (8 * width) - 1) for number_type, width in NUMBER_WIDTHS.items()])
+# a complete number element, header & content
+NUMBER_ELEMENTS = dict([(number_type, struct.Struct(">4sI" + number_type)) for number_type in NUMBER_WIDTHS])
+NUMBER_CONTENTS = dict([(number_type, struct.Struct(">" + number_type)) for number_type in NUMBER_WIDTHS])
+
+# the default limits of a hardened parse, well beyond any real itunes response
+MAX_DEPTH = 32
+MAX_BYTES = 64 * 1024 * 1024
+MAX_ELEMENTS = 4 * 1024 * 1024
+
+def encode(element):
+    '''
+    Serialise an element into a string.  The size of the element tree is calculated 
+    first so the whole tree can be written into a single preallocated buffer
+    '''
+    if native is not None:
+        return native.encode(element)
+    buffer = bytearray(element.get_size())
+    element.write_into(buffer, 0)
+    return str(buffer)
+
+class string_content_element(object):
     '''
     A content element holding a string
     name - the 4 letter element name
     content - the element content string
     '''
+    __slots__ = ("name", "content")
     
     def __init__(self, name, content):
         self.name = name
         self.content = content
         
-    def get_bytes(self):
+    def get_size(self):
+        return HEADER.size + len(self.content)
+    
+    def write_into(self, buffer, offset):
         length = len(self.content)
-        return struct.pack(">4sI" + str(length) + "s", self.name, length, self.content)
-
+        HEADER.pack_into(buffer, offset, self.name, length)
+        offset += HEADER.size
+        buffer[offset:offset + length] = self.content
+        return offset + length
+        
+    def get_bytes(self):
+        return encode(self)
+    
     def to_string(self, indent):
         print indent + "S[" + self.name + "]: " + self.content
 
-class number_content_element():
+class number_content_element(object):
     '''
     A content element holding a number:
     name - the 4 letter element name
     content - the element content number
     type - the number type code, must be one of: B (byte), H (short), I (integer), Q (long)
     '''
+    __slots__ = ("name", "content", "type")
         
     def __init__(self, name, content, number_type):
         self.name = name
         self.content = content
         self.type = number_type
-        self.number_types_by_type = { "B":1, "H":2, "I":4, "Q":8  }
-        if not self.number_types_by_type.has_key(self.type):
+        if not NUMBER_WIDTHS.has_key(self.type):
             raise ValueError("Number type must be one of: B, H, I, Q not: " + self.type)
         # check the number size
-        max_size = 2 ** (8 * self.number_types_by_type[self.type]) - 1
+        max_size = NUMBER_MAXIMUMS[self.type]
         if (self.content < 0 or self.content > max_size):
             raise ValueError("Number must be between 0 and %d, not %d" % (max_size, self.content))
         
+    def get_size(self):
+        return NUMBER_ELEMENTS[self.type].size
+    
+    def write_into(self, buffer, offset):
+        number_element = NUMBER_ELEMENTS[self.type]
+        number_element.pack_into(buffer, offset, self.name, NUMBER_WIDTHS[self.type], self.content)
+        return offset + number_element.size
+        
     def get_bytes(self):
-        number_type_length = self.number_types_by_type[self.type]
-        return struct.pack(">4sI" + self.type, self.name, number_type_length, self.content)
+        return NUMBER_ELEMENTS[self.type].pack(self.name, NUMBER_WIDTHS[self.type], self.content)
     
     def to_string(self, indent):
         print indent + self.type + "[" + self.name + "]: " + str(self.content)
 
-class hex_content_element():
+class hex_content_element(object):
     '''
     A content element holding a hex string
     name - the 4 letter element name
     content - the element content as a hex string
     '''
+    __slots__ = ("name", "content")
     
     def __init__(self, name, content):
         self.name = name
@@ -84,31 +160,51 @@ class hex_content_element():
             # binary is more difficult 
             self.content = "0" + content.upper()
         
-    def get_bytes(self):
-        length = len(self.content) / 2
+    def get_size(self):
+        return HEADER.size + len(self.content) / 2
+    
+    def write_into(self, buffer, offset):
         bytes = binascii.a2b_hex(self.content)
-        return struct.pack(">4sI" + str(length) + "s", self.name, length, bytes)
-
+        HEADER.pack_into(buffer, offset, self.name, len(bytes))
+        offset += HEADER.size
+        buffer[offset:offset + len(bytes)] = bytes
+        return offset + len(bytes)
+        
+    def get_bytes(self):
+        return encode(self)
+    
     def to_string(self, indent):
         print indent + "X[" + self.name + "]: " + self.content
 
-class parent_element():
+class parent_element(object):
     '''
     An element holding a collection of other elements
     name - the 4 letter element name
     children - a list or tuple of child elements
     '''
+    __slots__ = ("name", "children")
     
     def __init__(self, name, children):
         self.name = name
         self.children = children
         
-    def get_bytes(self):
-        child_bytes = ''
+    def get_size(self):
+        size = HEADER.size
         for child in self.children:
-            child_bytes = child_bytes + child.get_bytes()
-        length = len(child_bytes)
-        return struct.pack(">4sI" + str(length) + "s", self.name, length, child_bytes)
+            size += child.get_size()
+        return size
+    
+    def write_into(self, buffer, offset):
+        start = offset + HEADER.size
+        end = start
+        for child in self.children:
+            end = child.write_into(buffer, end)
+        # the children have been written so the content length is now known
+        HEADER.pack_into(buffer, offset, self.name, end - start)
+        return end
+        
+    def get_bytes(self):
+        return encode(self)
     
     def assert_self(self, name):
         if self.name == name:
@@ -127,80 +223,641 @@ class parent_element():
         for child in self.children:
             child.to_string(indent + "  ")
     
+
+class lazy_parent_element(object):
+    '''
+    A parent element parsed on demand.  Only the offsets of the children are recorded 
+    when the element is first searched, a child is decoded the first time it is read.
+    name - the 4 letter element name
+    parser - the parser used to decode the children
+    view - a memoryview over the response data
+    start, end - the offsets of the element content within the view
+    '''
+    __slots__ = ("name", "parser", "view", "start", "end", "offsets", "index", "decoded")
+    
+    def __init__(self, name, parser, view, start, end):
+        self.name = name
+        self.parser = parser
+        self.view = view
+        self.start = start
+        self.end = end
+        self.offsets = None
+        self.index = None
+        self.decoded = {}
+    
+    def _build_index(self):
+        '''
+        Record the name & offsets of each child and index the first child with each name
+        '''
+        self.offsets = list(self.parser._walk(self.view, self.start, self.end))
+        if self.parser.native is not None:
+            self.index = self.parser.native.index(self.offsets)
+            return
+        self.index = {}
+        for position in range(len(self.offsets) - 1, -1, -1):
+            self.index[self.offsets[position][0]] = position
+    
+    def _child(self, position):
+        child = self.decoded.get(position)
+        if child is None:
+            child_name, child_start, child_end = self.offsets[position]
+            child = self.parser._element(self.view, child_name, child_start, child_end, True)
+            self.decoded[position] = child
+        return child
+    
+    @property
+    def children(self):
+        if self.offsets is None:
+            self._build_index()
+        return [self._child(position) for position in range(len(self.offsets))]
+        
+    def get_size(self):
+        return HEADER.size + self.end - self.start
+    
+    def write_into(self, buffer, offset):
+        HEADER.pack_into(buffer, offset, self.name, self.end - self.start)
+        offset += HEADER.size
+        buffer[offset:offset + self.end - self.start] = self.view[self.start:self.end]
+        return offset + self.end - self.start
+        
+    def get_bytes(self):
+        return encode(self)
+    
+    def assert_self(self, name):
+        if self.name == name:
+            return self
+        else:
+            raise AssertionError("Expected element with name: " + name + " not: " + self.name)
+    
+    def assert_child(self, child_name):
+        if self.index is None:
+            self._build_index()
+        position = self.index.get(child_name)
+        if position is None:
+            raise AssertionError("Child with name: " + child_name + " does not exist for parent: " + self.name)
+        return self._child(position)
+    
+    def to_string(self, indent):
+        print indent + "P[" + self.name + "]:"
+        for child in self.children:
+            child.to_string(indent + "  ")
+    
+class number_column(object):
+    '''
+    A column of numbers held in an array, the narrowest array type able to hold the 
+    values is used and widened as required
+    '''
+    __slots__ = ("values",)
+    
+    def __init__(self, length):
+        self.values = array.array("B", [0]) * length
+        
+    def append(self, row, value):
+        if len(self.values) > row:
+            # only the first occurrence of a tag in an item is kept
+            return
+        if len(self.values) < row:
+            self.values.extend([0] * (row - len(self.values)))
+        # once widened to a list any value fits
+        if isinstance(self.values, array.array) and value >= 2 ** (8 * self.values.itemsize):
+            self.values = self._widen(value)
+        self.values.append(value)
+        
+    def extend(self, row, values):
+        '''
+        Append the values of a column decoded separately, the first value is for the row
+        '''
+        self.pad(row)
+        if isinstance(self.values, array.array):
+            # the values are in the narrowest array able to hold them, or a list
+            if not isinstance(values, array.array):
+                self.values = list(self.values)
+            elif values.itemsize > self.values.itemsize:
+                self.values = array.array(values.typecode, self.values)
+            elif values.typecode != self.values.typecode:
+                values = values.tolist()
+        self.values.extend(values)
+        
+    def pad(self, length):
+        if len(self.values) < length:
+            self.values.extend([0] * (length - len(self.values)))
+        
+    def get(self, row):
+        return self.values[row]
+        
+    def _widen(self, value):
+        for typecode in ("H", "I", "L"):
+            if value < 2 ** (8 * array.array(typecode).itemsize):
+                return array.array(typecode, self.values)
+        # no unsigned array type is wide enough on this platform
+        return list(self.values)
+
+class string_column(object):
+    '''
+    A column of strings held in a single shared buffer, the strings are located by 
+    an array of offsets.  The string for row i lies between offsets i and i + 1
+    '''
+    __slots__ = ("data", "offsets")
+    
+    def __init__(self, length):
+        self.data = bytearray()
+        self.offsets = array.array("L", [0]) * (length + 1)
+        
+    def append(self, row, value):
+        if len(self.offsets) > row + 1:
+            return
+        self.pad(row)
+        self.data += value
+        self.offsets.append(len(self.data))
+        
+    def extend(self, row, data, offsets):
+        '''
+        Append the strings of a column decoded separately, the first string is for the row
+        '''
+        self.pad(row)
+        base = len(self.data)
+        self.data += data
+        self.offsets.extend([base + offset for offset in offsets[1:]])
+        
+    def pad(self, length):
+        if len(self.offsets) < length + 1:
+            self.offsets.extend([len(self.data)] * (length + 1 - len(self.offsets)))
+        
+    def get(self, row):
+        return str(self.data[self.offsets[row]:self.offsets[row + 1]])
+
+class listing_table(object):
+    '''
+    The items of a listing decoded into columns, one per tag.  Numbers are held in arrays 
+    and every other content as strings in a shared buffer.  An item without a tag has a 
+    0 or empty string in its column.  Filtering, sorting & slicing return new tables 
+    sharing the same columns.
+    columns - a map of tag to number_column or string_column
+    rows - an array of the column positions of the rows in this table
+    '''
+    __slots__ = ("columns", "rows")
+    
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        
+    def __len__(self):
+        return len(self.rows)
+    
+    def __getitem__(self, index):
+        '''
+        A slice returns a new table, an index returns the row as a map of tag to value
+        '''
+        if isinstance(index, slice):
+            return listing_table(self.columns, self.rows[index])
+        return self.row(index)
+        
+    def tags(self):
+        return self.columns.keys()
+    
+    def get(self, tag, index):
+        return self.columns[tag].get(self.rows[index])
+    
+    def row(self, index):
+        position = self.rows[index]
+        return dict([(tag, column.get(position)) for tag, column in self.columns.items()])
+        
+    def column(self, tag):
+        '''
+        Returns a list of the values for the tag in row order
+        '''
+        get = self.columns[tag].get
+        return [get(position) for position in self.rows]
+        
+    def filter(self, tag, predicate):
+        '''
+        Returns a table of the rows for which predicate(value of tag) is true
+        '''
+        get = self.columns[tag].get
+        return listing_table(self.columns, array.array("L", [position for position in self.rows if predicate(get(position))]))
+    
+    def sort(self, tag, reverse = False):
+        '''
+        Returns a table of the rows ordered by the value of the tag
+        '''
+        rows = array.array("L", sorted(self.rows, key=self.columns[tag].get, reverse=reverse))
+        return listing_table(self.columns, rows)
     
 class parser_exception(Exception):
     
     def __init__(self, message):
         Exception.__init__(self, message)
         
+if native is not None:
+    native.configure(parent_element, string_content_element, number_content_element, hex_content_element, parser_exception, PARENT_TAGS, STRING_TAGS)
+        
+class parse_limits():
+    '''
+    The bounds a hardened parse rejects a response for exceeding
+    max_depth - the deepest nesting of elements, the response element is at depth 1
+    max_bytes - the largest response, or largest element of a streamed response
+    max_elements - the most elements in a response
+    '''
+    
+    def __init__(self, max_depth = MAX_DEPTH, max_bytes = MAX_BYTES, max_elements = MAX_ELEMENTS):
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.max_elements = max_elements
+
+DEFAULT_LIMITS = parse_limits()
+
 class parser():
+    '''
+    Decodes dacp responses into element trees
+    limits - the parse_limits of a hardened parse, which walks the response with an 
+    explicit stack rather than recursing & rejects responses exceeding the limits.  By 
+    default the response is trusted.  The compiled codec decodes the response when it 
+    is built, enforcing the same limits
+    '''
     
-    def __init__(self):
-        self.nodes = ("arsv", "mupd", "msrv", "mdcl", "mccr", "cmst", "mlog", "agal", "mlcl", "mshl", "mlit", "abro", "abar", "apso", "caci", "avdb", "cmgt", "aply", "adbs", "cmpa")
-        self.strings = ("mcnm", "mcna", "minm", "cann", "cana", "canl", "asaa", "asal", "asar", "cmty", "cmnm")
-        self.number_types_by_length = { 1:"B", 2:"H", 4:"I", 8:"Q" }
+    def __init__(self, limits = None):
+        self.nodes = PARENT_TAGS
+        self.strings = STRING_TAGS
+        self.number_types_by_length = NUMBER_TYPES_BY_WIDTH
+        self.limits = limits
+        self.native = native
+        # the elements are only counted while metrics are enabled, so the walk is unchanged 
+        # otherwise.  Counting needs the python walk
+        if metrics.enabled:
+            self._walk = self._counted_walk
+            self.native = None
+        elif self.native is not None:
+            self._walk = self._native_walk
         
-    def parse(self, data, assert_status = True, allow_null = False):
+    def parse(self, data, assert_status = True, allow_null = False, lazy = False):
         '''
         Transform the supplied binary data into a structure of element objects.  Returns
         a parent_element.  
         assert_status - if true throws a parser_exception when the return code (mstt) != 200 (OK) 
         allow_null - if false throws a parser_exception when there are no data elements, otherwise return None
+        lazy - if true returns lazy_parent_elements which decode their children on first access
         '''
-        server_response = self._parse(data)
+        server_response = self._parse(data, lazy)
         if len(server_response) == 0:
             if allow_null:
                 return None
             else:
                 raise parser_exception("data did not contain any valid dacp elements")
         if len(server_response) > 1:
-            raise parser_exception("data contained too many elements: " + len(server_response))
+            raise parser_exception("data contained too many elements: %d" % len(server_response))
+        response = server_response[0]
+        if response.name not in self.nodes:
+            raise parser_exception("data did not contain a response, found element: %r" % response.name)
         if assert_status:
-            if server_response[0].assert_child("mstt").content != 200:
-                raise parser_exception("dacp error: " + server_response[0].assert_child("mstt").content)
-        return server_response[0]
+            status = response.assert_child("mstt").content
+            if status != 200:
+                raise parser_exception("dacp error: %s" % status)
+        return response
+        
+    def parse_listing(self, data, listing = "mlcl", assert_status = True):
+        '''
+        Decode the items of a listing response into a listing_table with a column for 
+        each tag found in the items
+        listing - the name of the child of the response holding the items
+        assert_status - if true throws a parser_exception when the return code (mstt) != 200 (OK) 
+        '''
+        items = self.parse(data, assert_status, lazy=True).assert_child(listing)
+        numbers, strings, rows = self._decode_items(items.view, items.start, items.end)
+        return self._table(numbers, strings, rows)
+        
+    def _decode_items(self, view, offset, end):
+        '''
+        Decode the items between offset and end into a number & a string column for each
+        tag, returning the columns by tag & the number of items.  The columns are not 
+        padded to the number of items
+        '''
+        numbers = {}
+        strings = {}
+        row = 0
+        for item_name, item_start, item_end in self._walk(view, offset, end):
+            for element_name, element_start, element_end in self._walk(view, item_start, item_end):
+                element_length = element_end - element_start
+                if element_name not in self.strings and element_name not in self.nodes and self.number_types_by_length.has_key(element_length):
+                    column = numbers.get(element_name)
+                    if column is None:
+                        column = numbers[element_name] = number_column(row)
+                    value = NUMBER_CONTENTS[self.number_types_by_length[element_length]].unpack_from(view, element_start)[0]
+                    column.append(row, value)
+                else:
+                    column = strings.get(element_name)
+                    if column is None:
+                        column = strings[element_name] = string_column(row)
+                    column.append(row, view[element_start:element_end])
+            row += 1
+        return numbers, strings, row
+        
+    def _table(self, numbers, strings, rows):
+        columns = {}
+        for tag, column in numbers.items() + strings.items():
+            column.pad(rows)
+            columns[tag] = column
+        return listing_table(columns, array.array("L", xrange(rows)))
         
-    def _parse(self, data):
+    def find(self, data, tags):
+        '''
+        Decode only the first element with each of the supplied names, wherever it is in
+        the response, stopping as soon as they have all been found.  Returns a dict of the
+        found elements by name, parent elements are lazy.  The response status is not
+        checked & the limits are enforced on the part of the response walked
+        '''
+        view = self._view(data)
+        wanted = set(tags)
+        found = {}
+        for depth, element_name, element_start, element_end in self._bounded_walk(view, 0, len(view)):
+            if element_name in wanted:
+                found[element_name] = self._element(view, element_name, element_start, element_end, True)
+                wanted.discard(element_name)
+                if len(wanted) == 0:
+                    break
+        return found
+    
+    def _view(self, data):
+        limits = self.limits
+        if limits is not None and len(data) > limits.max_bytes:
+            raise parser_exception("response of %d bytes exceeds the %d byte limit" % (len(data), limits.max_bytes))
+        return memoryview(data)
+    
+    def _parse(self, data, lazy = False):
+        view = self._view(data)
+        if self.native is not None:
+            return self._native_parse_range(view, 0, len(view), lazy)
+        if self.limits is not None:
+            return self._bounded_parse_range(view, 0, len(view), lazy)
+        return self._parse_range(view, 0, len(view), lazy)
+    
+    def _native_parse_range(self, view, offset, end, lazy = False, depth = 0):
+        limits = self.limits
+        if limits is None:
+            # the interpreter's recursion limit bounds the depth, as it does a python parse
+            max_depth, max_elements = 2 ** 31 - 1, sys.maxsize
+        else:
+            max_depth, max_elements = limits.max_depth, limits.max_elements
+        if not lazy:
+            if not gc.isenabled():
+                return self.native.decode(view, offset, end, depth, max_depth, max_elements)
+            # the decoded elements cannot form cycles, collecting while a large response
+            # is decoded only traverses the growing tree again & again
+            gc.disable()
+            try:
+                return self.native.decode(view, offset, end, depth, max_depth, max_elements)
+            finally:
+                gc.enable()
+        if limits is not None:
+            self.native.check(view, offset, end, depth, max_depth, max_elements)
+        return self._parse_range(view, offset, end, True)
+    
+    def _parse_range(self, view, offset, end, lazy = False):
         elements = []
-        remaining_data = data
-        while len(remaining_data) > 0:
-            data_length = len(remaining_data) - struct.calcsize("4sI")
-            element_name, element_length, temp_data = struct.unpack(">4sI" + str(data_length) + "s", remaining_data)
-            remaining_length = data_length - element_length
-            
-            '''
-            print "DEBUG ------------------------------"
-            print "parsing data len: ", len(remaining_data)
-            print "data_length: ", data_length
-            print "element_name: ", element_name
-            print "element_length: ", element_length
-            print "temp_data len: ", len(temp_data)
-            print "remaining_length: ", remaining_length
-            '''
-            
-            # if the element is a node type
-            if element_name in self.nodes:
-                element_data, remaining_data = struct.unpack(">" + str(element_length) + "s" + str(remaining_length) + "s", temp_data)
-                children = self._parse(element_data)
-                elements.append(parent_element(element_name, children))
-                continue
-            
-            # if the element is a string type
-            if element_name in self.strings:
-                element_data, remaining_data = struct.unpack(">" + str(element_length) + "s" + str(remaining_length) + "s", temp_data)
-                elements.append(string_content_element(element_name, element_data))
-                continue
+        for element_name, element_start, element_end in self._walk(view, offset, end):
+            elements.append(self._element(view, element_name, element_start, element_end, lazy))
+        return elements
+    
+    def _walk(self, view, offset, end):
+        '''
+        Walk the elements between offset and end of the supplied memoryview yielding the 
+        name, content start & content end offsets of each.  Elements are located by offset 
+        so the underlying data is never copied
+        '''
+        header_length = HEADER.size
+        while offset < end:
+            if end - offset < header_length:
+                raise parser_exception("truncated element header at offset %d" % offset)
+            element_name, element_length = HEADER.unpack_from(view, offset)
+            element_start = offset + header_length
+            element_end = element_start + element_length
+            if element_end > end:
+                raise parser_exception("element %s at offset %d overruns its parent by %d bytes" % (element_name, offset, element_end - end))
+            offset = element_end
+            yield element_name, element_start, element_end
+    
+    def _bounded_walk(self, view, offset, end, depth = 0):
+        '''
+        Walk every element between offset and end depth first, yielding the depth, name, 
+        content start & content end offsets of each.  The enclosing elements are held on an
+        explicit stack so hostile nesting cannot exhaust the interpreter stack, & the 
+        parse_limits are checked as each element is reached
+        depth - the depth of the elements at offset, when walking within an element
+        '''
+        limits = self.limits
+        if limits is None:
+            limits = DEFAULT_LIMITS
+        max_depth = limits.max_depth - depth
+        max_elements = limits.max_elements
+        header_length = HEADER.size
+        nodes = self.nodes
+        # the end offsets of the enclosing elements, innermost last
+        ends = [end]
+        elements = 0
+        while True:
+            while offset == ends[-1]:
+                ends.pop()
+                if len(ends) == 0:
+                    return
+            parent_end = ends[-1]
+            if parent_end - offset < header_length:
+                raise parser_exception("truncated element header at offset %d" % offset)
+            element_name, element_length = HEADER.unpack_from(view, offset)
+            element_start = offset + header_length
+            element_end = element_start + element_length
+            if element_end > parent_end:
+                raise parser_exception("element %s at offset %d overruns its parent by %d bytes" % (element_name, offset, element_end - parent_end))
+            if len(ends) > max_depth:
+                raise parser_exception("element %s at offset %d is nested deeper than %d" % (element_name, offset, limits.max_depth))
+            elements += 1
+            if elements > max_elements:
+                raise parser_exception("response contains more than %d elements" % max_elements)
+            yield depth + len(ends) - 1, element_name, element_start, element_end
+            if element_name in nodes:
+                ends.append(element_end)
+                offset = element_start
+            else:
+                offset = element_end
+    
+    def _bounded_parse_range(self, view, offset, end, lazy = False, depth = 0):
+        '''
+        Decode the elements between offset and end from a single bounded walk, without 
+        recursion.  A lazy parse still walks the whole range so the limits are enforced 
+        before any element is returned, only the outermost elements are decoded
+        '''
+        if self.native is not None:
+            return self._native_parse_range(view, offset, end, lazy, depth)
+        elements = []
+        # the child lists being filled, by depth relative to the range
+        open_children = [elements]
+        counting = metrics.enabled
+        counts = {}
+        sizes = {}
+        for element_depth, element_name, element_start, element_end in self._bounded_walk(view, offset, end, depth):
+            level = element_depth - depth
+            if lazy:
+                if level > 0:
+                    continue
+                element = self._element(view, element_name, element_start, element_end, True)
+            elif element_name in self.nodes:
+                children = []
+                element = parent_element(element_name, children)
+                del open_children[level + 1:]
+                open_children.append(children)
+            else:
+                element = self._element(view, element_name, element_start, element_end)
+            open_children[level].append(element)
+            if counting:
+                counts[element_name] = counts.get(element_name, 0) + 1
+                sizes[element_name] = sizes.get(element_name, 0) + element_end - element_start
+        if counting:
+            self._record(counts, sizes)
+        return elements
+    
+    def _record(self, counts, sizes):
+        for element_name, count in counts.iteritems():
+            metrics.parsed_elements.increment(count, element_name)
+            metrics.parsed_bytes.increment(sizes[element_name] + count * HEADER.size, element_name)
+    
+    def _native_walk(self, view, offset, end):
+        try:
+            return iter(self.native.walk(view, offset, end))
+        except parser_exception:
+            # the python walk yields the elements before the bad one, as callers descend
+            # into them before reaching it & may fail there first
+            return parser._walk(self, view, offset, end)
+    
+    def _counted_walk(self, view, offset, end):
+        # tallied locally & added to the metrics once the walk is finished or abandoned
+        counts = {}
+        sizes = {}
+        try:
+            for element_name, element_start, element_end in parser._walk(self, view, offset, end):
+                counts[element_name] = counts.get(element_name, 0) + 1
+                sizes[element_name] = sizes.get(element_name, 0) + element_end - element_start
+                yield element_name, element_start, element_end
+        finally:
+            self._record(counts, sizes)
+    
+    def _element(self, view, element_name, element_start, element_end, lazy = False):
+        '''
+        Decode the single element whose content lies between element_start and element_end
+        '''
+        # if the element is a node type
+        if element_name in self.nodes:
+            if lazy:
+                return lazy_parent_element(element_name, self, view, element_start, element_end)
+            children = self._parse_range(view, element_start, element_end)
+            return parent_element(element_name, children)
+        
+        # if the element is a string type
+        if element_name in self.strings:
+            element_data = view[element_start:element_end].tobytes()
+            return string_content_element(element_name, element_data)
+        
+        # if the element length matches one of the number types
+        element_length = element_end - element_start
+        if self.number_types_by_length.has_key(element_length):
+            number_type = self.number_types_by_length[element_length]
+            element_data = NUMBER_CONTENTS[number_type].unpack_from(view, element_start)[0]
+            return number_content_element(element_name, element_data, number_type)
+        
+        # otherwise convert the data to hex
+        hex = binascii.b2a_hex(view[element_start:element_end].tobytes()).upper()
+        return hex_content_element(element_name, hex)
+
+class stream_decoder():
+    '''
+    Incrementally decodes a dacp response as it arrives, so that elements can be used 
+    before the whole response has been received.  Node elements are descended into and 
+    every other element is emitted whole as soon as its last byte has arrived.  Only 
+    the partially received element is buffered.
+    element_parser - the parser used to decode the emitted elements, if it has limits 
+    each element is rejected as soon as its header shows it exceeds them
+    emit - names of node elements to emit whole rather than descend into, by default 
+    the mlit items of a listing
+    '''
+    
+    def __init__(self, element_parser = None, emit = ("mlit",)):
+        if element_parser is None:
+            element_parser = parser()
+        self.parser = element_parser
+        self.emit = emit
+        self.buffer = bytearray()
+        self.offset = 0
+        self.consumed = 0
+        self.open = []
+        self.counting = metrics.enabled
+        self.limits = self.parser.limits
+        self.elements = 0
+        
+    def feed(self, chunk):
+        '''
+        Add a chunk of response data, returning a generator of (path, element) tuples 
+        for the elements completed by it.  path is the tuple of names of the enclosing 
+        node elements.  The generator must be consumed before the next chunk is fed
+        '''
+        # discard the data used by previously emitted elements
+        if self.offset > 0:
+            del self.buffer[:self.offset]
+            self.consumed += self.offset
+            self.offset = 0
+        self.buffer.extend(chunk)
+        return self._decode()
+    
+    def close(self):
+        '''
+        Signal the end of the response, throws a parser_exception if it was truncated
+        '''
+        self._close_finished()
+        if len(self.buffer) > self.offset or len(self.open) > 0:
+            raise parser_exception("response truncated at offset %d" % (self.consumed + self.offset))
+        
+    def _close_finished(self):
+        position = self.consumed + self.offset
+        while len(self.open) > 0 and self.open[-1][1] == position:
+            self.open.pop()
+        
+    def _check_limits(self, element_name, element_length):
+        position = self.consumed + self.offset
+        if len(self.open) >= self.limits.max_depth:
+            raise parser_exception("element %s at offset %d is nested deeper than %d" % (element_name, position, self.limits.max_depth))
+        if element_length > self.limits.max_bytes - HEADER.size:
+            raise parser_exception("element %s at offset %d of %d bytes exceeds the %d byte limit" % (element_name, position, element_length, self.limits.max_bytes))
+        if self.elements >= self.limits.max_elements:
+            raise parser_exception("response contains more than %d elements" % self.limits.max_elements)
+        
+    def _decode(self):
+        header_length = HEADER.size
+        while True:
+            self._close_finished()
+            if len(self.buffer) - self.offset < header_length:
+                return
+            element_name, element_length = HEADER.unpack_from(self.buffer, self.offset)
+            element_end = self.consumed + self.offset + header_length + element_length
+            if len(self.open) > 0 and element_end > self.open[-1][1]:
+                raise parser_exception("element %s at offset %d overruns its parent by %d bytes" % (element_name, self.consumed + self.offset, element_end - self.open[-1][1]))
+            if self.limits is not None:
+                self._check_limits(element_name, element_length)
             
-            # if the element length matches one of the number types
-            if self.number_types_by_length.has_key(element_length):
-                number_type = self.number_types_by_length[element_length]
-                element_data, remaining_data = struct.unpack(">" + number_type + str(remaining_length) + "s", temp_data)
-                elements.append(number_content_element(element_name, element_data, number_type))
+            if element_name in self.parser.nodes and element_name not in self.emit:
+                self.elements += 1
+                self.offset += header_length
+                self.open.append((element_name, element_end))
                 continue
             
-            # otherwise convert the data to hex
-            element_data, remaining_data = struct.unpack(">" + str(element_length) + "s" + str(remaining_length) + "s", temp_data)
-            hex = binascii.b2a_hex(element_data).upper()
-            elements.append(hex_content_element(element_name, hex))
-            
-        return elements
\ No newline at end of file
+            if len(self.buffer) - self.offset < header_length + element_length:
+                return
+            self.elements += 1
+            start = self.offset + header_length
+            if self.limits is not None and element_name in self.parser.nodes:
+                # decode the emitted element with the bounded walk, continuing the depth
+                element_data = str(self.buffer[self.offset:start + element_length])
+                element = self.parser._bounded_parse_range(memoryview(element_data), 0, len(element_data), depth=len(self.open))[0]
+            else:
+                element_data = str(self.buffer[start:start + element_length])
+                element = self.parser._element(memoryview(element_data), element_name, 0, element_length)
+                if self.counting:
+                    metrics.parsed_elements.increment(1, element_name)
+                    metrics.parsed_bytes.increment(header_length + element_length, element_name)
+            self.offset = start + element_length
+            yield tuple(name for name, end in self.open), element
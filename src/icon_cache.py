@@ -0,0 +1,57 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+The icons shown by the indicators.  Each icon is loaded or rendered the first time it 
+is used & then shared by every indicator, gtk itself is only imported once an icon is 
+needed.
+'''
+
+class icon_cache():
+    '''
+    The loaded icons keyed by file name or stock id
+    resources - the directory holding the icon files
+    '''
+    
+    def __init__(self, resources):
+        self.resources = resources
+        self.icons = {}
+        self.helper = None
+        
+    def get_file(self, name):
+        '''
+        Returns the pixbuf of an icon file in the resources directory
+        '''
+        icon = self.icons.get(name)
+        if icon is None:
+            import gtk
+            icon = gtk.gdk.pixbuf_new_from_file(self.resources + name)
+            self.icons[name] = icon
+        return icon
+    
+    def get_stock(self, stock_id):
+        '''
+        Returns the menu sized pixbuf of a gtk stock icon
+        '''
+        icon = self.icons.get(stock_id)
+        if icon is None:
+            import gtk
+            if self.helper is None:
+                # stock icons are rendered through a widget so they follow the theme
+                self.helper = gtk.Button()
+            icon = self.helper.render_icon(stock_id, gtk.ICON_SIZE_MENU)
+            self.icons[stock_id] = icon
+        return icon
@@ -18,21 +18,21 @@
 '''
 
 '''
-Python itunes remote controller
+Python itunes remote controller.  The indicator applet front end, a subscriber to the
+headless remote_daemon
 '''
 
+import time
+# taken before anything else is imported so the startup timing covers the imports
+STARTED = time.time()
+
 import indicate
 import gobject
-import gtk
-import time
-import threading
-import gconf
-import dacp_serialisation
-import httplib
 import os
-import pynotify
+import sys
 import signal
-import pairing_service
+import remote_daemon
+import icon_cache
 
 try:
     import avahi, dbus
@@ -41,308 +41,233 @@ except ImportError:
     print "To use itunes remote applet you need to install Avahi and python-dbus."
     sys.exit(1)
 
-SETTINGS_PAIRINGS = "/apps/itunes-remote-applet/pairings/"
-SERVICE_ID_PROPERTY = "MID"
-LOGIN_TEMPLATE = "/login?pairing-guid=0x%s"
-PLAY_STATUS_UPDATE_TEMPLATE = "/ctrl-int/1/playstatusupdate?revision-number=%d&session-id=%s"
-PLAY_PAUSE_TEMPLATE = "/ctrl-int/1/playpause?session-id=%s"
-NEXT_ITEM_TEMPLATE = "/ctrl-int/1/nextitem?session-id=%s"
-PREV_ITEM_TEMPLATE = "/ctrl-int/1/previtem?session-id=%s"
+# the pairing gui (gtk & glade), the library mirror (sqlite) & pynotify are imported
+# when they are first used, so they do not delay the first indicator
 
-PLAY_PAUSE_COMMAND = "play-pause"
-NEXT_TRACK_COMMAND = "next-track"
-PREV_TRACK_COMMAND = "prev-track"
-QUERY_TRACK_COMMAND = "query-track"
+RESOURCES = "/usr/share/itunes-remote-applet/" #"/media/disk/apps/workspaces/python/itunes-remote"
+PAIRING_GUI = RESOURCES + "pairing-gui.glade"
 
-PLAY_STATUS_STOPPED = 2
-PLAY_STATUS_PAUSED = 3
-PLAY_STATUS_PLAYING = 4
+PAIRED_SERVICE_ICON = "emblem-default.png"
+UNPAIRED_SERVICE_ICON = "emblem-generic.png"
+CONNECTED_SERVICE_ICON = "audio-x-generic.png"
+DEFAULT_ARTWORK = "audio-x-generic.png"
+STOCK_MEDIA_PLAY = "gtk-media-play"
+STOCK_MEDIA_PAUSE = "gtk-media-pause"
+STOCK_MEDIA_STOP = "gtk-media-stop"
+STOCK_MEDIA_NEXT = "gtk-media-next"
 
-RESOURCES = "/usr/share/itunes-remote-applet/" #"/media/disk/apps/workspaces/python/itunes-remote"
+# set to print the time taken to show the first indicator
+STARTUP_TIMING_VARIABLE = "ITUNES_REMOTE_STARTUP_TIMING"
 
-class service_exception(Exception):
-    
-    def __init__(self, message):
-        Exception.__init__(self, message)
+def decode_artwork(data):
+    '''
+    Decode an image into a pixbuf, returning the pixbuf & its size in bytes
+    '''
+    import gtk
+    loader = gtk.gdk.PixbufLoader()
+    loader.write(data)
+    loader.close()
+    pixbuf = loader.get_pixbuf()
+    return pixbuf, pixbuf.get_rowstride() * pixbuf.get_height()
 
-class track_info():
-    
-    def __init__(self, status):
-        self.track = status.assert_child("cann").content
-        self.artist = status.assert_child("cana").content
-        self.album = status.assert_child("canl").content
-    
-class service_control_thread(threading.Thread):
+class service_indicator():
     '''
-    Itunes status & control thread.  Performs two functions:
-    
-    1) Listen to the itunes status broadcasts and relay status changes to the applet
-    2) Issue commands to itunes
+    The indicators of a single service: the service itself and, while it is selected,
+    its play status & next track
+    icons - the icon_cache shared by all the indicators, the play status icons are
+    only loaded once the service is selected
     '''
     
-    def __init__(self, host, port, pairing_guid):
-        threading.Thread.__init__(self)
-        self.host = host
-        self.port = port
-        self.pairing_guid = pairing_guid
-        self.current_track = None
+    def __init__(self, applet, service):
+        self.applet = applet
+        self.service = service
+        self.icons = applet.icons
         self.notification = None
         
-        helper = gtk.Button()
-        self.notification_ico = gtk.gdk.pixbuf_new_from_file(RESOURCES + "audio-x-generic.png")
-
-    def run(self):
-        login = self.make_request(LOGIN_TEMPLATE % self.pairing_guid)
-        self.session_id = login.assert_child("mlid").content
-        
-        revision_number = 1
-        while True:
-            status = self.make_request(PLAY_STATUS_UPDATE_TEMPLATE % (revision_number, self.session_id)).assert_self("cmst")
-            play_status = status.assert_child("caps").content
-            if play_status == PLAY_STATUS_STOPPED:
-                gobject.idle_add(self.applet_controller.set_play_status, play_status, None, None)
-            else:
-                self.track_info = track_info(status)
-                gobject.idle_add(self.applet_controller.set_play_status, play_status, self.track_info.track, self.track_info.artist)
-                self.display_notification()
-            revision_number = status.assert_child("cmsr").content
-    
-    def display_notification(self):
-        title = self.track_info.track + " - " + self.track_info.artist
-        message = self.track_info.album
-        if self.notification is None:
-            self.notification = pynotify.Notification(title, message, "notification-message-email")
-            self.notification.set_icon_from_pixbuf(self.notification_ico)
-            self.notification.show()
-        else:
-            self.notification.update(title, message)
-            self.notification.show()
-        
-    
-    def make_request(self, url, allow_null = False):
-        '''
-        Make a request to the supplied url and return the resulting dacp response object
-        '''
-        headers = {"Viewer-Only-Client": "1"}
-        c = httplib.HTTPConnection(self.host, self.port)
-        c.request("GET", url, "", headers)
-        
-        r = c.getresponse();
-        rd = r.read()
-        c.close()
-         
-        parser = dacp_serialisation.parser()
-        return parser.parse(rd, allow_null=allow_null)
-    
-    def toggle_play(self, indicator):
-        self.make_request(PLAY_PAUSE_TEMPLATE % self.session_id, True)
-        
-    def next_track(self, indicator):
-        self.make_request(NEXT_ITEM_TEMPLATE % self.session_id, True)
-        
-    def prev_track(self, indicator):
-        self.make_request(PREV_ITEM_TEMPLATE % self.session_id, True)
-    
-class indicator_applet_controller():
-    
-    def __init__(self, indicator, service_control_thread, named_pipe_controller):
-        
-        self.service_controller = service_control_thread
-        self.named_pipe_controller = named_pipe_controller
-        
-        helper = gtk.Button()
-        self.paired_service_ico = gtk.gdk.pixbuf_new_from_file(RESOURCES + "emblem-default.png")
-        self.connected_service_ico = gtk.gdk.pixbuf_new_from_file(RESOURCES + "audio-x-generic.png")
-        self.play_ico = helper.render_icon(gtk.STOCK_MEDIA_PLAY, gtk.ICON_SIZE_MENU)
-        self.stop_ico = helper.render_icon(gtk.STOCK_MEDIA_STOP, gtk.ICON_SIZE_MENU)
-        self.pause_ico = helper.render_icon(gtk.STOCK_MEDIA_PAUSE, gtk.ICON_SIZE_MENU)
-        self.next_ico = helper.render_icon(gtk.STOCK_MEDIA_NEXT, gtk.ICON_SIZE_MENU)
+        self.indicator = indicate.Indicator()
+        self.indicator.set_property("name", service.name)
+        self.indicator.connect("user-display", self.activate)
         
         self.play_status = indicate.Indicator()
-        self.play_status.connect("user-display", self.service_controller.toggle_play)
+        self.play_status.connect("user-display", lambda indicator: self.service.toggle_play())
         
         self.next = indicate.Indicator()
-        self.next.set_property_icon("icon", self.next_ico)
         self.next.set_property("name", "Next track")
-        self.next.connect("user-display", self.service_controller.next_track)
+        self.next.connect("user-display", lambda indicator: self.service.next_track())
         
-        self.indicator = indicator
-        self.indicator.set_property_icon("icon", self.paired_service_ico)
+        self.show_service()
     
-    def select(self, indicator):
-        if self.service_controller is None:
-            print "Error: service controller thread not set"
-            return
-        
-        if self.named_pipe_controller.service_controller is not None:
-            # for some reason this is called before unselect, just ignore these calls
-            return
-        
-        if not self.service_controller.isAlive():
-            self.service_controller.start()
-            
-        self.named_pipe_controller.service_controller = self.service_controller
-        self.indicator.set_property_icon("icon", self.connected_service_ico)
-        self.indicator.connect("user-display", self.unselect)
+    def activate(self, indicator):
+        daemon = self.applet.daemon
+        if not self.service.is_paired():
+            daemon.pair(self.service.service_id)
+        elif daemon.selected is self.service:
+            daemon.unselect()
+        else:
+            daemon.select(self.service.service_id)
+    
+    def show_service(self):
+        if self.service.is_paired():
+            self.indicator.set_property_icon("icon", self.icons.get_file(PAIRED_SERVICE_ICON))
+        else:
+            self.indicator.set_property_icon("icon", self.icons.get_file(UNPAIRED_SERVICE_ICON))
+        self.indicator.show()
+    
+    def select(self):
+        self.indicator.set_property_icon("icon", self.icons.get_file(CONNECTED_SERVICE_ICON))
+        self.next.set_property_icon("icon", self.icons.get_stock(STOCK_MEDIA_NEXT))
         self.play_status.show()
         self.next.show()
     
-    def unselect(self, indicator):
-        self.indicator.set_property_icon("icon", self.paired_service_ico)
-        self.named_pipe_controller.service_controller = None
-        self.indicator.connect("user-display", self.select)
+    def unselect(self):
+        self.indicator.set_property_icon("icon", self.icons.get_file(PAIRED_SERVICE_ICON))
         self.play_status.hide()
         self.next.hide()
-        
-    def set_play_status(self, playing, current_track, track_artist):
-        if playing == PLAY_STATUS_STOPPED:
-            self.play_status.set_property_icon("icon", self.stop_ico)
+    
+    def set_play_status(self):
+        playing = self.service.play_status
+        if playing == remote_daemon.PLAY_STATUS_STOPPED:
+            self.play_status.set_property_icon("icon", self.icons.get_stock(STOCK_MEDIA_STOP))
             self.play_status.set_property("name", "Stopped")
             self.next.hide()
         else:
-            self.play_status.set_property("name", track_artist + " - " + current_track)
-            if playing == PLAY_STATUS_PAUSED:
-                self.play_status.set_property_icon("icon", self.pause_ico)
-            if playing == PLAY_STATUS_PLAYING:
-                self.play_status.set_property_icon("icon", self.play_ico)
+            track_info = self.service.track_info
+            self.play_status.set_property("name", track_info.artist + " - " + track_info.track)
+            if playing == remote_daemon.PLAY_STATUS_PAUSED:
+                self.play_status.set_property_icon("icon", self.icons.get_stock(STOCK_MEDIA_PAUSE))
+            if playing == remote_daemon.PLAY_STATUS_PLAYING:
+                self.play_status.set_property_icon("icon", self.icons.get_stock(STOCK_MEDIA_PLAY))
             self.next.show()
         self.play_status.show()
-        
+    
+    def display_notification(self):
+        track_info = self.service.track_info
+        if track_info is None:
+            return
+        title = track_info.track + " - " + track_info.artist
+        message = track_info.album
+        icon = self.service.current_artwork()
+        if icon is None:
+            icon = self.icons.get_file(DEFAULT_ARTWORK)
+        if self.notification is None:
+            import pynotify
+            if not pynotify.is_initted() and not pynotify.init("iTunes Controller"):
+                print "Error: failed to initialise pynotify"
+                return
+            self.notification = pynotify.Notification(title, message, "notification-message-email")
+        else:
+            self.notification.update(title, message)
+        self.notification.set_icon_from_pixbuf(icon)
+        self.notification.show()
+    
     def remove(self):
         self.indicator.hide()
-        self.named_pipe_controller.service_controller = None
-    
-class named_pipe_controller(threading.Thread):
+        self.play_status.hide()
+        self.next.hide()
+
+class pairing_dialog():
     '''
-    Listens for commands on the supplied named pipe and invokes 
-    the appropriate method on the service_controller
+    Shows the 4 digit pairing code until pairing finishes or the dialog is closed,
+    closing the dialog cancels the pairing
     '''
     
-    def __init__(self, pipe_name):
-        threading.Thread.__init__(self)
-        self.service_controller = None
-        self.pipe_name = pipe_name
-        
-    def run(self):
-        if os.path.exists(self.pipe_name):
-            os.unlink(self.pipe_name)
-        os.mkfifo(self.pipe_name)
-        while True:
-            pipe = open(self.pipe_name, "r")
-            cmd = pipe.readline().rstrip()
-            self.command(cmd)
-                    
-    def command(self, cmd):
-        if cmd == "":
-            return
-            
-        if self.service_controller is None:
-            return
-        
-        if cmd == NEXT_TRACK_COMMAND:
-            self.service_controller.next_track(None)
-            return
-        
-        if cmd == PREV_TRACK_COMMAND:
-            self.service_controller.prev_track(None)
-            return
-            
-        if cmd == PLAY_PAUSE_COMMAND:
-            self.service_controller.toggle_play(None)
-            return
-        
-        if cmd == QUERY_TRACK_COMMAND:
-            self.service_controller.display_notification()
-            return;
-        
-        print "Error: unknown command: " + cmd
- 
-class base_service():
+    def __init__(self, daemon, pairing_code):
+        import gtk.glade
+        self.daemon = daemon
+        wTree = gtk.glade.XML(PAIRING_GUI, "itunes_remote_pairing_gui", "iTunes Remote Applet")
+        self.window = wTree.get_widget("itunes_remote_pairing_gui")
+        self.window.set_title("iTunes Pairing")
+        wTree.get_widget("label_code").set_markup("<span  size=\"xx-large\" weight=\"bold\">%d %d %d %d</span>" % pairing_code)
+        signals = {  "on_button_cancel_clicked" : self._close_dialog, "gtk_main_quit" : self._cancel_pairing}
+        wTree.signal_autoconnect(signals)
+        self.window.show_all()
     
-    def __init__(self, host, port, indicator):
-        self.host = host
-        self.port = port
-        self.indicator = indicator
-        self.is_base = True
-        
-    def remove(self):
-        self.indicator.hide()
-            
-class controller():
+    def close(self):
+        if self.window is not None:
+            window = self.window
+            self.window = None
+            window.destroy()
+    
+    def _close_dialog(self, button_widget):
+        self.close()
+    
+    def _cancel_pairing(self, window):
+        self.window = None
+        self.daemon.cancel_pairing()
+
+class indicator_applet():
+    '''
+    The indicator applet front end.  Subscribes to the daemon and shows an indicator
+    for each service, the play status of the selected service & track notifications
+    '''
     
-    def __init__(self):
-        self.services = {}
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.indicators = {}
+        self.pairing_dialog = None
+        self.first_indicator_shown = False
+        # loaded on first use & shared by all the services
+        self.icons = icon_cache.icon_cache(RESOURCES)
         self.server = indicate.indicate_server_ref_default()
         self.server.set_type("message.mail")
         self.server.set_desktop_file("/usr/share/applications/itunes-remote-applet.desktop")
-        self.named_pipe_controller = named_pipe_controller("/tmp/itunes-controller")
-        self.named_pipe_controller.start()
-        
-        helper = gtk.Button()
-        self.unpaired_service_ico = gtk.gdk.pixbuf_new_from_file(RESOURCES + "emblem-generic.png")
-        
-    def service_added(self, interface, protocol, name, type, domain, flags):
-        interface, protocol, name, type, domain, host, aprotocol, address, port, txt, flags = server.ResolveService(interface, protocol, name, type, domain, avahi.PROTO_UNSPEC, dbus.UInt32(0))
-        service_id = name + '.' + type + '.' + domain
-        
-        properties = {}
-        for t in txt:
-            # convert the dbus byte arrays into strings, split into KV pairs and store in a map
-            as_string = "".join(chr(b) for b in t)
-            key_value_pair = as_string.split("=")
-            properties[key_value_pair[0]] = key_value_pair[1]
-            
-        service_id = properties[SERVICE_ID_PROPERTY].replace("0x", "", 1)
+        daemon.subscribe(self.event)
+    
+    def event(self, event, service, data):
+        if event == remote_daemon.SERVICE_ADDED:
+            self.indicators[service.service_id] = service_indicator(self, service)
+            self._indicator_shown()
+            return
         
-        base = base_service(host, port, indicate.Indicator()) 
-        base.indicator.set_property("name", name)
-        self.services.update({service_id: base})
-        self.service_available(service_id)
+        if event == remote_daemon.PAIRING_STARTED:
+            self.pairing_dialog = pairing_dialog(self.daemon, data)
+            return
         
-    def service_available(self, service_id):
-        service = self.services.get(service_id)
-        client = gconf.client_get_default()
-        pairing_guid = client.get_string(SETTINGS_PAIRINGS + service_id)
-        if pairing_guid:
-            control_thread = service_control_thread(service.host, service.port, pairing_guid)
-            applet_controller = indicator_applet_controller(service.indicator, control_thread, self.named_pipe_controller)
-            control_thread.applet_controller = applet_controller
-            service.indicator.connect("user-display", applet_controller.select)
-            service.indicator.show()
-            
-            self.services.update({service_id: applet_controller})
-        else:
-            pairing = pairing_service.pairing_service(self)
-            service.indicator.set_property_icon("icon", self.unpaired_service_ico)
-            service.indicator.connect("user-display", pairing.activate)
-            service.indicator.show()
+        if event == remote_daemon.PAIRING_FINISHED:
+            if self.pairing_dialog is not None:
+                self.pairing_dialog.close()
+                self.pairing_dialog = None
+            return
         
-    def service_removed(self, interface, protocol, name, type, domain):
-        service_id = name + '.' + type + '.' + domain
-        service = self.services.pop(service_id)
-        service.remove()
+        indicator = self.indicators.get(service.service_id)
+        if indicator is None:
+            return
         
-# this allows CTRL-C to exit the gtk main loop
+        if event == remote_daemon.SERVICE_REMOVED:
+            del self.indicators[service.service_id]
+            indicator.remove()
+        elif event == remote_daemon.SERVICE_PAIRED:
+            indicator.show_service()
+        elif event == remote_daemon.SERVICE_SELECTED:
+            indicator.select()
+        elif event == remote_daemon.SERVICE_UNSELECTED:
+            indicator.unselect()
+        elif event == remote_daemon.STATUS_CHANGED:
+            indicator.set_play_status()
+            if data:
+                indicator.display_notification()
+        elif event in (remote_daemon.ARTWORK_AVAILABLE, remote_daemon.TRACK_QUERIED):
+            indicator.display_notification()
+    
+    def _indicator_shown(self):
+        if not self.first_indicator_shown:
+            self.first_indicator_shown = True
+            if os.environ.has_key(STARTUP_TIMING_VARIABLE):
+                print "startup: first indicator after %.1f ms" % ((time.time() - STARTED) * 1000)
+                sys.stdout.flush()
+
+# this allows CTRL-C to exit the main loop
 signal.signal(signal.SIGINT, signal.SIG_DFL)
-        
-gobject.threads_init()
 
-# initialise pop-up notifications
-if not pynotify.init("iTunes Controller"):
-    syslog.syslog(syslog.LOG_ERR, "Failed to initialise pynotify.  Exiting")
-    sys.exit(-100)
+gobject.threads_init()
 
-controller = controller()
+daemon = remote_daemon.remote_daemon(decode_artwork=decode_artwork)
+applet = indicator_applet(daemon)
+daemon.start()
 
 DBusGMainLoop(set_as_default=True)
-    
-bus = dbus.SystemBus()
-server = dbus.Interface(bus.get_object(avahi.DBUS_NAME, avahi.DBUS_PATH_SERVER), avahi.DBUS_INTERFACE_SERVER)
 
-stype = "_daap._tcp"
-domain = "local"
-browser = dbus.Interface(bus.get_object(avahi.DBUS_NAME, server.ServiceBrowserNew(avahi.IF_UNSPEC, avahi.PROTO_UNSPEC, stype, domain, dbus.UInt32(0))), avahi.DBUS_INTERFACE_SERVICE_BROWSER)
-browser.connect_to_signal('ItemNew', controller.service_added)
-browser.connect_to_signal('ItemRemove', controller.service_removed)
+daemon.browse(dbus.SystemBus(), "_daap._tcp", "local")
 
-gtk.main()
\ No newline at end of file
+# gtk is not needed until an icon or the pairing gui is shown, the glib loop runs both
+gobject.MainLoop().run()
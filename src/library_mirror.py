@@ -0,0 +1,193 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+A local copy of the tracks in an itunes library, held in sqlite.  The full listing is 
+downloaded once, after that only the changes since the last synchronised library 
+revision are requested.
+'''
+
+import os
+import sqlite3
+import threading
+
+import dacp_serialisation
+
+UPDATE_TEMPLATE = "/update?revision-number=1&session-id=%s"
+DATABASES_TEMPLATE = "/databases?session-id=%s"
+ITEMS_TEMPLATE = "/databases/%d/items?type=music&meta=dmap.itemid,dmap.persistentid,dmap.itemname,daap.songartist,daap.songalbum&revision-number=%d&session-id=%s"
+ITEMS_DELTA_TEMPLATE = ITEMS_TEMPLATE + "&delta=%d"
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER)",
+    "CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, persistent_id TEXT, name TEXT, artist TEXT, album TEXT)" )
+# full text search is used where sqlite has been built with it
+SEARCH_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS items_search USING fts3(name, artist, album)"
+# the items stored at a time as the listing is read, so only these are held in memory
+STORE_BATCH_SIZE = 1000
+
+class library_mirror():
+    '''
+    The local copy of a library
+    service - the service_controller whose session is used to fetch the library
+    path - the sqlite database file
+    '''
+    
+    def __init__(self, service, path):
+        self.service = service
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        connection = self._connect()
+        try:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            try:
+                connection.execute(SEARCH_SCHEMA)
+                self.full_text = True
+            except sqlite3.OperationalError:
+                self.full_text = False
+            connection.commit()
+        finally:
+            connection.close()
+            
+    def sync_in_background(self, callback = None):
+        '''
+        Synchronise from a worker thread so the main loop is not blocked, callback is 
+        called from the worker with None or the exception once it is complete
+        '''
+        def run():
+            try:
+                self.sync()
+                exception = None
+            except Exception, e:
+                print "Error: library sync with %s:%d failed: %s" % (self.service.host, self.service.port, e)
+                exception = e
+            if callback is not None:
+                callback(exception)
+        thread = threading.Thread(target=run)
+        thread.setDaemon(True)
+        thread.start()
+            
+    def sync(self):
+        '''
+        Bring the local copy up to the current library revision, returning the number of 
+        items added or updated.  Only one synchronisation runs at a time
+        '''
+        self.lock.acquire()
+        try:
+            session_id = self.service.session_id
+            update = self.service.make_request(UPDATE_TEMPLATE % session_id)
+            revision = update.assert_child("musr").content
+            connection = self._connect()
+            try:
+                state = dict(connection.execute("SELECT key, value FROM state").fetchall())
+                if state.get("revision") == revision:
+                    return 0
+                database_id = state.get("database")
+                if database_id is None:
+                    databases = self.service.make_request(DATABASES_TEMPLATE % session_id)
+                    database_id = databases.assert_child("mlcl").assert_child("mlit").assert_child("miid").content
+                if state.has_key("revision"):
+                    url = ITEMS_DELTA_TEMPLATE % (database_id, revision, session_id, state["revision"])
+                else:
+                    url = ITEMS_TEMPLATE % (database_id, revision, session_id)
+                updated = self._apply(connection, self.service.stream_request(url))
+                connection.execute("INSERT OR REPLACE INTO state VALUES ('revision', ?)", (revision,))
+                connection.execute("INSERT OR REPLACE INTO state VALUES ('database', ?)", (database_id,))
+                connection.commit()
+                return updated
+            finally:
+                connection.close()
+        finally:
+            self.lock.release()
+            
+    def search(self, text, limit = 20):
+        '''
+        Returns up to limit (id, name, artist, album) tuples of the tracks matching the text
+        '''
+        connection = self._connect()
+        try:
+            if self.full_text:
+                # match every word as a prefix in any of the columns
+                query = " ".join(['"%s*"' % word.replace('"', '') for word in text.split()])
+                return connection.execute("SELECT items.id, items.name, items.artist, items.album FROM items_search JOIN items ON items.id = items_search.docid WHERE items_search MATCH ? LIMIT ?", (query, limit)).fetchall()
+            pattern = "%" + text + "%"
+            return connection.execute("SELECT id, name, artist, album FROM items WHERE name LIKE ? OR artist LIKE ? OR album LIKE ? LIMIT ?", (pattern, pattern, pattern, limit)).fetchall()
+        finally:
+            connection.close()
+        
+    def _apply(self, connection, elements):
+        '''
+        Store the items of a full or delta listing as they are decoded & remove the items 
+        it reports deleted, returning the number of items stored
+        elements - the (path, element) tuples of the listing, as service.stream_request 
+        returns them
+        '''
+        status = None
+        rows = []
+        deleted = []
+        stored = 0
+        for path, element in elements:
+            parent = path[-1:]
+            if parent == ("mlcl",) and element.name == "mlit":
+                rows.append(self._row(element))
+                if len(rows) >= STORE_BATCH_SIZE:
+                    self._store(connection, rows)
+                    stored += len(rows)
+                    rows = []
+            elif parent == ("mudl",) and element.name == "miid":
+                deleted.append((element.content,))
+            elif len(path) == 1 and element.name == "mstt":
+                status = element.content
+                if status != 200:
+                    raise dacp_serialisation.parser_exception("dacp error: %s" % status)
+        if status is None:
+            raise dacp_serialisation.parser_exception("listing contained no status")
+        self._store(connection, rows)
+        connection.executemany("DELETE FROM items WHERE id = ?", deleted)
+        if self.full_text:
+            connection.executemany("DELETE FROM items_search WHERE docid = ?", deleted)
+        return stored + len(rows)
+    
+    def _row(self, item):
+        '''
+        The items table row of a listing item, only the first occurrence of a tag is kept
+        '''
+        fields = {}
+        for child in item.children:
+            if not fields.has_key(child.name):
+                fields[child.name] = child.content
+        persistent_id = fields.get("mper")
+        if persistent_id is not None:
+            persistent_id = "%016X" % persistent_id
+        return (fields["miid"], persistent_id, self._text(fields.get("minm")), self._text(fields.get("asar")), self._text(fields.get("asal")))
+    
+    def _store(self, connection, rows):
+        connection.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)", rows)
+        if self.full_text:
+            connection.executemany("DELETE FROM items_search WHERE docid = ?", [(row[0],) for row in rows])
+            connection.executemany("INSERT INTO items_search (docid, name, artist, album) VALUES (?, ?, ?, ?)", [(row[0], row[2], row[3], row[4]) for row in rows])
+    
+    def _text(self, value):
+        if value is None:
+            return None
+        return value.decode("utf-8", "replace")
+    
+    def _connect(self):
+        return sqlite3.connect(self.path)
@@ -0,0 +1,221 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Latency histograms & counters for the request, parse, status & command paths.  Recording
+is off by default: the instrumented code tests the module level enabled flag before
+taking any timings, so the disabled cost is a single attribute lookup.  The metrics are
+exported as JSON on the control socket or in the prometheus text format over http.
+'''
+
+import bisect
+import errno
+import json
+import os
+import socket
+
+# set to record metrics from startup, & to serve the prometheus format on a port
+ENABLED_VARIABLE = "ITUNES_REMOTE_METRICS"
+PORT_VARIABLE = "ITUNES_REMOTE_METRICS_PORT"
+
+# the upper bounds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HTTP_RESPONSE_TEMPLATE = "HTTP/1.0 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+MAX_HTTP_REQUEST_SIZE = 4096
+
+enabled = os.environ.has_key(ENABLED_VARIABLE)
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+class histogram():
+    '''
+    Counts the observed values falling in each bucket, for each combination of label values
+    name - the metric name
+    description - the help text
+    label_names - the names of the labels distinguishing the series
+    buckets - the ascending bucket upper bounds
+    '''
+    
+    def __init__(self, name, description, label_names = (), buckets = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values: [bucket counts, sum, count]
+        self.series = {}
+    
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+    
+    def to_prometheus(self, lines):
+        lines.append("# HELP %s %s" % (self.name, self.description))
+        lines.append("# TYPE %s histogram" % self.name)
+        for label_values, (counts, total, count) in sorted(self.series.items()):
+            labels = _labels(self.label_names, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append("%s_bucket%s %d" % (self.name, _labels(self.label_names + ("le",), label_values + (repr(bound),)), cumulative))
+            lines.append("%s_bucket%s %d" % (self.name, _labels(self.label_names + ("le",), label_values + ("+Inf",)), count))
+            lines.append("%s_sum%s %r" % (self.name, labels, total))
+            lines.append("%s_count%s %d" % (self.name, labels, count))
+    
+    def to_json(self):
+        series = []
+        for label_values, (counts, total, count) in sorted(self.series.items()):
+            series.append({ "labels":dict(zip(self.label_names, label_values)), "buckets":dict(zip([repr(bound) for bound in self.buckets] + ["+Inf"], counts)), "sum":total, "count":count })
+        return { "type":"histogram", "help":self.description, "series":series }
+
+class counter():
+    '''
+    A count for each combination of label values
+    name - the metric name
+    description - the help text
+    label_names - the names of the labels distinguishing the series
+    '''
+    
+    def __init__(self, name, description, label_names = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.series = {}
+    
+    def increment(self, amount, *label_values):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+    
+    def to_prometheus(self, lines):
+        lines.append("# HELP %s %s" % (self.name, self.description))
+        lines.append("# TYPE %s counter" % self.name)
+        for label_values, value in sorted(self.series.items()):
+            lines.append("%s%s %d" % (self.name, _labels(self.label_names, label_values), value))
+    
+    def to_json(self):
+        series = [{ "labels":dict(zip(self.label_names, label_values)), "value":value } for label_values, value in sorted(self.series.items())]
+        return { "type":"counter", "help":self.description, "series":series }
+
+def _labels(label_names, label_values):
+    if len(label_names) == 0:
+        return ""
+    return "{" + ",".join(['%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in zip(label_names, label_values)]) + "}"
+
+# the metrics recorded by the instrumented code
+request_phase = histogram("dacp_request_phase_seconds", "Time spent in each phase of a dacp request: connect, first_byte, read & parse", ("connection", "phase"))
+long_poll_wait = histogram("dacp_long_poll_wait_seconds", "Time a play status update was held by the service before it replied")
+command_to_status = histogram("dacp_command_to_status_seconds", "Time from sending a command to the next play status update")
+parsed_elements = counter("dacp_parsed_elements_total", "Elements decoded by the parser, by tag", ("tag",))
+parsed_bytes = counter("dacp_parsed_bytes_total", "Bytes decoded by the parser including element headers & children, by tag", ("tag",))
+
+METRICS = (request_phase, long_poll_wait, command_to_status, parsed_elements, parsed_bytes)
+
+def reset():
+    for metric in METRICS:
+        metric.series = {}
+
+def to_prometheus():
+    '''
+    All the metrics in the prometheus text exposition format
+    '''
+    lines = []
+    for metric in METRICS:
+        metric.to_prometheus(lines)
+    return "\n".join(lines) + "\n"
+
+def to_json():
+    '''
+    All the metrics as a single line of JSON
+    '''
+    return json.dumps(dict([(metric.name, metric.to_json()) for metric in METRICS]), sort_keys=True)
+
+class metrics_endpoint():
+    '''
+    Serves the prometheus text format to http GET requests, from the glib main loop.
+    Each connection is answered once & closed.  gobject is imported on start, so the
+    parser can record metrics without glib
+    port - the port to listen on, bound to the loopback interface
+    '''
+    
+    def __init__(self, port, address = "127.0.0.1"):
+        self.port = port
+        self.address = address
+        self.watch = None
+        self.clients = {}
+    
+    def start(self):
+        import gobject
+        self.gobject = gobject
+        self.serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.serversocket.bind((self.address, self.port))
+        self.serversocket.listen(5)
+        self.watch = self.gobject.io_add_watch(self.serversocket, self.gobject.IO_IN, self._accept)
+        return self.serversocket.getsockname()[1]
+    
+    def stop(self):
+        if self.watch is not None:
+            self.gobject.source_remove(self.watch)
+            self.watch = None
+            self.serversocket.close()
+            for clientsocket, (watch, data) in self.clients.items():
+                self.gobject.source_remove(watch)
+                clientsocket.close()
+            self.clients = {}
+    
+    def _accept(self, source, condition):
+        clientsocket, address = self.serversocket.accept()
+        clientsocket.setblocking(0)
+        watch = self.gobject.io_add_watch(clientsocket, self.gobject.IO_IN | self.gobject.IO_ERR | self.gobject.IO_HUP, self._read)
+        self.clients[clientsocket] = (watch, "")
+        return True
+    
+    def _read(self, clientsocket, condition):
+        watch, data = self.clients[clientsocket]
+        try:
+            received = clientsocket.recv(MAX_HTTP_REQUEST_SIZE)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            received = ""
+        data = data + received
+        if received != "" and data.find("\r\n\r\n") < 0 and len(data) < MAX_HTTP_REQUEST_SIZE:
+            self.clients[clientsocket] = (watch, data)
+            return True
+        del self.clients[clientsocket]
+        if data.startswith("GET "):
+            body = to_prometheus()
+            response = HTTP_RESPONSE_TEMPLATE % ("200 OK", PROMETHEUS_CONTENT_TYPE, len(body)) + body
+        else:
+            response = HTTP_RESPONSE_TEMPLATE % ("400 Bad Request", "text/plain", 0)
+        try:
+            # the response is small enough for the socket buffer
+            clientsocket.setblocking(1)
+            clientsocket.sendall(response)
+        except socket.error:
+            pass
+        clientsocket.close()
+        return False
@@ -14,18 +14,13 @@
    limitations under the License.
 '''
 
-import gconf
+import errno
 import signal
 import sys
 import socket
-import threading
 import random
-import httplib
 import hashlib
-import gtk, gtk.glade
 import gobject
-import select
-import time
 import re
 import struct
 import binascii
@@ -40,14 +35,91 @@ re_pairing_response = re.compile(".*pairingcode=(\w*)&servicename=(\w*).*Host:\s
 PAIRING_RESPONSE_HEADER_TEMPLATE = "HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n";
 REMOTE_APPLICATION_NAME = "iTunes Remote Applet" # appears in itunes menu
 MDNS_PAIR_ID = "0000000000000001"
-SETTINGS_PAIRINGS = "/apps/itunes-remote-applet/pairings/"
+PAIRING_REQUEST_TIMEOUT = 10000 # milliseconds
+MAX_PAIRING_REQUEST_SIZE = 16384
 
-class pairing_request_listener(threading.Thread):
+class pairing_request():
+    '''
+    A connection to the pairing listener.  The request headers are read from the glib 
+    main loop as they arrive, the connection is dropped if they are not complete within 
+    the timeout or grow beyond the maximum request size
+    '''
+    
+    def __init__(self, listener, clientsocket):
+        self.listener = listener
+        self.clientsocket = clientsocket
+        self.clientsocket.setblocking(0)
+        self.data = ""
+        self.watch = gobject.io_add_watch(self.clientsocket, gobject.IO_IN | gobject.IO_ERR | gobject.IO_HUP, self._read)
+        self.timeout = gobject.timeout_add(PAIRING_REQUEST_TIMEOUT, self._timed_out)
+        
+    def respond(self, response):
+        '''
+        Send the response and close the connection
+        '''
+        self.clientsocket.setblocking(1)
+        try:
+            self.clientsocket.sendall(response)
+        finally:
+            self.close()
+        
+    def close(self):
+        if self.clientsocket is None:
+            return
+        if self.watch is not None:
+            gobject.source_remove(self.watch)
+            self.watch = None
+        if self.timeout is not None:
+            gobject.source_remove(self.timeout)
+            self.timeout = None
+        self.clientsocket.close()
+        self.clientsocket = None
+        self.listener.requests.remove(self)
+    
+    def _read(self, source, condition):
+        try:
+            data = self.clientsocket.recv(1024)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            data = ""
+        if data == "":
+            self.close()
+            return False
+        # only the newly received data & the 3 bytes before it can complete the header
+        search_start = max(0, len(self.data) - 3)
+        self.data = self.data + data
+        end = self.data.find("\r\n\r\n", search_start)
+        if end < 0:
+            if len(self.data) > MAX_PAIRING_REQUEST_SIZE:
+                print "Error: pairing request too large"
+                self.close()
+                return False
+            return True
+        gobject.source_remove(self.timeout)
+        self.timeout = None
+        self.watch = None
+        self.listener.request_received(self, self.data[:end + 4])
+        return False
+    
+    def _timed_out(self):
+        print "Error: pairing request timed out"
+        self.timeout = None
+        self.close()
+        return False
+
+class pairing_request_listener():
+    '''
+    Accepts the pairing request from itunes.  The listener socket and each connection to 
+    it are watched from the glib main loop, so several pairing attempts can be in progress 
+    at once
+    '''
     
     def __init__(self, pairing_code, address, pairing_service):
-        threading.Thread.__init__(self)
         self.address = address
         self.pairing_service = pairing_service
+        self.watch = None
+        self.requests = []
         tmp = "%s%s\x00%s\x00%s\x00%s\x00" % (MDNS_PAIR_ID, pairing_code[0], pairing_code[1], pairing_code[2], pairing_code[3])
         self.pairing_hash = hashlib.md5(tmp).hexdigest().upper()
     
@@ -59,65 +131,81 @@ class pairing_request_listener(threading.Thread):
         self.serversocket.bind((self.address, 0))
         return self.serversocket.getsockname()[1]
     
+    def start(self):
+        self.serversocket.listen(5)
+        self.watch = gobject.io_add_watch(self.serversocket, gobject.IO_IN, self._accept)
+    
     def stop_listening(self):
-        self.listening = False
+        '''
+        Close the listener socket and any connections still being read
+        '''
+        if self.watch is not None:
+            gobject.source_remove(self.watch)
+            self.watch = None
+            self.serversocket.close()
+            for request in list(self.requests):
+                request.close()
+            print "listener exit"
     
-    def run(self):
-        self.listening = True
-        self.serversocket.listen(5)
-        while self.listening:
-            ready_to_read, ready_to_write, in_error = select.select([self.serversocket], [], [], 0)
-            if len(ready_to_read) == 0:
-                time.sleep(1);
-            else:
-                print "recv"
-                clientsocket, address = self.serversocket.accept()
-                data = ""
-                while not data.endswith("\r\n\r\n"):
-                    data = data + clientsocket.recv(1024)
-                    
-                response = re_pairing_response.search(data)
-                if response:
-                    pairing_hash = response.group(1)
-                    service_id = response.group(2)
-                    service_host = response.group(3)
-                    service_port = response.group(4)
+    def _accept(self, source, condition):
+        clientsocket, address = self.serversocket.accept()
+        self.requests.append(pairing_request(self, clientsocket))
+        return True
+    
+    def request_received(self, request, data):
+        '''
+        Respond to a complete pairing request, pairing is finished by the first request 
+        with the expected pairing code
+        '''
+        response = re_pairing_response.search(data)
+        if response:
+            pairing_hash = response.group(1)
+            service_id = response.group(2)
+            service_host = response.group(3)
+            service_port = response.group(4)
+        
+            if self.pairing_hash == pairing_hash:
+                pairing_guid_bin_data = struct.pack("2L", random.getrandbits(32), random.getrandbits(32))
+                pairing_guid = binascii.b2a_hex(pairing_guid_bin_data).upper()
+                
+                elements = []
+                elements.append(dacp_serialisation.hex_content_element("cmpg", pairing_guid))
+                elements.append(dacp_serialisation.string_content_element("cmnm", REMOTE_APPLICATION_NAME))
+                elements.append(dacp_serialisation.string_content_element("cmty", "iPod"))
+                root_element = dacp_serialisation.parent_element("cmpa", elements)
+                
+                # write the http header & the response into a single buffer
+                response_length = root_element.get_size()
+                response_header = PAIRING_RESPONSE_HEADER_TEMPLATE % response_length
+                pairing_response = bytearray(len(response_header) + response_length)
+                pairing_response[:len(response_header)] = response_header
+                root_element.write_into(pairing_response, len(response_header))
                 
-                    if self.pairing_hash == pairing_hash:
-                        pairing_guid_bin_data = struct.pack("2L", random.getrandbits(32), random.getrandbits(32))
-                        pairing_guid = binascii.b2a_hex(pairing_guid_bin_data).upper()
-                        
-                        elements = []
-                        elements.append(dacp_serialisation.hex_content_element("cmpg", pairing_guid))
-                        elements.append(dacp_serialisation.string_content_element("cmnm", REMOTE_APPLICATION_NAME))
-                        elements.append(dacp_serialisation.string_content_element("cmty", "iPod"))
-                        root_element = dacp_serialisation.parent_element("cmpa", elements)
-                        
-                        pairing_response = root_element.get_bytes()
-                        
-                        sent1 = clientsocket.send(PAIRING_RESPONSE_HEADER_TEMPLATE % len(pairing_response))
-                        sent2 = clientsocket.send(pairing_response)
-                        
-                        clientsocket.close()
-                        self.pairing_service.complete_pairing(service_id, service_host, service_port, pairing_guid)
-                        self.listening = False
-                                 
-        self.serversocket.close()
-        print "listener thread exit"
+                request.respond(pairing_response)
+                self.stop_listening()
+                self.pairing_service.complete_pairing(service_id, service_host, service_port, pairing_guid)
+                return
+        request.close()
         
 class pairing_service():
     '''
-    Allows the itunes remote to pair with an itunes server
+    Allows the itunes remote to pair with an itunes server.  Has no user interface of its 
+    own, the pairing code is returned by start for the front end to show
     '''
     
     def __init__(self, main_controller_callback):
         '''
-        service_id - the service id of the service to pair to
-        main_controller_callback - the process to be notified when pairing is complete.  must implement a method: service_available(service_id)
+        main_controller_callback - the process to be notified when pairing is complete.  must implement a method: service_available(service_id) & hold the pairing_store as pairings
         '''
         self.main_process = main_controller_callback
+        self.group = None
+        self.request_listener = None
     
-    def activate(self, indicator):
+    def start(self):
+        '''
+        Listen for the pairing request & advertise the pairing service, returning the 4 
+        digit pairing code to be entered in itunes
+        '''
         self.host_name = socket.gethostname()
         self.bus = dbus.SystemBus()
         self.avahi_server = dbus.Interface(self.bus.get_object(avahi.DBUS_NAME, avahi.DBUS_PATH_SERVER), avahi.DBUS_INTERFACE_SERVER)
@@ -129,17 +217,15 @@ class pairing_service():
         self.request_listener.start()
         
         self._publish_pairing_info(pairing_service_port)
-        
-        self._display_gui()
+        return self.pairing_code
         
     def _publish_pairing_info(self, pairing_service_port):
         '''
         Advertise the pairing service using avahi
         '''
-        bus = dbus.SystemBus()
-        server = dbus.Interface( bus.get_object( avahi.DBUS_NAME, avahi.DBUS_PATH_SERVER), avahi.DBUS_INTERFACE_SERVER)
+        server = self.avahi_server
         
-        self.group = dbus.Interface( bus.get_object(avahi.DBUS_NAME, server.EntryGroupNew()), avahi.DBUS_INTERFACE_ENTRY_GROUP)
+        self.group = dbus.Interface( self.bus.get_object(avahi.DBUS_NAME, server.EntryGroupNew()), avahi.DBUS_INTERFACE_ENTRY_GROUP)
         
         txt_info = dbus.Array()
         txt_info.append(dbus.ByteArray("DvNm=" + REMOTE_APPLICATION_NAME))
@@ -153,27 +239,16 @@ class pairing_service():
         
         self.group.Commit()
         
-    def _display_gui(self):
-        '''
-        Show the pairing gui with the 4 digit code 
-        '''
-        wTree = gtk.glade.XML("/media/disk/apps/workspaces/python/itunes-remote/pairing-gui.glade", "itunes_remote_pairing_gui", "iTunes Remote Applet")
-        self.window = wTree.get_widget("itunes_remote_pairing_gui")
-        self.window.set_title("iTunes Pairing")
-        wTree.get_widget("label_code").set_markup("<span  size=\"xx-large\" weight=\"bold\">%d %d %d %d</span>" % self.pairing_code)
-        signals = {  "on_button_cancel_clicked" : self._close_dialog, "gtk_main_quit" : self._cancel_pairing}
-        wTree.signal_autoconnect(signals)
-        self.window.show_all()
-        
-    def _close_dialog(self, button_widget):
-        self.window.destroy()
-        
-    def _cancel_pairing(self, button_widget):
+    def cancel(self):
         '''
         Cancel the pairing operation & shut down the pairing service
         '''
-        self.group.Free() # unpublish the pairing service from avahi
-        self.request_listener.stop_listening()
+        if self.group is not None:
+            self.group.Free() # unpublish the pairing service from avahi
+            self.group = None
+        if self.request_listener is not None:
+            self.request_listener.stop_listening()
+            self.request_listener = None
         
     def complete_pairing(self, service_id, service_host, service_port, pairing_guid):
         '''
@@ -181,7 +256,6 @@ class pairing_service():
         guid and shut down the pairing service
         '''
         print "paired: ", service_id, service_host, service_port, pairing_guid
-        client = gconf.client_get_default()
-        client.set_string(SETTINGS_PAIRINGS + service_id, pairing_guid)
-        self._close_dialog(None)
+        self.main_process.pairings.set(service_id, pairing_guid)
+        self.cancel()
         self.main_process.service_available(service_id)
@@ -0,0 +1,92 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+The pairing guids of the paired itunes services.  The guids are read from gconf once 
+& then served from memory, so looking up a newly discovered service never waits on gconf.  
+Where gconf is not installed, as on a headless media box, they are kept in a file instead.
+'''
+
+import os
+
+try:
+    import gconf
+except ImportError:
+    gconf = None
+
+SETTINGS_PAIRINGS = "/apps/itunes-remote-applet/pairings"
+PAIRINGS_FILE = os.path.expanduser("~/.config/itunes-remote-applet/pairings")
+
+class pairing_store():
+    '''
+    The pairing guids keyed by service id
+    directory - the gconf directory holding a string key per paired service
+    path - the file of service_id=pairing_guid lines used when gconf is not installed
+    '''
+    
+    def __init__(self, directory = SETTINGS_PAIRINGS, path = PAIRINGS_FILE):
+        self.directory = directory
+        self.path = path
+        self.pairings = {}
+        if gconf is None:
+            self.client = None
+            self._read()
+            return
+        self.client = gconf.client_get_default()
+        for entry in self.client.all_entries(directory):
+            value = entry.get_value()
+            if value is not None and value.type == gconf.VALUE_STRING:
+                self.pairings[entry.get_key().rsplit("/", 1)[-1]] = value.get_string()
+                
+    def get(self, service_id):
+        '''
+        Returns the pairing guid of the service, or None when it has not been paired
+        '''
+        return self.pairings.get(service_id)
+    
+    def set(self, service_id, pairing_guid):
+        '''
+        Record a new pairing in memory & in gconf
+        '''
+        self.pairings[service_id] = pairing_guid
+        if self.client is None:
+            self._write()
+        else:
+            self.client.set_string(self.directory + "/" + service_id, pairing_guid)
+            
+    def _read(self):
+        try:
+            lines = open(self.path).read().splitlines()
+        except IOError:
+            return
+        for line in lines:
+            if "=" in line:
+                service_id, pairing_guid = line.split("=", 1)
+                self.pairings[service_id] = pairing_guid
+                
+    def _write(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # write then rename so that a partly written file is never read
+        temporary_path = self.path + ".tmp"
+        output = open(temporary_path, "w")
+        try:
+            for service_id, pairing_guid in sorted(self.pairings.items()):
+                output.write("%s=%s\n" % (service_id, pairing_guid))
+        finally:
+            output.close()
+        os.rename(temporary_path, self.path)
@@ -0,0 +1,168 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Decodes the items of very large listings across a pool of processes.  The offsets of
+the items are found by a single walk over their headers, the items are split into
+ranges of roughly equal size & each range is decoded into columns by a worker process.
+The response is copied once into a shared memory map before the workers are forked, so
+only the range offsets are sent to the workers & only the decoded columns are returned.
+The columns are joined in item order into a single listing_table.
+
+The workers are forked from the calling process, so it must be single threaded & hold
+no state the workers must not inherit.  The daemon decodes its listings from a sync
+thread alongside glib, dbus & avahi, so it uses parser.parse_listing rather than this.
+'''
+
+import array
+import gc
+import mmap
+import multiprocessing
+
+import dacp_serialisation
+
+# listings with fewer items are decoded in this process, forking is not worth it
+MIN_PARALLEL_ITEMS = 100000
+# the ranges decoded by each worker, more than one so a slow range does not hold up the rest
+RANGES_PER_PROCESS = 4
+
+# the shared response & the parser of a worker process, set when the pool starts it
+worker_data = None
+worker_parser = None
+
+def _start_worker(data, limits):
+    global worker_data, worker_parser
+    # the decode creates no cycles, & collections would traverse the objects inherited
+    # from the parent, copying the pages holding them
+    gc.disable()
+    worker_data = data
+    worker_parser = dacp_serialisation.parser(limits)
+
+def _decode_range(item_range):
+    '''
+    Decode the items between the offsets in a worker process.  The columns have slots
+    so they are returned as their arrays & strings
+    '''
+    start, end = item_range
+    numbers, strings, rows = worker_parser._decode_items(worker_data, start, end)
+    number_values = dict([(tag, _pack(column.values)) for tag, column in numbers.items()])
+    string_values = dict([(tag, (str(column.data), _pack(column.offsets))) for tag, column in strings.items()])
+    return number_values, string_values, rows
+
+def _pack(values):
+    # arrays are pickled as lists of numbers, their bytes are far quicker to send
+    if isinstance(values, array.array):
+        return values.typecode, values.tostring()
+    return None, values
+
+def _unpack(packed):
+    typecode, values = packed
+    if typecode is None:
+        return values
+    unpacked = array.array(typecode)
+    unpacked.fromstring(values)
+    return unpacked
+
+class parallel_parser():
+    '''
+    Decodes listings into a listing_table like parser.parse_listing, decoding the items
+    of the listings with at least min_items items in a pool of processes
+    element_parser - the parser used to find the items & decode smaller listings, its
+    limits are applied to the workers
+    processes - the number of worker processes, by default one per cpu
+    min_items - the fewest items decoded in parallel
+    '''
+    
+    def __init__(self, element_parser = None, processes = None, min_items = MIN_PARALLEL_ITEMS):
+        if element_parser is None:
+            element_parser = dacp_serialisation.parser()
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.parser = element_parser
+        self.processes = processes
+        self.min_items = min_items
+    
+    def parse_listing(self, data, listing = "mlcl", assert_status = True):
+        '''
+        Decode the items of a listing response into a listing_table with a column for
+        each tag found in the items
+        listing - the name of the child of the response holding the items
+        assert_status - if true throws a parser_exception when the return code (mstt) != 200 (OK)
+        '''
+        if self.processes < 2:
+            return self.parser.parse_listing(data, listing, assert_status)
+        items = self.parser.parse(data, assert_status, lazy=True).assert_child(listing)
+        try:
+            ranges = self._ranges(list(self.parser._walk(items.view, items.start, items.end)))
+        except dacp_serialisation.parser_exception:
+            # decoded in order so the error reported is the one a serial decode reports
+            return self.parser.parse_listing(data, listing, assert_status)
+        if ranges is None:
+            return self.parser.parse_listing(data, listing, assert_status)
+        
+        shared = mmap.mmap(-1, len(data))
+        try:
+            shared.write(data)
+            pool = multiprocessing.Pool(self.processes, _start_worker, (shared, self.parser.limits))
+            try:
+                numbers, strings, rows = self._join(pool.imap(_decode_range, ranges))
+            finally:
+                pool.terminate()
+        finally:
+            shared.close()
+        return self.parser._table(numbers, strings, rows)
+    
+    def _ranges(self, offsets):
+        '''
+        Split the items into ranges of roughly equal size, returning the offsets of each
+        range including the item headers, or None if there are too few items to split
+        '''
+        if len(offsets) < self.min_items:
+            return None
+        header_length = dacp_serialisation.HEADER.size
+        start = offsets[0][1] - header_length
+        end = offsets[-1][2]
+        size = (end - start) / (self.processes * RANGES_PER_PROCESS) + 1
+        ranges = []
+        range_start = start
+        for item_name, item_start, item_end in offsets:
+            if item_end - range_start >= size:
+                ranges.append((range_start, item_end))
+                range_start = item_end
+        if range_start < end:
+            ranges.append((range_start, end))
+        return ranges
+    
+    def _join(self, decoded_ranges):
+        '''
+        Append the columns of each range, in item order, to a single column for each tag
+        '''
+        numbers = {}
+        strings = {}
+        rows = 0
+        for number_values, string_values, range_rows in decoded_ranges:
+            for tag, values in number_values.items():
+                column = numbers.get(tag)
+                if column is None:
+                    column = numbers[tag] = dacp_serialisation.number_column(rows)
+                column.extend(rows, _unpack(values))
+            for tag, (data, offsets) in string_values.items():
+                column = strings.get(tag)
+                if column is None:
+                    column = strings[tag] = dacp_serialisation.string_column(rows)
+                column.extend(rows, data, _unpack(offsets))
+            rows += range_rows
+        return numbers, strings, rows
@@ -0,0 +1,948 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+The headless itunes remote: service discovery, pairing, sessions, status & commands.
+Nothing here needs a display, front ends such as the indicator applet subscribe to the
+daemon's events.  Run directly to control itunes from a headless box through the
+control socket:
+
+    python remote_daemon.py
+'''
+
+import gobject
+import errno
+import os
+import resource
+import signal
+import socket
+import sys
+import time
+import urllib
+import dacp_serialisation
+import dacp_connection
+import control_socket
+import command_scheduler
+import status_model
+import artwork_cache
+import pairing_store
+import service_group
+import metrics
+
+SERVICE_ID_PROPERTY = "MID"
+LOGIN_TEMPLATE = "/login?pairing-guid=0x%s"
+PLAY_STATUS_UPDATE_TEMPLATE = "/ctrl-int/1/playstatusupdate?revision-number=%d&session-id=%s"
+PLAY_PAUSE_TEMPLATE = "/ctrl-int/1/playpause?session-id=%s"
+NEXT_ITEM_TEMPLATE = "/ctrl-int/1/nextitem?session-id=%s"
+PREV_ITEM_TEMPLATE = "/ctrl-int/1/previtem?session-id=%s"
+PAUSE_TEMPLATE = "/ctrl-int/1/pause?session-id=%s"
+CUE_PLAY_TEMPLATE = "/ctrl-int/1/cue?command=play&query=%s&index=0&sort=name&session-id=%s"
+NOW_PLAYING_ARTWORK_TEMPLATE = "/ctrl-int/1/nowplayingartwork?mw=%d&mh=%d&session-id=%s"
+
+PLAY_PAUSE_COMMAND = "play-pause"
+NEXT_TRACK_COMMAND = "next-track"
+PREV_TRACK_COMMAND = "prev-track"
+PAUSE_COMMAND = "pause"
+QUERY_TRACK_COMMAND = "query-track"
+COMMAND_STATS_COMMAND = "command-stats"
+PLAY_SEARCH_COMMAND = "play-search"
+SYNC_LIBRARY_COMMAND = "sync-library"
+LIST_SERVICES_COMMAND = "list-services"
+SELECT_COMMAND = "select"
+PAIR_COMMAND = "pair"
+CANCEL_PAIRING_COMMAND = "cancel-pairing"
+FOOTPRINT_COMMAND = "footprint"
+GROUP_COMMAND = "group"
+GROUP_ADD_COMMAND = "group-add"
+GROUP_REMOVE_COMMAND = "group-remove"
+GROUP_LIST_COMMAND = "group-list"
+METRICS_COMMAND = "metrics"
+METRICS_ON_COMMAND = "metrics-on"
+METRICS_OFF_COMMAND = "metrics-off"
+# the commands which can be sent to a whole group & the service_controller method for each
+GROUP_METHODS = { PLAY_PAUSE_COMMAND:"toggle_play", NEXT_TRACK_COMMAND:"next_track", PREV_TRACK_COMMAND:"prev_track", PAUSE_COMMAND:"pause" }
+
+CONTROL_SOCKET = "/tmp/itunes-controller.sock"
+CONTROL_PIPE = "/tmp/itunes-controller"
+
+STREAM_CHUNK_SIZE = 16384
+
+PLAY_STATUS_STOPPED = 2
+PLAY_STATUS_PAUSED = 3
+PLAY_STATUS_PLAYING = 4
+PLAY_STATUS_NAMES = { PLAY_STATUS_STOPPED:"stopped", PLAY_STATUS_PAUSED:"paused", PLAY_STATUS_PLAYING:"playing" }
+
+CACHE_DIR = os.path.expanduser("~/.cache/itunes-remote-applet")
+ARTWORK_CACHE_NAME = "artwork"
+LIBRARY_CACHE_TEMPLATE = "library-%s.db"
+ARTWORK_SIZE = 128
+
+# the events passed to the subscribers as (event, service, data)
+SERVICE_ADDED = "service-added"
+SERVICE_REMOVED = "service-removed"
+SERVICE_PAIRED = "service-paired"
+SERVICE_SELECTED = "service-selected"
+SERVICE_UNSELECTED = "service-unselected"
+PAIRING_STARTED = "pairing-started" # data is the 4 digit pairing code
+PAIRING_FINISHED = "pairing-finished"
+STATUS_CHANGED = "status-changed" # data is true when the track has changed
+ARTWORK_AVAILABLE = "artwork-available" # data is the artwork cache key
+TRACK_QUERIED = "track-queried"
+
+class service_exception(Exception):
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+class track_info():
+
+    def __init__(self, status):
+        self.track = status.track
+        self.artist = status.artist
+        self.album = status.album
+
+def raw_artwork(data):
+    '''
+    Keeps the artwork encoded, for front ends that do not decode images
+    '''
+    return data, len(data)
+
+class service_controller():
+    '''
+    Itunes status & control.  Performs two functions:
+    
+    1) Listen to the itunes status broadcasts and relay status changes to the subscribers
+    2) Issue commands to itunes
+    
+    Both are driven by the glib main loop rather than a thread per service.  The long poll
+    status updates and the commands each have their own connection so a command never
+    waits behind the long poll.
+    '''
+    
+    def __init__(self, daemon, service_id, name, host, port, pairing_guid, address = None):
+        '''
+        daemon - the remote_daemon whose subscribers are told of the changes
+        pairing_guid - None until the service has been paired
+        address - the (family, socket address) discovery resolved the host to, the main
+        loop connections use it so the host name is never resolved on the main loop
+        '''
+        self.daemon = daemon
+        self.service_id = service_id
+        self.name = name
+        self.host = host
+        self.port = port
+        self.pairing_guid = pairing_guid
+        self.artwork = daemon.artwork
+        self.artwork_request = None
+        self.current_track = None
+        self.track_info = None
+        self.play_status = None
+        self.status = status_model.status_model()
+        self.session_id = None
+        self.running = False
+        self.status_request = None
+        # the status requests are long polls held until the status changes
+        self.status_connection = dacp_connection.async_connection(host, port, name="status", timeout=None, address=address)
+        self.command_connection = dacp_connection.async_connection(host, port, name="command", address=address)
+        self.artwork_connection = dacp_connection.async_connection(host, port, name="artwork", address=address)
+        # blocking connections for callers running outside the main loop
+        self.command_connections = dacp_connection.connection_pool(host, port)
+        # when the outstanding status request & the first unanswered command were sent,
+        # only recorded while metrics are enabled
+        self.status_requested = None
+        self.command_sent = None
+        self.scheduler = command_scheduler.command_scheduler(self._send_command)
+        self.command_templates = { command_scheduler.TOGGLE_PLAY:PLAY_PAUSE_TEMPLATE, command_scheduler.NEXT_TRACK:NEXT_ITEM_TEMPLATE, command_scheduler.PREV_TRACK:PREV_ITEM_TEMPLATE, PAUSE_COMMAND:PAUSE_TEMPLATE }
+        self.library = None
+    
+    def is_paired(self):
+        return self.pairing_guid is not None
+    
+    def start(self):
+        '''
+        Log in to the service and start listening for status updates
+        '''
+        self.running = True
+        self.status_request = self.request_async(self.status_connection, LOGIN_TEMPLATE % self.pairing_guid, self._logged_in)
+    
+    def stop(self):
+        '''
+        Cancel the status updates and any outstanding commands
+        '''
+        self.running = False
+        self.status_request = None
+        self.scheduler.cancel()
+        self.artwork_request = None
+        self.command_sent = None
+        self.status_connection.close()
+        self.command_connection.close()
+        self.artwork_connection.close()
+    
+    def is_running(self):
+        return self.running
+    
+    def _logged_in(self, login):
+        self.session_id = login.assert_child("mlid").content
+        self._request_status(1)
+        if self.library is None:
+            import library_mirror
+            self.library = library_mirror.library_mirror(self, os.path.join(self.daemon.cache_dir, LIBRARY_CACHE_TEMPLATE % self.host))
+        self.library.sync_in_background()
+    
+    def _request_status(self, revision_number):
+        url = PLAY_STATUS_UPDATE_TEMPLATE % (revision_number, self.session_id)
+        self.status_request = self.request_async(self.status_connection, url, self._status_received, lazy=True)
+        self.status_requested = None
+        if metrics.enabled:
+            self.status_requested = time.time()
+    
+    def _status_received(self, status):
+        if self.status_requested is not None:
+            received = time.time()
+            metrics.long_poll_wait.observe(received - self.status_requested)
+            if self.command_sent is not None:
+                metrics.command_to_status.observe(received - self.command_sent)
+                self.command_sent = None
+        status = status.assert_self("cmst")
+        changes = self.status.update(status)
+        # the subscribers only need telling when a visible field has changed
+        if status_model.PLAY_STATUS_CHANGED in changes or status_model.TRACK_CHANGED in changes:
+            self._play_status_changed(status_model.TRACK_CHANGED in changes)
+        self._request_status(self.status.revision)
+    
+    def _play_status_changed(self, track_changed):
+        play_status = self.status.play_status
+        self.play_status = play_status
+        if play_status == PLAY_STATUS_STOPPED:
+            self.track_info = None
+        else:
+            self.track_info = track_info(self.status)
+            if track_changed:
+                self._prefetch_artwork()
+        self.daemon.emit(STATUS_CHANGED, self, track_changed)
+    
+    def artwork_key(self):
+        '''
+        The artwork cache key of the current track, by album where itunes reports one
+        '''
+        artwork_id = self.status.album_id
+        if artwork_id is None:
+            artwork_id = self.status.now_playing
+        if artwork_id is None:
+            return None
+        return "%s:%s" % (self.host, artwork_id)
+    
+    def current_artwork(self):
+        '''
+        The cached artwork of the current track, or None if it is not cached yet
+        '''
+        key = self.artwork_key()
+        if key is None:
+            return None
+        return self.artwork.get(key)
+    
+    def _prefetch_artwork(self):
+        '''
+        Start fetching the artwork of a new track unless it is already cached
+        '''
+        if self.artwork_request is not None:
+            self.artwork_request.cancel()
+            self.artwork_request = None
+        key = self.artwork_key()
+        if key is None or self.artwork.get(key) is not None:
+            return
+        headers = {"Viewer-Only-Client": "1"}
+        url = NOW_PLAYING_ARTWORK_TEMPLATE % (ARTWORK_SIZE, ARTWORK_SIZE, self.session_id)
+        self.artwork_request = self.artwork_connection.request(url, headers, lambda data: self._artwork_received(key, data), self._artwork_failed)
+    
+    def _artwork_received(self, key, data):
+        self.artwork_request = None
+        # tracks without artwork have an empty response
+        if len(data) == 0:
+            return
+        try:
+            self.artwork.store(key, data)
+        except Exception, e:
+            print "Error: could not cache artwork: %s" % e
+            return
+        # only of interest if the track hasn't changed while it was fetched
+        if key == self.artwork_key():
+            self.daemon.emit(ARTWORK_AVAILABLE, self, key)
+    
+    def _artwork_failed(self, exception):
+        self.artwork_request = None
+        # tracks without artwork may be answered with not found rather than an empty response
+        if isinstance(exception, dacp_connection.http_status_exception) and exception.status == 404:
+            return
+        print "Error: artwork request to %s:%d failed: %s" % (self.host, self.port, exception)
+    
+    def _request_failed(self, exception):
+        print "Error: request to %s:%d failed: %s" % (self.host, self.port, exception)
+        self.stop()
+    
+    def describe_status(self):
+        '''
+        A single line description of the play status & current track
+        '''
+        if self.play_status is None:
+            return "unknown"
+        description = PLAY_STATUS_NAMES.get(self.play_status, str(self.play_status))
+        if self.track_info is not None:
+            description = "%s %s - %s (%s)" % (description, self.track_info.artist, self.track_info.track, self.track_info.album)
+        return description
+    
+    def request_async(self, connection, url, callback, allow_null = False, lazy = False, error_callback = None):
+        '''
+        Queue a request to the supplied url on an async_connection, the resulting dacp
+        response object is passed to the callback.  If lazy is true the response children
+        are only decoded when they are accessed.  A failed request is passed to the
+        error_callback, by default stopping the controller.  Returns the async_request
+        '''
+        headers = {"Viewer-Only-Client": "1"}
+        if error_callback is None:
+            error_callback = self._request_failed
+        def response_received(rd):
+            parser = dacp_serialisation.parser(dacp_serialisation.DEFAULT_LIMITS)
+            try:
+                if metrics.enabled:
+                    started = time.time()
+                    response = parser.parse(rd, allow_null=allow_null, lazy=lazy)
+                    metrics.request_phase.observe(time.time() - started, connection.name, "parse")
+                else:
+                    response = parser.parse(rd, allow_null=allow_null, lazy=lazy)
+                if callback is not None:
+                    callback(response)
+            except (dacp_serialisation.parser_exception, AssertionError), e:
+                error_callback(e)
+        return connection.request(url, headers, response_received, error_callback)
+    
+    def make_request(self, url, allow_null = False, lazy = False):
+        '''
+        Make a blocking request to the supplied url and return the resulting dacp response
+        object.  For use outside the main loop, the request is sent on a pooled connection
+        '''
+        headers = {"Viewer-Only-Client": "1"}
+        rd = self.command_connections.fetch(url, headers)
+        
+        parser = dacp_serialisation.parser(dacp_serialisation.DEFAULT_LIMITS)
+        if not metrics.enabled:
+            return parser.parse(rd, allow_null=allow_null, lazy=lazy)
+        started = time.time()
+        response = parser.parse(rd, allow_null=allow_null, lazy=lazy)
+        metrics.request_phase.observe(time.time() - started, self.command_connections.name, "parse")
+        return response
+    
+    def stream_request(self, url):
+        '''
+        Make a request to the supplied url and return a generator of the (path, element)
+        tuples of the response, decoded as the response is read from the socket.  Throws 
+        an http_status_exception if the request is answered with a status other than 2xx
+        '''
+        headers = {"Viewer-Only-Client": "1"}
+        c, r = self.command_connections.request(url, headers)
+        complete = False
+        try:
+            if r.status < 200 or r.status >= 300:
+                raise dacp_connection.http_status_exception(r.status, r.reason)
+            decoder = dacp_serialisation.stream_decoder(dacp_serialisation.parser(dacp_serialisation.DEFAULT_LIMITS))
+            while True:
+                chunk = r.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                for item in decoder.feed(chunk):
+                    yield item
+            decoder.close()
+            complete = True
+        finally:
+            # only a fully read response leaves the connection reusable
+            if complete:
+                self.command_connections.release(c, r)
+            else:
+                c.close()
+    
+    def _send_command(self, command, completed):
+        '''
+        Send a control command for the scheduler, completed is called with None once
+        itunes has responded or with the exception if the command failed
+        '''
+        if self.session_id is None:
+            print "Error: not logged in to %s:%d" % (self.host, self.port)
+            completed(service_exception("not logged in"))
+            return
+        def failed(exception):
+            print "Error: command to %s:%d failed: %s" % (self.host, self.port, exception)
+            completed(exception)
+        url = self.command_templates[command] % self.session_id
+        if metrics.enabled and self.command_sent is None:
+            self.command_sent = time.time()
+        self.request_async(self.command_connection, url, lambda response: completed(None), allow_null=True, error_callback=failed)
+    
+    def sync_library(self, reply):
+        '''
+        Bring the library mirror up to date, the reply is made from the main loop
+        '''
+        if self.library is None:
+            reply("error not logged in")
+            return
+        def synchronised(exception):
+            if exception is None:
+                gobject.idle_add(reply, "ok")
+            else:
+                gobject.idle_add(reply, "error " + str(exception))
+        self.library.sync_in_background(synchronised)
+    
+    def play_search(self, text, reply):
+        '''
+        Play the first track in the library mirror matching the text
+        '''
+        if self.library is None:
+            reply("error not logged in")
+            return
+        tracks = self.library.search(text, 1)
+        if len(tracks) == 0:
+            reply("error no track matches: " + text)
+            return
+        track_id, track, artist, album = tracks[0]
+        description = ("ok %s - %s (%s)" % (artist, track, album)).encode("utf-8")
+        def failed(exception):
+            reply("error " + str(exception))
+        query = urllib.quote("'dmap.itemid:%d'" % track_id)
+        self.request_async(self.command_connection, CUE_PLAY_TEMPLATE % (query, self.session_id), lambda response: reply(description), allow_null=True, error_callback=failed)
+    
+    def toggle_play(self, reply = None):
+        self.scheduler.toggle_play(reply)
+    
+    def next_track(self, reply = None):
+        self.scheduler.next_track(reply)
+    
+    def prev_track(self, reply = None):
+        self.scheduler.prev_track(reply)
+        
+    def pause(self, reply = None):
+        '''
+        Pause playback, sent at once as unlike the toggle it can't be coalesced
+        '''
+        def completed(exception):
+            if reply is None:
+                return
+            if exception is None:
+                reply("ok")
+            else:
+                reply("error " + str(exception))
+        self._send_command(PAUSE_COMMAND, completed)
+
+class named_pipe_reader():
+    '''
+    Reads commands written to the supplied named pipe, kept so that anything writing
+    to the pipe directly continues to work.  The pipe is watched from the glib main
+    loop and the replies to its commands are discarded
+    '''
+    
+    def __init__(self, pipe_name, dispatch):
+        self.pipe_name = pipe_name
+        self.dispatch = dispatch
+        self.pending = ""
+        self.watch = None
+    
+    def start(self):
+        if os.path.exists(self.pipe_name):
+            os.unlink(self.pipe_name)
+        os.mkfifo(self.pipe_name)
+        self.pipe = os.open(self.pipe_name, os.O_RDONLY | os.O_NONBLOCK)
+        # holding the write end open stops the pipe reporting end of file each time a writer closes
+        self.keep_open = os.open(self.pipe_name, os.O_WRONLY)
+        self.watch = gobject.io_add_watch(self.pipe, gobject.IO_IN, self._read)
+    
+    def stop(self):
+        if self.watch is not None:
+            gobject.source_remove(self.watch)
+            self.watch = None
+            os.close(self.keep_open)
+            os.close(self.pipe)
+    
+    def _read(self, source, condition):
+        try:
+            data = os.read(self.pipe, 4096)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            raise
+        lines = (self.pending + data).split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self.dispatch(line.rstrip(), lambda message: None)
+        return True
+
+class command_controller():
+    '''
+    Listens for commands on the control socket & the named pipe and invokes
+    the appropriate method on the daemon or its selected service_controller.  Each
+    command is replied to once it is complete, with ok, the current status or an error
+    '''
+    
+    def __init__(self, daemon, socket_path, pipe_name):
+        self.daemon = daemon
+        self.control_server = control_socket.control_server(socket_path, self.command)
+        self.named_pipe = named_pipe_reader(pipe_name, self.command)
+    
+    def start(self):
+        self.control_server.start()
+        self.named_pipe.start()
+    
+    def stop(self):
+        self.control_server.stop()
+        self.named_pipe.stop()
+    
+    def command(self, cmd, reply):
+        if cmd == "":
+            reply("error empty command")
+            return
+        
+        # the daemon commands work without a selected service
+        if cmd == LIST_SERVICES_COMMAND:
+            reply("ok " + self.daemon.describe_services())
+            return
+        
+        if cmd.startswith(SELECT_COMMAND + " "):
+            if self.daemon.select(cmd[len(SELECT_COMMAND) + 1:].strip()):
+                reply("ok")
+            else:
+                reply("error no paired service: " + cmd[len(SELECT_COMMAND) + 1:].strip())
+            return
+        
+        if cmd.startswith(PAIR_COMMAND + " "):
+            pairing_code = self.daemon.pair(cmd[len(PAIR_COMMAND) + 1:].strip())
+            if pairing_code is None:
+                reply("error no service: " + cmd[len(PAIR_COMMAND) + 1:].strip())
+            else:
+                reply("ok %d%d%d%d" % pairing_code)
+            return
+        
+        if cmd == CANCEL_PAIRING_COMMAND:
+            self.daemon.cancel_pairing()
+            reply("ok")
+            return
+        
+        if cmd == FOOTPRINT_COMMAND:
+            reply("ok " + self.daemon.footprint())
+            return
+        
+        if cmd == METRICS_COMMAND:
+            reply("ok " + metrics.to_json())
+            return
+        
+        if cmd == METRICS_ON_COMMAND:
+            metrics.enable()
+            reply("ok")
+            return
+        
+        if cmd == METRICS_OFF_COMMAND:
+            metrics.disable()
+            reply("ok")
+            return
+        
+        if cmd.startswith(GROUP_ADD_COMMAND + " "):
+            service_id = cmd[len(GROUP_ADD_COMMAND) + 1:].strip()
+            if service_id == "all":
+                reply("ok %d services" % self.daemon.group.add_all())
+            elif self.daemon.group.add(service_id):
+                reply("ok")
+            else:
+                reply("error no paired service: " + service_id)
+            return
+        
+        if cmd.startswith(GROUP_REMOVE_COMMAND + " "):
+            self.daemon.group.remove(cmd[len(GROUP_REMOVE_COMMAND) + 1:].strip())
+            reply("ok")
+            return
+        
+        if cmd == GROUP_LIST_COMMAND:
+            reply("ok " + self.daemon.group.describe())
+            return
+        
+        if cmd.startswith(GROUP_COMMAND + " "):
+            method = GROUP_METHODS.get(cmd[len(GROUP_COMMAND) + 1:].strip())
+            if method is None:
+                reply("error not a group command: " + cmd)
+            else:
+                self.daemon.group.broadcast(method, reply)
+            return
+        
+        service = self.daemon.selected
+        if service is None:
+            reply("error no service selected")
+            return
+        
+        if cmd == NEXT_TRACK_COMMAND:
+            service.next_track(reply)
+            return
+        
+        if cmd == PREV_TRACK_COMMAND:
+            service.prev_track(reply)
+            return
+        
+        if cmd == PLAY_PAUSE_COMMAND:
+            service.toggle_play(reply)
+            return
+        
+        if cmd == PAUSE_COMMAND:
+            service.pause(reply)
+            return
+        
+        if cmd == QUERY_TRACK_COMMAND:
+            self.daemon.emit(TRACK_QUERIED, service)
+            reply("ok " + service.describe_status())
+            return
+        
+        if cmd == COMMAND_STATS_COMMAND:
+            reply("ok " + service.scheduler.metrics())
+            return
+        
+        if cmd.startswith(PLAY_SEARCH_COMMAND + " "):
+            service.play_search(cmd[len(PLAY_SEARCH_COMMAND) + 1:].strip(), reply)
+            return
+        
+        if cmd == SYNC_LIBRARY_COMMAND:
+            service.sync_library(reply)
+            return
+        
+        print "Error: unknown command: " + cmd
+        reply("error unknown command: " + cmd)
+
+class remote_daemon():
+    '''
+    Discovers the itunes services, pairs with them & controls the selected one.  Front
+    ends subscribe to its events & call its methods, it never touches a display itself
+    pairings - the pairing_store, loaded from gconf or the pairings file by default
+    decode_artwork - decodes the cached artwork, by default it is kept encoded
+    auto_select - select the first paired service found, for running without a front end
+    cache_dir - the directory holding the artwork cache & the library mirrors
+    '''
+    
+    def __init__(self, pairings = None, decode_artwork = raw_artwork, auto_select = False, socket_path = CONTROL_SOCKET, pipe_name = CONTROL_PIPE, cache_dir = CACHE_DIR):
+        if pairings is None:
+            pairings = pairing_store.pairing_store()
+        self.pairings = pairings
+        self.auto_select = auto_select
+        self.services = {}
+        self.subscribers = []
+        self.selected = None
+        self.pairing = None
+        self.pairing_service_id = None
+        # the browsed (interface, protocol, name, type, domain) entries: the resolver path
+        # while resolving & the service id once resolved
+        self.resolving = {}
+        self.resolved = {}
+        self.resolver_entries = {}
+        self.cache_dir = cache_dir
+        self.artwork = artwork_cache.artwork_cache(os.path.join(cache_dir, ARTWORK_CACHE_NAME), decode_artwork)
+        self.command_controller = command_controller(self, socket_path, pipe_name)
+        # the services controlled together by the group commands
+        self.group = service_group.service_group(self)
+        self.metrics_endpoint = None
+    
+    def start(self):
+        self.command_controller.start()
+        if os.environ.has_key(metrics.PORT_VARIABLE):
+            # serving the metrics implies recording them
+            metrics.enable()
+            self.metrics_endpoint = metrics.metrics_endpoint(int(os.environ[metrics.PORT_VARIABLE]))
+            try:
+                self.metrics_endpoint.start()
+            except socket.error, e:
+                print "Error: could not serve metrics on port %s: %s" % (os.environ[metrics.PORT_VARIABLE], e)
+                self.metrics_endpoint = None
+    
+    def stop(self):
+        self.cancel_pairing()
+        self.command_controller.stop()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.stop()
+            self.metrics_endpoint = None
+        for service in self.services.values():
+            if service.is_running():
+                service.stop()
+    
+    def subscribe(self, callback):
+        '''
+        Call the callback with (event, service, data) for each event from the main loop
+        '''
+        self.subscribers.append(callback)
+    
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+    
+    def emit(self, event, service, data = None):
+        for callback in list(self.subscribers):
+            try:
+                callback(event, service, data)
+            except Exception, e:
+                # a failing front end must not stop the daemon
+                print "Error: %s subscriber failed: %s" % (event, e)
+    
+    def browse(self, bus, service_type, domain):
+        '''
+        Browse avahi for the services, resolving each one as it is found
+        '''
+        import avahi, dbus
+        self.bus = bus
+        self.avahi_server = dbus.Interface(bus.get_object(avahi.DBUS_NAME, avahi.DBUS_PATH_SERVER), avahi.DBUS_INTERFACE_SERVER)
+        # the resolver signals are received once for all the resolvers & matched by path
+        bus.add_signal_receiver(self.service_resolved, "Found", avahi.DBUS_INTERFACE_SERVICE_RESOLVER, avahi.DBUS_NAME, path_keyword="path")
+        bus.add_signal_receiver(self.resolve_failed, "Failure", avahi.DBUS_INTERFACE_SERVICE_RESOLVER, avahi.DBUS_NAME, path_keyword="path")
+        browser_path = self.avahi_server.ServiceBrowserNew(avahi.IF_UNSPEC, avahi.PROTO_UNSPEC, service_type, domain, dbus.UInt32(0))
+        self.browser = dbus.Interface(bus.get_object(avahi.DBUS_NAME, browser_path), avahi.DBUS_INTERFACE_SERVICE_BROWSER)
+        self.browser.connect_to_signal('ItemNew', self.service_added)
+        self.browser.connect_to_signal('ItemRemove', self.service_removed)
+    
+    def service_added(self, interface, protocol, name, type, domain, flags):
+        '''
+        Start resolving a browsed service.  The resolver is created asynchronously & reports
+        back through its signals, so the main loop is never blocked & all the services
+        resolve concurrently
+        '''
+        import avahi, dbus
+        entry = (interface, protocol, name, type, domain)
+        if self.resolving.has_key(entry) or self.resolved.has_key(entry):
+            return
+        self.resolving[entry] = None
+        
+        def created(path):
+            if self.resolving.get(entry, True) is not None:
+                # the service was removed while the resolver was being created
+                self._free_resolver(path)
+                return
+            self.resolving[entry] = path
+            self.resolver_entries[path] = entry
+        
+        def failed(exception):
+            print "Error: could not resolve %s: %s" % (name, exception)
+            self.resolving.pop(entry, None)
+        
+        self.avahi_server.ServiceResolverNew(interface, protocol, name, type, domain, avahi.PROTO_UNSPEC, dbus.UInt32(0), reply_handler=created, error_handler=failed)
+    
+    def service_resolved(self, interface, protocol, name, type, domain, host, aprotocol, address, port, txt, flags, path = None):
+        entry = self.resolver_entries.pop(path, None)
+        if entry is None:
+            return
+        self.resolving.pop(entry, None)
+        self._free_resolver(path)
+        
+        properties = {}
+        for t in txt:
+            # convert the dbus byte arrays into strings, split into KV pairs and store in a map
+            as_string = "".join(chr(b) for b in t)
+            key_value_pair = as_string.split("=", 1)
+            if len(key_value_pair) == 2:
+                properties[key_value_pair[0]] = key_value_pair[1]
+        
+        if not properties.has_key(SERVICE_ID_PROPERTY):
+            print "Error: service %s has no %s property" % (name, SERVICE_ID_PROPERTY)
+            return
+        service_id = properties[SERVICE_ID_PROPERTY].replace("0x", "", 1)
+        self.resolved[entry] = service_id
+        import avahi
+        if aprotocol == avahi.PROTO_INET6:
+            # link local addresses are only reachable through the interface they were found on
+            resolved = (socket.AF_INET6, (str(address), int(port), 0, int(interface)))
+        else:
+            resolved = (socket.AF_INET, (str(address), int(port)))
+        # the same service is browsed once for each interface & protocol it is reachable on
+        self.add_service(service_id, str(name), str(host), int(port), resolved)
+    
+    def resolve_failed(self, error, path = None):
+        entry = self.resolver_entries.pop(path, None)
+        if entry is None:
+            return
+        self.resolving.pop(entry, None)
+        self._free_resolver(path)
+        print "Error: could not resolve %s: %s" % (entry[2], error)
+    
+    def _free_resolver(self, path):
+        import avahi, dbus
+        resolver = dbus.Interface(self.bus.get_object(avahi.DBUS_NAME, path), avahi.DBUS_INTERFACE_SERVICE_RESOLVER)
+        resolver.Free(reply_handler=lambda: None, error_handler=lambda exception: None)
+    
+    def service_removed(self, interface, protocol, name, type, domain, flags):
+        entry = (interface, protocol, name, type, domain)
+        path = self.resolving.pop(entry, None)
+        if path is not None:
+            del self.resolver_entries[path]
+            self._free_resolver(path)
+        service_id = self.resolved.pop(entry, None)
+        # the service stays while it can be reached on another interface or protocol
+        if service_id is None or service_id in self.resolved.values():
+            return
+        self.remove_service(service_id)
+    
+    def add_service(self, service_id, name, host, port, address = None):
+        '''
+        Add a resolved service, returning its service_controller.  Discovery calls this for
+        each service found with the (family, socket address) it resolved, it can also be 
+        called directly for a known host
+        '''
+        service = self.services.get(service_id)
+        if service is not None:
+            return service
+        service = service_controller(self, service_id, name, host, port, self.pairings.get(service_id), address)
+        self.services[service_id] = service
+        self.emit(SERVICE_ADDED, service)
+        if self.auto_select and self.selected is None and service.is_paired():
+            self.select(service_id)
+        return service
+    
+    def remove_service(self, service_id):
+        service = self.services.pop(service_id, None)
+        if service is None:
+            return
+        if self.selected is service:
+            self.unselect()
+        self.group.remove(service_id)
+        if service.is_running():
+            service.stop()
+        self.emit(SERVICE_REMOVED, service)
+    
+    def service_available(self, service_id):
+        '''
+        Called by the pairing_service once the service has been paired
+        '''
+        pairing_service_id = self.pairing_service_id
+        self.pairing = None
+        self.pairing_service_id = None
+        service = self.services.get(service_id)
+        if service is not None:
+            service.pairing_guid = self.pairings.get(service_id)
+            self.emit(SERVICE_PAIRED, service)
+        self.emit(PAIRING_FINISHED, self.services.get(pairing_service_id))
+        if self.auto_select and self.selected is None and service is not None:
+            self.select(service_id)
+    
+    def select(self, service_id):
+        '''
+        Make the service the one controlled by the commands, logging in to it if need be.
+        Returns false if there is no such paired service
+        '''
+        service = self.services.get(service_id)
+        if service is None or not service.is_paired():
+            return False
+        if self.selected is service:
+            return True
+        if self.selected is not None:
+            self.unselect()
+        if not service.is_running():
+            service.start()
+        self.selected = service
+        self.emit(SERVICE_SELECTED, service)
+        return True
+    
+    def unselect(self):
+        '''
+        Stop controlling the selected service, its status updates continue
+        '''
+        service = self.selected
+        if service is None:
+            return
+        self.selected = None
+        self.emit(SERVICE_UNSELECTED, service)
+    
+    def pair(self, service_id):
+        '''
+        Start pairing with a service, returning the pairing code to enter in itunes or
+        None if there is no such service.  Only one pairing runs at a time
+        '''
+        service = self.services.get(service_id)
+        if service is None:
+            return None
+        self.cancel_pairing()
+        import pairing_service
+        self.pairing = pairing_service.pairing_service(self)
+        self.pairing_service_id = service_id
+        pairing_code = self.pairing.start()
+        self.emit(PAIRING_STARTED, service, pairing_code)
+        return pairing_code
+    
+    def cancel_pairing(self):
+        if self.pairing is None:
+            return
+        self.pairing.cancel()
+        service = self.services.get(self.pairing_service_id)
+        self.pairing = None
+        self.pairing_service_id = None
+        self.emit(PAIRING_FINISHED, service)
+    
+    def describe_services(self):
+        '''
+        A single line listing each service as id name followed by its state
+        '''
+        descriptions = []
+        for service_id, service in sorted(self.services.items()):
+            state = "unpaired"
+            if service is self.selected:
+                state = "selected"
+            elif service.is_paired():
+                state = "paired"
+            descriptions.append("%s %s %s" % (service_id, service.name, state))
+        return "; ".join(descriptions)
+    
+    def footprint(self):
+        '''
+        The processor time used & memory held by the process
+        '''
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # linux reports the peak in kilobytes, the current size is read from /proc
+        description = "cpu user %.2fs system %.2fs peak rss %d kB" % (usage.ru_utime, usage.ru_stime, usage.ru_maxrss)
+        try:
+            pages = int(open("/proc/self/statm").read().split()[1])
+            description += " rss %d kB" % (pages * resource.getpagesize() / 1024)
+        except (IOError, IndexError, ValueError):
+            pass
+        return description
+
+def log_event(event, service, data):
+    '''
+    The subscriber used when running without a front end, logging each event
+    '''
+    if event == STATUS_CHANGED:
+        print "%s: %s" % (service.name, service.describe_status())
+    elif event == PAIRING_STARTED:
+        print "%s: enter pairing code %d %d %d %d in itunes" % ((service.name,) + data)
+    elif service is not None:
+        print "%s: %s" % (service.name, event)
+
+def main():
+    # this allows CTRL-C to exit the main loop
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gobject.threads_init()
+    try:
+        import dbus
+        from dbus.mainloop.glib import DBusGMainLoop
+    except ImportError:
+        print "To use itunes remote you need to install Avahi and python-dbus."
+        return 1
+    DBusGMainLoop(set_as_default=True)
+    
+    daemon = remote_daemon(auto_select=True)
+    daemon.subscribe(log_event)
+    daemon.start()
+    daemon.browse(dbus.SystemBus(), "_daap._tcp", "local")
+    gobject.MainLoop().run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
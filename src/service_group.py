@@ -0,0 +1,132 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Controls a group of libraries together, for example pausing every library in the house.
+The members are kept logged in & a command is sent to all of them at once, so a
+broadcast takes as long as the slowest member rather than the sum of them all.
+'''
+
+import gobject
+
+# how long a member has to complete a broadcast command before it is reported timed out
+BROADCAST_TIMEOUT = 2000 # milliseconds
+
+class broadcast():
+    '''
+    A command sent to every member of a group, replied to with the outcome for each member
+    once they have all completed or the timeout expires
+    members - the (service_id, send) pairs, send is called with the reply for that member
+    reply - called with the aggregated reply
+    '''
+    
+    def __init__(self, members, reply, timeout = BROADCAST_TIMEOUT):
+        self.reply = reply
+        self.order = [service_id for service_id, send in members]
+        self.results = {}
+        self.timer = None
+        if len(members) == 0:
+            self.reply("error no services in the group")
+            return
+        self.timer = gobject.timeout_add(timeout, self._timed_out)
+        for service_id, send in members:
+            self._send(service_id, send)
+    
+    def _send(self, service_id, send):
+        try:
+            send(lambda message: self._completed(service_id, message))
+        except Exception, e:
+            self._completed(service_id, "error " + str(e))
+    
+    def _completed(self, service_id, message):
+        # late replies from members that have already timed out are ignored
+        if self.timer is None or self.results.has_key(service_id):
+            return
+        self.results[service_id] = message
+        if len(self.results) == len(self.order):
+            gobject.source_remove(self.timer)
+            self._finish()
+    
+    def _timed_out(self):
+        for service_id in self.order:
+            if not self.results.has_key(service_id):
+                self.results[service_id] = "error timed out"
+        self._finish()
+        return False
+    
+    def _finish(self):
+        self.timer = None
+        succeeded = len([message for message in self.results.values() if message.startswith("ok")])
+        outcomes = "; ".join(["%s %s" % (service_id, self.results[service_id]) for service_id in self.order])
+        if succeeded == len(self.order):
+            self.reply("ok %d/%d: %s" % (succeeded, len(self.order), outcomes))
+        else:
+            self.reply("error %d/%d: %s" % (succeeded, len(self.order), outcomes))
+
+class service_group():
+    '''
+    The libraries controlled together.  Each member is logged in when it joins, so its
+    session is open when a command is broadcast
+    daemon - the remote_daemon holding the services
+    '''
+    
+    def __init__(self, daemon, timeout = BROADCAST_TIMEOUT):
+        self.daemon = daemon
+        self.timeout = timeout
+        self.members = []
+    
+    def add(self, service_id):
+        '''
+        Add a paired service to the group, returning false if there is no such service
+        '''
+        service = self.daemon.services.get(service_id)
+        if service is None or not service.is_paired():
+            return False
+        if service_id not in self.members:
+            self.members.append(service_id)
+        if not service.is_running():
+            service.start()
+        return True
+    
+    def add_all(self):
+        '''
+        Add every paired service, returning the number in the group
+        '''
+        for service_id, service in sorted(self.daemon.services.items()):
+            if service.is_paired():
+                self.add(service_id)
+        return len(self.members)
+    
+    def remove(self, service_id):
+        if service_id in self.members:
+            self.members.remove(service_id)
+    
+    def describe(self):
+        return " ".join(self.members)
+    
+    def broadcast(self, method, reply):
+        '''
+        Call the named service_controller method, which takes a reply, on every member
+        '''
+        members = []
+        for service_id in list(self.members):
+            service = self.daemon.services.get(service_id)
+            if service is None:
+                # the service has gone away since it was added
+                self.members.remove(service_id)
+                continue
+            members.append((service_id, getattr(service, method)))
+        return broadcast(members, reply, self.timeout)
@@ -0,0 +1,64 @@
+'''
+   Copyright 2010 Jacob Pezaro
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+'''
+Tracks the play status reported by the itunes status updates, so that only the fields 
+which have changed need to be acted on.
+'''
+
+PLAY_STATUS_CHANGED = "play-status-changed"
+TRACK_CHANGED = "track-changed"
+SHUFFLE_CHANGED = "shuffle-changed"
+REPEAT_CHANGED = "repeat-changed"
+
+# the status element fields held by the model: tag, attribute & the event raised when it changes
+STATUS_FIELDS = (
+    ("caps", "play_status", PLAY_STATUS_CHANGED),
+    ("cann", "track", TRACK_CHANGED),
+    ("cana", "artist", TRACK_CHANGED),
+    ("canl", "album", TRACK_CHANGED),
+    ("asai", "album_id", TRACK_CHANGED),
+    ("canp", "now_playing", TRACK_CHANGED),
+    ("cash", "shuffle", SHUFFLE_CHANGED),
+    ("carp", "repeat", REPEAT_CHANGED) )
+
+class status_model():
+    '''
+    The latest known value of each status field, a field missing from the status is None
+    '''
+    
+    def __init__(self):
+        for tag, attribute, event in STATUS_FIELDS:
+            setattr(self, attribute, None)
+        self.revision = None
+        
+    def update(self, status):
+        '''
+        Apply a cmst status element, returning the list of change events.  The list is 
+        empty when only the revision has changed
+        '''
+        changes = []
+        for tag, attribute, event in STATUS_FIELDS:
+            try:
+                value = status.assert_child(tag).content
+            except AssertionError:
+                value = None
+            if value != getattr(self, attribute):
+                setattr(self, attribute, value)
+                if event not in changes:
+                    changes.append(event)
+        self.revision = status.assert_child("cmsr").content
+        return changes